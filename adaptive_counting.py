@@ -0,0 +1,182 @@
+"""
+Adaptive counting: count until the detector has enough counts rather than for a fixed time, current or frames
+"""
+from .alarm_monitor import raise_if_alarm_signalled
+from .genie_backend import g, monotonic, sleep as backend_sleep
+
+# Time in seconds between reads of the detector counts
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class TotalCountReader(object):
+    """
+    Reads the total counts for the current run from the DAE
+    """
+    def counts(self):
+        """
+        Returns: total detector counts in the current run
+        """
+        return g.get_totalcounts()
+
+    def __repr__(self):
+        return "total counts"
+
+
+class SpectraCountReader(object):
+    """
+    Reads the counts in a set of spectra, e.g. the reflected beam region of the detector, from the DAE
+    """
+    def __init__(self, spectra, t_min=None, t_max=None, period=None):
+        """
+        Initialiser.
+        Args:
+            spectra: spectrum numbers to sum
+            t_min: lower time of flight limit to integrate from; None for the start of the spectrum
+            t_max: upper time of flight limit to integrate to; None for the end of the spectrum
+            period: period to read; None for the period the DAE is counting into when the counts are read, so a
+                count into a later period of a multi-period run reads that period
+        """
+        self.spectra = list(spectra)
+        self.t_min = t_min
+        self.t_max = t_max
+        self.period = period
+
+    def counts(self):
+        """
+        Returns: sum of the counts in the spectra
+        """
+        period = self.period if self.period is not None else g.get_period()
+        return sum(g.integrate_spectrum(spectrum, period, self.t_min, self.t_max) for spectrum in self.spectra)
+
+    def __repr__(self):
+        return "counts in spectra {}".format(self.spectra)
+
+
+class FakeCountReader(object):
+    """
+    Stand in for a detector which counts at a constant rate while the run is counting, for testing with a simulated
+    DAE. The counts start from zero in each new run and, between reads, only go up while the run is counting, so time
+    spent moving or paused is not counted.
+    """
+    def __init__(self, rate, clock=None):
+        """
+        Initialiser.
+        Args:
+            rate: counts per second
+            clock: function returning the current time in seconds; None for the genie backend's clock
+        """
+        self.rate = rate
+        self.clock = clock if clock is not None else monotonic
+        self._run = None
+        self._counts = 0.0
+        self._running_since = None
+
+    def counts(self):
+        """
+        Returns: counts in the current run
+        """
+        now = self.clock()
+        run, run_state = g.get_runnumber(), g.get_runstate()
+        if run != self._run or run_state == "SETUP":
+            self._run = run
+            self._counts = 0.0
+        elif self._running_since is not None:
+            self._counts += self.rate * (now - self._running_since)
+        self._running_since = now if run_state == "RUNNING" else None
+        return self._counts
+
+    def __repr__(self):
+        return "fake counts at {}/s".format(self.rate)
+
+
+class CountTarget(object):
+    """
+    Statistics to count until; the count ends when either the total counts or the relative error is reached, but never
+    before the minimum time or after the maximum time
+    """
+    def __init__(self, total_counts=None, relative_error=None, min_seconds=0.0, max_seconds=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, reader=None):
+        """
+        Initialiser.
+        Args:
+            total_counts: counts to stop at; None for no count target
+            relative_error: relative (Poisson) error on the total counts to stop at, e.g. 0.01 for 1%; None for no
+                error target
+            min_seconds: minimum time to count for
+            max_seconds: maximum time to count for; None for no limit
+            poll_interval: time in seconds between reads of the counts
+            reader: object with a counts() method to read the counts from; None for the total counts from the DAE
+        """
+        if total_counts is None and relative_error is None and max_seconds is None:
+            raise ValueError("A count target needs a total count, relative error or maximum time")
+        self.total_counts = total_counts
+        self.relative_error = relative_error
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.poll_interval = poll_interval
+        self.reader = reader if reader is not None else TotalCountReader()
+
+    def required_counts(self):
+        """
+        Returns: counts needed to reach the target statistics; None if there is no count or error target
+        """
+        required = []
+        if self.total_counts is not None:
+            required.append(self.total_counts)
+        if self.relative_error is not None:
+            required.append(1.0 / self.relative_error ** 2)  # Poisson error on N counts is sqrt(N)
+        return min(required) if required else None
+
+    def is_reached(self, counts, elapsed):
+        """
+        Args:
+            counts: counts so far
+            elapsed: time counted for so far in seconds
+
+        Returns: True if counting should stop
+        """
+        if elapsed < self.min_seconds:
+            return False
+        if self.max_seconds is not None and elapsed >= self.max_seconds:
+            return True
+        required = self.required_counts()
+        return required is not None and counts >= required
+
+    def estimated_seconds(self):
+        """
+        Returns: time allowed for in estimates; the maximum time if given, otherwise the minimum time
+        """
+        return float(self.max_seconds if self.max_seconds is not None else self.min_seconds)
+
+    def __repr__(self):
+        return "counts={}, relative_error={}, min {} s, max {} s, reading {}".format(
+            self.total_counts, self.relative_error, self.min_seconds, self.max_seconds, self.reader)
+
+
+def count_until(target, clock=None, sleep=None):
+    """
+    Poll the counts until the target is reached; the run must already be counting. Counts are measured from when this
+    is called, so a count can continue a run, e.g. in a later period.
+    Args:
+        target (CountTarget): the target to reach
+        clock: function returning the current time in seconds; None for the genie backend's clock
+        sleep: function which waits for a number of seconds; None for the genie backend's sleep
+
+    Returns: counts and time in seconds when the count stopped
+    Raises:
+        techniques.reflectometry.alarm_monitor.BlockInAlarmError: if the alarm monitor signals an alarm in RAISE mode
+    """
+    clock = clock if clock is not None else monotonic
+    sleep = sleep if sleep is not None else backend_sleep
+    start = clock()
+    initial_counts = target.reader.counts()
+    while True:
+        elapsed = clock() - start
+        counts = target.reader.counts() - initial_counts
+        if target.is_reached(counts, elapsed):
+            return counts, elapsed
+        raise_if_alarm_signalled()
+        wait = target.poll_interval
+        if target.max_seconds is not None:
+            wait = min(wait, max(target.max_seconds - elapsed, 0.0))
+        sleep(wait)
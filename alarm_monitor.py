@@ -0,0 +1,401 @@
+"""
+Background monitor of the alarm state of the blocks a script moves, so that a block going into alarm pauses the run or
+stops the script straight away rather than being found after a wasted count
+"""
+import sys
+import threading
+from contextlib import contextmanager
+
+from .genie_backend import g, monotonic, sleep as backend_sleep
+
+PAUSE = "pause"  # pause the run while a block is in alarm and resume it when the alarm clears
+RAISE = "raise"  # pause the run and raise BlockInAlarmError in the script
+MODES = (PAUSE, RAISE)
+
+MINOR = "MINOR"
+MAJOR = "MAJOR"
+INVALID = "INVALID"
+SEVERITIES = (MINOR, MAJOR, INVALID)  # in the order check_alarms returns them
+
+# Time in seconds between polls of the alarm state
+DEFAULT_ALARM_POLL_INTERVAL = 0.5
+
+
+class BlockInAlarmError(RuntimeError):
+    """
+    A block the script moved went into alarm
+    """
+    def __init__(self, alarms):
+        """
+        Initialiser.
+        Args:
+            alarms: dictionary of block name to alarm severity
+        """
+        super(BlockInAlarmError, self).__init__("Blocks in alarm: {}".format(
+            ", ".join("{} ({})".format(block, severity) for block, severity in sorted(alarms.items()))))
+        self.alarms = dict(alarms)
+
+
+class GenieAlarmSource(object):
+    """
+    Reads the alarm state of blocks with genie
+    """
+    def alarms(self, blocks):
+        """
+        Args:
+            blocks: names of the blocks to check
+
+        Returns: dictionary of the name of each block in alarm to its severity
+        """
+        alarms = {}
+        for severity, alarm_list in zip(SEVERITIES, g.check_alarms(*blocks)):
+            for block in alarm_list:
+                alarms[block] = severity
+        return alarms
+
+    def __repr__(self):
+        return "genie alarms"
+
+
+class FakeAlarmSource(object):
+    """
+    Stand in for the instrument's alarms which are set by hand, for testing without an instrument
+    """
+    def __init__(self):
+        self._alarms = {}
+        self._lock = threading.Lock()
+
+    def set_alarm(self, block, severity=MAJOR):
+        """
+        Put a block into alarm
+        Args:
+            block: block name
+            severity: alarm severity
+        """
+        with self._lock:
+            self._alarms[block] = severity
+
+    def clear_alarm(self, block):
+        """
+        Take a block out of alarm
+        Args:
+            block: block name
+        """
+        with self._lock:
+            self._alarms.pop(block, None)
+
+    def alarms(self, blocks):
+        """
+        Args:
+            blocks: names of the blocks to check
+
+        Returns: dictionary of the name of each block in alarm to its severity
+        """
+        with self._lock:
+            return {block: severity for block, severity in self._alarms.items() if block in blocks}
+
+    def __repr__(self):
+        return "fake alarms {}".format(self._alarms)
+
+
+class AlarmMonitor(object):
+    """
+    Thread which polls the alarm state of the watched blocks. Blocks are watched from when the script first sets them
+    until the monitor is stopped. When a watched block goes into alarm the run is paused; in RAISE mode an alarm is
+    signalled as well, which stops the count the script is waiting for with a BlockInAlarmError. Before a run begins or
+    resumes the alarms are checked again, so a block still in alarm from a move is not counted with.
+    """
+    def __init__(self, mode=PAUSE, blocks=(), severities=(MAJOR, INVALID), poll_interval=DEFAULT_ALARM_POLL_INTERVAL,
+                 source=None, dae=None):
+        """
+        Initialiser.
+        Args:
+            mode: PAUSE or RAISE
+            blocks: blocks to watch from the start, as well as those the script sets
+            severities: alarm severities which count as being in alarm
+            poll_interval: time in seconds between polls
+            source: object with an alarms(blocks) method to read alarms from; None to read them with genie
+            dae: object with get_runstate, get_runnumber, get_period, pause and resume methods to control the run; None
+                for genie
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown alarm monitor mode {}, should be one of {}".format(mode, MODES))
+        self.mode = mode
+        self.severities = tuple(severities)
+        self.poll_interval = poll_interval
+        self.source = source if source is not None else GenieAlarmSource()
+        self.dae = dae if dae is not None else g
+        self.alarms = {}
+        self.paused_run = False
+        self._paused_at = None  # run number and period the monitor paused
+        self._blocks = set(blocks)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._alarm_signalled = threading.Event()
+        self._thread = None
+
+    def watch(self, block):
+        """
+        Start watching a block
+        Args:
+            block: block name
+        """
+        with self._lock:
+            self._blocks.add(block)
+
+    def watched_blocks(self):
+        """
+        Returns: the blocks being watched
+        """
+        with self._lock:
+            return sorted(self._blocks)
+
+    def start(self):
+        """
+        Start polling in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll_loop, name="alarm monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop polling and wait for the thread to finish
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def current_alarms(self):
+        """
+        Read the alarms of the watched blocks without acting on them
+
+        Returns: dictionary of watched block in alarm to its severity
+        """
+        blocks = self.watched_blocks()
+        if not blocks:
+            return {}
+        return {block: severity for block, severity in self.source.alarms(blocks).items()
+                if severity in self.severities}
+
+    def poll(self):
+        """
+        Check the alarms of the watched blocks once and act on any change
+
+        Returns: dictionary of watched block in alarm to its severity
+        """
+        alarms = self.current_alarms()
+        with self._lock:
+            new_alarms = {block: severity for block, severity in alarms.items() if block not in self.alarms}
+            self.alarms = alarms
+        if new_alarms:
+            self._on_alarm(new_alarms)
+        elif not alarms and self.paused_run:
+            if self.mode == PAUSE and self._owns_pause():
+                print("Alarms cleared, resuming run")
+                self.dae.resume()
+            self.paused_run = False
+        return alarms
+
+    def release_run(self):
+        """
+        Leave a run the monitor has paused to the script, e.g. because the script pauses it between periods itself;
+        the monitor will not resume it when the alarms clear
+        """
+        self.paused_run = False
+
+    def _owns_pause(self):
+        """
+        Returns: True if the run is still paused in the run and period the monitor paused; the script may have ended
+            the run or moved to another period since
+        """
+        paused_at = (self.dae.get_runnumber(), self.dae.get_period())
+        return self.dae.get_runstate() == "PAUSED" and self._paused_at == paused_at
+
+    def raise_if_alarmed(self):
+        """
+        Raises:
+            BlockInAlarmError: if a watched block is in alarm
+        """
+        with self._lock:
+            alarms = dict(self.alarms)
+        if alarms:
+            self._alarm_signalled.clear()
+            raise BlockInAlarmError(alarms)
+
+    def raise_if_signalled(self):
+        """
+        Called by a script while it waits for a count
+        Raises:
+            BlockInAlarmError: if an alarm has been signalled in RAISE mode since the last error was raised
+        """
+        if self._alarm_signalled.is_set():
+            self._alarm_signalled.clear()
+            with self._lock:
+                alarms = dict(self.alarms)
+            raise BlockInAlarmError(alarms)
+
+    def check_before_counting(self):
+        """
+        Read the alarms of the watched blocks before a run begins or resumes. In PAUSE mode wait until they have
+        cleared; blocks which went into alarm during a move would otherwise be counted with.
+        Raises:
+            BlockInAlarmError: in RAISE mode, if a watched block is in alarm
+        """
+        alarms = self.current_alarms()
+        if not alarms:
+            return
+        if self.mode == RAISE:
+            raise BlockInAlarmError(alarms)
+        sys.stderr.write("{}, waiting for them to clear before counting\n".format(BlockInAlarmError(alarms)))
+        while alarms:
+            backend_sleep(self.poll_interval)
+            alarms = self.current_alarms()
+        print("Alarms cleared, counting")
+
+    def _on_alarm(self, new_alarms):
+        sys.stderr.write("{}\n".format(BlockInAlarmError(new_alarms)))
+        if not self.paused_run and self.dae.get_runstate() == "RUNNING":
+            self.dae.pause()
+            self.paused_run = True
+            self._paused_at = (self.dae.get_runnumber(), self.dae.get_period())
+        if self.mode == RAISE:
+            self._alarm_signalled.set()
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                sys.stderr.write("Alarm monitor could not read alarms: {}\n".format(e))
+            self._stop.wait(self.poll_interval)
+
+    def __repr__(self):
+        return "Alarm monitor: mode={}, blocks={}, alarms={}, source={}".format(
+            self.mode, self.watched_blocks(), self.alarms, self.source)
+
+
+_ALARM_MONITOR = None
+
+
+def start_alarm_monitor(mode=PAUSE, blocks=(), **kwargs):
+    """
+    Start monitoring the alarms of the blocks the script sets; the monitor runs until stop_alarm_monitor is called.
+    Args:
+        mode: PAUSE to pause the run while a block is in alarm, and to wait for alarms to clear before counting;
+            RAISE to also stop the script with a BlockInAlarmError
+        blocks: blocks to watch from the start, as well as those the script sets
+        kwargs: other arguments for AlarmMonitor
+
+    Returns:
+        AlarmMonitor: the monitor
+    """
+    global _ALARM_MONITOR
+    stop_alarm_monitor()
+    _ALARM_MONITOR = AlarmMonitor(mode, blocks, **kwargs)
+    _ALARM_MONITOR.start()
+    return _ALARM_MONITOR
+
+
+def stop_alarm_monitor():
+    """
+    Stop monitoring alarms
+    """
+    global _ALARM_MONITOR
+    if _ALARM_MONITOR is not None:
+        _ALARM_MONITOR.stop()
+        _ALARM_MONITOR = None
+
+
+def get_alarm_monitor():
+    """
+    Returns:
+        AlarmMonitor: the running monitor; None if alarms are not being monitored
+    """
+    return _ALARM_MONITOR
+
+
+@contextmanager
+def alarm_guard():
+    """
+    In RAISE mode, raise a BlockInAlarmError if a block is in alarm when the context exits
+    """
+    yield
+    monitor = get_alarm_monitor()
+    if monitor is not None and monitor.mode == RAISE:
+        monitor.raise_if_alarmed()
+
+
+def check_alarms_before_counting():
+    """
+    Check the alarms of the watched blocks before a run begins or resumes, see AlarmMonitor.check_before_counting; does
+    nothing if alarms are not being monitored
+    """
+    monitor = get_alarm_monitor()
+    if monitor is not None:
+        monitor.check_before_counting()
+
+
+def raise_if_alarm_signalled():
+    """
+    Raise a BlockInAlarmError if the monitor has signalled an alarm in RAISE mode; does nothing if alarms are not being
+    monitored
+    """
+    monitor = get_alarm_monitor()
+    if monitor is not None:
+        monitor.raise_if_signalled()
+
+
+def release_paused_run():
+    """
+    Leave a run the monitor has paused to the script, see AlarmMonitor.release_run; does nothing if alarms are not
+    being monitored
+    """
+    monitor = get_alarm_monitor()
+    if monitor is not None:
+        monitor.release_run()
+
+
+def wait_for_count(uamps=None, seconds=None, frames=None):
+    """
+    Wait while the run counts until it reaches the uamps or frames, or for the seconds, as the genie waitfor functions
+    do. With an alarm monitor in RAISE mode the counts are polled instead, so that the wait stops as soon as an alarm
+    is signalled.
+    Args:
+        uamps: uamps in the run to wait for; None to wait in a different way
+        seconds: seconds to wait for; None to wait in a different way
+        frames: frames in the run to wait for; None to wait in a different way
+    Raises:
+        BlockInAlarmError: if an alarm is signalled in RAISE mode while waiting
+    """
+    monitor = get_alarm_monitor()
+    if monitor is None or monitor.mode != RAISE:
+        if uamps is not None:
+            g.waitfor_uamps(uamps)
+        elif seconds is not None:
+            g.waitfor_time(seconds=seconds)
+        elif frames is not None:
+            g.waitfor_frames(frames)
+        return
+
+    if uamps is not None:
+        def _counted():
+            return g.get_uamps() >= uamps
+    elif seconds is not None:
+        end = monotonic() + seconds
+
+        def _counted():
+            return monotonic() >= end
+    else:
+        def _counted():
+            return frames is None or g.get_frames() >= frames
+    while not _counted():
+        monitor.raise_if_signalled()
+        if seconds is None:
+            backend_sleep(monitor.poll_interval)
+        else:
+            backend_sleep(min(monitor.poll_interval, max(0.0, end - monotonic())))
+    monitor.raise_if_signalled()
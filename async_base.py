@@ -0,0 +1,154 @@
+"""
+Asyncio versions of run_angle, transmission and the movement API. Blocking genie calls are run in a single worker
+thread, so they happen one at a time and in order, while the event loop is free to prepare the next step, poll alarms
+or read constants during moves and counts.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import _Movement, run_angle, transmission
+from .instrument_constants import get_instrument_constants
+from .tracing import TRACER
+
+# Worker which makes all the blocking genie calls for moves and counts
+GENIE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="genie")
+
+
+async def _run_blocking(executor, function, *args, **kwargs):
+    """
+    Run a blocking function in an executor and wait for it without blocking the event loop
+    Args:
+        executor: executor to run the function in; None for the genie executor
+        function: function to run
+        args: arguments for the function
+        kwargs: keyword arguments for the function
+
+    Returns: the function's return value
+    """
+    loop = asyncio.get_event_loop()
+    executor = executor if executor is not None else GENIE_EXECUTOR
+    return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+
+class AsyncMovement(object):
+    """
+    Awaitable version of _Movement: each public method of _Movement is a coroutine here which runs the method in the
+    genie executor, e.g. await movement.set_theta(0.7) or await movement.count_for(5, None, None).
+    Attributes such as dry_run and setpoints are those of the wrapped movement.
+    """
+    def __init__(self, dry_run=False, skip_unchanged=False, movement=None, executor=None):
+        """
+        Initialiser.
+        Args:
+            dry_run: True to just print what would happen
+            skip_unchanged: True to skip moves to where a block already is
+            movement (techniques.reflectometry.base._Movement): movement to wrap; None to create one
+            executor: executor the blocking calls are made in; None for the genie executor
+        """
+        self.movement = movement if movement is not None else _Movement(dry_run, skip_unchanged)
+        self.executor = executor
+
+    def __getattr__(self, name):
+        attribute = getattr(self.movement, name)
+        if name.startswith("_") or name == "move_plan" or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def _awaitable(*args, **kwargs):
+            return await _run_blocking(self.executor, attribute, *args, **kwargs)
+        return _awaitable
+
+    def __repr__(self):
+        return "Async movement: {}".format(self.movement)
+
+
+async def run_angle_async(sample, angle, executor=None, **kwargs):
+    """
+    Awaitable run_angle; the angle is run in the genie executor so the event loop can do other work while it moves
+    and counts.
+    Args:
+        sample (techniques.reflectometry.sample.Sample): The sample to measure
+        angle: The angle to measure at
+        executor: executor to run in; None for the genie executor
+        kwargs: other arguments as for run_angle
+
+    Examples:
+        >>> await asyncio.gather(run_angle_async(sample_1, 0.7, count_uamps=5), poll_something())
+    """
+    return await _run_blocking(executor, run_angle, sample, angle, **kwargs)
+
+
+async def transmission_async(sample, title, s1vg, s2vg, executor=None, **kwargs):
+    """
+    Awaitable transmission; the transmission is run in the genie executor so the event loop can do other work while
+    it moves and counts.
+    Args:
+        sample (techniques.reflectometry.sample.Sample): The sample to measure
+        title: Title to set
+        s1vg: slit 1 vertical gap
+        s2vg: slit 2 vertical gap
+        executor: executor to run in; None for the genie executor
+        kwargs: other arguments as for transmission
+    """
+    return await _run_blocking(executor, transmission, sample, title, s1vg, s2vg, **kwargs)
+
+
+async def get_instrument_constants_async(force_refresh=False):
+    """
+    Read the instrument constants in a thread of the default executor, so that the read can happen while the genie
+    executor is moving or counting.
+    Args:
+        force_refresh: True to re-read the constants from the REFL server even if they are cached
+
+    Returns: the instrument constants
+    """
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(get_instrument_constants, force_refresh))
+
+
+async def run_plan_async(plan, dry_run=False, prepare=None):
+    """
+    Run all the steps in a scan plan, preparing each step while the step before it moves and counts. Preparing a step
+    reads the instrument constants (which re-reads them from the REFL server only if the cached ones have expired)
+    and then awaits prepare, if given. The constants are read again once a step which sets the mode has finished, as
+    changing the mode invalidates them.
+    Args:
+        plan (techniques.reflectometry.scan_plan.ScanPlan): the plan to run
+        dry_run: If True just print what would happen; If False, run the plan
+        prepare: coroutine function called with the next step, e.g. to check it, while the current step runs; None
+            for no extra preparation
+
+    Examples:
+        >>> asyncio.get_event_loop().run_until_complete(run_plan_async(plan))
+    """
+    movement = AsyncMovement(dry_run, skip_unchanged=True)
+    await movement.dry_run_warning()
+    constants = await get_instrument_constants_async()
+    await movement.seed_setpoints()
+    await movement.change_to_soft_period_count()
+
+    async def _prepare(step):
+        step_constants = await get_instrument_constants_async()
+        if prepare is not None:
+            await prepare(step)
+        return step_constants
+
+    for index, step in enumerate(plan.steps):
+        print("** Step {} of {}: {} **".format(index + 1, len(plan.steps), step.describe()))
+        running = _run_blocking(movement.executor, _execute_step, step, movement.movement, constants)
+        if index + 1 < len(plan.steps):
+            _, constants = await asyncio.gather(running, _prepare(plan.steps[index + 1]))
+            if step.mode is not None:
+                constants = await get_instrument_constants_async()  # the mode may have changed after they were read
+        else:
+            await running
+    print(movement.movement.move_statistics())
+
+
+def _execute_step(step, movement, constants):
+    """
+    Execute a plan step as a traced step
+    """
+    with TRACER.step(step.describe()):
+        step.execute(movement, constants)
@@ -2,23 +2,65 @@
 Base routine for reflectometry techniques
 """
 import sys
-from collections import OrderedDict
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 from future.moves import itertools
 from math import tan, radians, sin
 
+import numpy as np
 from six.moves import input
-from genie_python import genie as g
 
-import general.utilities.io
+from .adaptive_counting import count_until
+from .alarm_monitor import alarm_guard, check_alarms_before_counting, get_alarm_monitor, wait_for_count
+from .block_snapshot import BlockSnapshot, GAP_BLOCKS, HORIZONTAL_GAP_BLOCKS, VERTICAL_GAP_BLOCKS
+from .genie_backend import g, sleep as backend_sleep
 from .sample import Sample
-from .instrument_constants import get_instrument_constants
+from .setpoint_limits import SetpointLimitError, setpoint_problems
+from .instrument_constants import get_instrument_constants, invalidate_instrument_constants
+from .move_time import get_move_time_model, format_seconds
+from .slit_gaps import calculate_slit_gaps_for_angles, slit_gaps_table
+from .tracing import TRACER, traced_methods
+
+# Blocks which must have finished moving before the given block is moved when a move plan is dispatched. MODE is
+# always set and waited for before any other block in a plan.
+MOVE_DEPENDENCIES = {
+    "HEIGHT": ("TRANS",),  # translation can cause some drift in height so it is moved first
+    "HEIGHT2": ("TRANS",),
+}
+
+# How close, in block units, a block must be to a setpoint for a move to it to be skipped as unchanged
+MOVE_TOLERANCES = {
+    "TRANS": 0.001,
+    "THETA": 0.0001,
+    "PHI": 0.0001,
+    "PSI": 0.0001,
+    "HEIGHT": 0.001,
+    "HEIGHT2": 0.001,
+    "SM2ANGLE": 0.0001,
+}
+for _slit in [1, 2, 3, 4]:
+    MOVE_TOLERANCES["S{}VG".format(_slit)] = 0.001
+    MOVE_TOLERANCES["S{}HG".format(_slit)] = 0.001
+
+# Tolerance for numeric blocks not in MOVE_TOLERANCES; non-numeric blocks such as MODE must match exactly
+DEFAULT_MOVE_TOLERANCE = 1e-6
+
+# Default time in seconds between laser offset reads when averaging them for auto height
+AUTO_HEIGHT_AVERAGE_INTERVAL = 0.1
+
+AutoHeightResult = namedtuple("AutoHeightResult", ["converged", "iterations", "residual", "seconds"])
+
+# Blocks read in one go to seed a movement's setpoints so that moves to where a block already is are skipped
+SEED_BLOCKS = ("MODE", "TRANS", "THETA", "PHI", "PSI", "HEIGHT", "HEIGHT2", "SM2ANGLE", "SM2INBEAM") + GAP_BLOCKS
 
 
 def run_angle(sample, angle, count_uamps=None, count_seconds=None, count_frames=None, s1vg=None, s2vg=None, s3vg=None,
               s4vg=None, smangle=None, mode=None, do_auto_height=False, laser_offset_block=None, fine_height_block=None,
-              auto_height_target=0.0, continue_on_error=False, dry_run=False, include_gaps_in_title=True):
+              auto_height_target=0.0, continue_on_error=False, dry_run=False, include_gaps_in_title=True,
+              auto_height_tolerance=None, auto_height_max_iterations=1, auto_height_average_over=1, count_target=None):
     """
     Move to a given theta and smangle with slits set. If a current, time or frame count are given then take a
     measurement.
@@ -42,6 +84,12 @@ def run_angle(sample, angle, count_uamps=None, count_seconds=None, count_frames=
         continue_on_error: If True, continue script on error; If False, interrupt and prompt the user on error
         dry_run: If True just print what would happen; If False, run the experiment
         include_gaps_in_title: Whether current slit gap sizes should be appended to the run title or not
+        auto_height_tolerance: Tolerance on the laser offset for auto height to converge to; None for a single
+            correction
+        auto_height_max_iterations: Maximum number of auto height corrections
+        auto_height_average_over: Number of laser offset reads averaged for each auto height correction
+        count_target (techniques.reflectometry.adaptive_counting.CountTarget): statistics to count until; if given
+            this is used instead of count_uamps, count_seconds and count_frames
 
     Examples:
         The simplest scan is:
@@ -65,50 +113,82 @@ def run_angle(sample, angle, count_uamps=None, count_seconds=None, count_frames=
 
     print("** Run angle {} **".format(sample.title))
 
-    movement = _Movement(dry_run)
-
-    movement.dry_run_warning()
-    constants = get_instrument_constants()
-    movement.change_to_soft_period_count()
-    movement.set_translation(sample.translation)  # Move this first before the heights as this can cause some drift.
-    mode = movement.change_to_mode_if_not_none(mode)
+    with TRACER.step("Run angle {} th={}".format(sample.title, angle)), alarm_guard():
+        movement = _Movement(dry_run, skip_unchanged=True, check_limits=True)
+
+        movement.dry_run_warning()
+        constants = get_instrument_constants()
+        movement.seed_setpoints()
+        movement.change_to_soft_period_count()
+        _run_angle(movement, constants, sample, angle, count_uamps=count_uamps, count_seconds=count_seconds,
+                   count_frames=count_frames, s1vg=s1vg, s2vg=s2vg, s3vg=s3vg, s4vg=s4vg, smangle=smangle, mode=mode,
+                   do_auto_height=do_auto_height, laser_offset_block=laser_offset_block,
+                   fine_height_block=fine_height_block, auto_height_target=auto_height_target,
+                   continue_on_error=continue_on_error, include_gaps_in_title=include_gaps_in_title,
+                   auto_height_tolerance=auto_height_tolerance,
+                   auto_height_max_iterations=auto_height_max_iterations,
+                   auto_height_average_over=auto_height_average_over, count_target=count_target)
+    if dry_run:
+        _print_time_estimate(movement, count_uamps, count_seconds, count_frames, count_target)
+
+
+def _run_angle(movement, constants, sample, angle, count_uamps=None, count_seconds=None, count_frames=None, s1vg=None,
+               s2vg=None, s3vg=None, s4vg=None, smangle=None, mode=None, do_auto_height=False,
+               laser_offset_block=None, fine_height_block=None, auto_height_target=0.0, continue_on_error=False,
+               include_gaps_in_title=True, auto_height_tolerance=None, auto_height_max_iterations=1,
+               auto_height_average_over=1, count_target=None):
+    """
+    Move to a given theta and measure using an existing movement and constants; see run_angle for the arguments.
+    Args:
+        movement (_Movement): object that does movement required (or prints message for a dry run)
+        constants: instrument constants
+    """
+    movement.constants = constants
+    with movement.move_plan():
+        movement.set_translation(sample.translation)  # Moved before the heights as this can cause some drift.
+        mode = movement.change_to_mode_if_not_none(mode)
+
+        print("Mode {}".format(mode))
+
+        if mode == "LIQUID":
+            # In liquid the sample is tilted by the incoming beam angle so that it is level, this is accounted for by
+            # adjusting the super mirror
+            smangle = (constants.incoming_beam_angle - angle)/2
+            movement.set_smangle_if_not_none(smangle)
+        else:
+            # assume angle sample can be set, if there is a sm angle then set the sample to include this bounce
+            movement.set_smangle_if_not_none(smangle)
+            sm_reflection = smangle * 2.0 if smangle is not None else 0
+            movement.set_phi_psi(sm_reflection + angle + sample.phi_offset, 0 + sample.psi_offset)
 
-    print("Mode {}".format(mode))
+        movement.set_height2_offset(sample.height2_offset, constants)
+        movement.set_theta(angle)
 
-    if mode == "LIQUID":
-        # In liquid the sample is tilted by the incoming beam angle so that it is level, this is accounted for by
-        # adjusting the super mirror
-        smangle = (constants.incoming_beam_angle - angle)/2
-        movement.set_smangle_if_not_none(smangle)
-    else:
-        # assume angle sample can be set, if there is a sm angle then set the sample to include this bounce
-        movement.set_smangle_if_not_none(smangle)
-        sm_reflection = smangle * 2.0 if smangle is not None else 0
-        movement.set_phi_psi(sm_reflection + angle + sample.phi_offset, 0 + sample.psi_offset)
+        if not do_auto_height:
+            movement.set_height_offset(sample.height)
 
-    movement.set_height2_offset(sample.height2_offset, constants)
-    movement.set_theta(angle)
+        movement.set_slit_gaps(angle, constants, s1vg, s2vg, s3vg, s4vg, sample)
 
-    if not do_auto_height:
-        movement.set_height_offset(sample.height)
-    else:
+    if do_auto_height:
+        movement.wait_for_move()  # the laser can only read the offset once the sample is in position
         auto_height(laser_offset_block, fine_height_block, target=auto_height_target,
-                    continue_if_nan=continue_on_error, dry_run=dry_run)
+                    continue_if_nan=continue_on_error, dry_run=movement.dry_run, tolerance=auto_height_tolerance,
+                    max_iterations=auto_height_max_iterations, average_over=auto_height_average_over,
+                    movement=movement)
 
-    movement.set_slit_gaps(angle, constants, s1vg, s2vg, s3vg, s4vg, sample)
     movement.wait_for_move()
     movement.update_title(sample.title, sample.subtitle, angle, smangle, add_current_gaps=include_gaps_in_title)
 
     # count
-    if count_seconds is None and count_uamps is None and count_frames is None:
+    if count_seconds is None and count_uamps is None and count_frames is None and count_target is None:
         print("Setup only no measurement")
     else:
-        movement.count_for(count_uamps, count_seconds, count_frames)
+        movement.count_for(count_uamps, count_seconds, count_frames, count_target)
 
 
 def transmission(sample, title, s1vg, s2vg, s3vg=None, s4vg=None, count_seconds=None, count_uamps=None,
                  count_frames=None, s1hg=None, s2hg=None, s3hg=None, s4hg=None, height_offset=5, smangle=None,
-                 mode=None, dry_run=False, include_gaps_in_title=True):
+                 mode=None, dry_run=False, include_gaps_in_title=True, count_target=None):
     """
     Perform a transmission
     Args:
@@ -130,6 +210,8 @@ def transmission(sample, title, s1vg, s2vg, s3vg=None, s4vg=None, count_seconds=
         mode: mode to run in; None don't change mode
         dry_run: If True just print what would happen; If False, run the transmission
         include_gaps_in_title: Whether current slit gap sizes should be appended to the run title or not
+        count_target (techniques.reflectometry.adaptive_counting.CountTarget): statistics to count until; if given
+            this is used instead of count_uamps, count_seconds and count_frames
 
     Examples:
         The simplest transmission is:
@@ -148,44 +230,66 @@ def transmission(sample, title, s1vg, s2vg, s3vg=None, s4vg=None, count_seconds=
         dry_run had not been set then the vertical gaps would be set to 0.1, 0.2, 0.3 and 0.4, the horizontal gaps
         would be all set to 20. The super mirror would be moved into the beam and set to the angle 0.1. The mode will
         be changed to PNR. The system will be record at least 1 frame of data.
+
+    Returns: run number of the transmission; None if it did not count
     """
 
     print("** Transmission {} **".format(title))
 
-    movement = _Movement(dry_run)
-
-    movement.dry_run_warning()
-    constants = get_instrument_constants()
-    movement.change_to_soft_period_count()
-
-    movement.set_translation(sample.translation)  # Move this first before the heights as this can cause some drift.
-
+    with TRACER.step("Transmission {}".format(title)), alarm_guard():
+        movement = _Movement(dry_run, skip_unchanged=True, check_limits=True)
+
+        movement.dry_run_warning()
+        constants = get_instrument_constants()
+        movement.seed_setpoints()
+        movement.change_to_soft_period_count()
+        _transmission(movement, constants, sample, title, s1vg, s2vg, s3vg=s3vg, s4vg=s4vg,
+                      count_seconds=count_seconds, count_uamps=count_uamps, count_frames=count_frames, s1hg=s1hg,
+                      s2hg=s2hg, s3hg=s3hg, s4hg=s4hg, height_offset=height_offset, smangle=smangle, mode=mode,
+                      include_gaps_in_title=include_gaps_in_title, count_target=count_target)
+    if dry_run:
+        _print_time_estimate(movement, count_uamps, count_seconds, count_frames, count_target)
+    return movement.last_run_number
+
+
+def _transmission(movement, constants, sample, title, s1vg, s2vg, s3vg=None, s4vg=None, count_seconds=None,
+                  count_uamps=None, count_frames=None, s1hg=None, s2hg=None, s3hg=None, s4hg=None, height_offset=5,
+                  smangle=None, mode=None, include_gaps_in_title=True, count_target=None):
+    """
+    Perform a transmission using an existing movement and constants; see transmission for the arguments.
+    Args:
+        movement (_Movement): object that does movement required (or prints message for a dry run)
+        constants: instrument constants
+    """
+    movement.constants = constants
     with reset_hgaps_and_sample_height(movement, sample, constants):
-        movement.change_to_mode_if_not_none(mode)
+        with movement.move_plan():
+            movement.set_translation(sample.translation)  # Moved before the heights as this can cause some drift.
+            movement.change_to_mode_if_not_none(mode)
 
-        movement.set_smangle_if_not_none(smangle)
+            movement.set_smangle_if_not_none(smangle)
 
-        movement.set_height2_offset(sample.height2_offset, constants)
-        movement.set_theta(0.0)
+            movement.set_height2_offset(sample.height2_offset, constants)
+            movement.set_theta(0.0)
 
-        # if there is a seconds height stage and the height offset is greater than can be achieved by the fine z use
-        # second stage
-        if constants.has_height2 and height_offset > 10:
-            movement.set_height2_offset(sample.height2_offset - height_offset, constants)
-        else:
-            movement.set_height_offset(sample.height - height_offset)
+            # if there is a seconds height stage and the height offset is greater than can be achieved by the fine z
+            # use second stage
+            if constants.has_height2 and height_offset > 10:
+                movement.set_height2_offset(sample.height2_offset - height_offset, constants)
+            else:
+                movement.set_height_offset(sample.height - height_offset)
 
-        if s3vg is None:
-            s3vg = constants.s3max
-        if s4vg is None:
-            s4vg = constants.s4max
+            if s3vg is None:
+                s3vg = constants.s3max
+            if s4vg is None:
+                s4vg = constants.s4max
 
-        movement.set_h_gaps(s1hg, s2hg, s3hg, s4hg)
-        movement.set_slit_gaps(0.0, constants, s1vg, s2vg, s3vg, s4vg, sample)
+            movement.set_h_gaps(s1hg, s2hg, s3hg, s4hg)
+            movement.set_slit_gaps(0.0, constants, s1vg, s2vg, s3vg, s4vg, sample)
         movement.wait_for_move()
 
         movement.update_title(title, "", None, smangle, add_current_gaps=include_gaps_in_title)
-        movement.count_for(count_uamps, count_seconds, count_frames)
+        movement.count_for(count_uamps, count_seconds, count_frames, count_target)
 
         # Horizontal gaps and height reset by with reset_gaps_and_sample_height
 
@@ -194,28 +298,32 @@ def transmission(sample, title, s1vg, s2vg, s3vg=None, s4vg=None, count_seconds=
 def reset_hgaps_and_sample_height(movement, sample, constants):
     """
     After the context is over reset the gaps back to the value before and set the height to the default sample height.
-    If keyboard interrupt give options for what to do.
+    If keyboard interrupt give options for what to do; in a multi-period run the run is left paused or counting as the
+    multi-period run has it, and ending or aborting goes through the multi-period run.
     Args:
         movement(_Movement): object that does movement required (or pronts message for a dry run)
         sample: sample to get the sample offset from
         constants: instrument constants
 
     """
-    horizontal_gaps = movement.get_gaps(vertical=False)
+    horizontal_gaps = movement.known_snapshot(HORIZONTAL_GAP_BLOCKS).gaps(vertical=False)
 
     def _reset_gaps():
         print("Reset horizontal gaps to {}".format(list(horizontal_gaps.values())))
-        movement.set_h_gaps(**horizontal_gaps)
+        with movement.move_plan():
+            movement.set_h_gaps(**horizontal_gaps)
 
-        movement.set_height_offset(sample.height)
-        movement.set_height2_offset(sample.height2_offset, constants)
+            movement.set_height_offset(sample.height)
+            movement.set_height2_offset(sample.height2_offset, constants)
         movement.wait_for_move()
 
     try:
         yield
         _reset_gaps()
     except KeyboardInterrupt:
-        running_on_entry = not movement.is_in_setup()
+        period_run = movement.multi_period_run
+        in_period_run = period_run is not None and period_run.started
+        running_on_entry = not in_period_run and not movement.is_in_setup()
         if running_on_entry:
             movement.pause()
 
@@ -227,13 +335,17 @@ def reset_hgaps_and_sample_height(movement, sample, constants):
             print("Invalid choice try again!")
 
         if choice.upper() == "A":
-            if running_on_entry:
+            if in_period_run:
+                period_run.abort()
+            elif running_on_entry:
                 movement.abort()
             print("Setting horizontal slit gaps to pre-tranmission values.")
             _reset_gaps()
 
         elif choice.upper() == "E":
-            if running_on_entry:
+            if in_period_run:
+                period_run.end()
+            elif running_on_entry:
                 movement.end()
             _reset_gaps()
 
@@ -251,23 +363,33 @@ def slit_check(theta, footprint, resolution):
     """
     Check the slits values
     Args:
-        theta: theta
-        footprint: desired footprint
-        resolution:  desired resolution
+        theta: theta; may be a list of angles to print a table of slit gaps
+        footprint: desired footprint; may be a list with one footprint per angle
+        resolution:  desired resolution; may be a list with one resolution per angle
 
     """
     constants = get_instrument_constants()
-    movement = _Movement(True)
-    s1, s2 = movement.calculate_slit_gaps(theta, footprint, resolution, constants)
-    print("For a foortprint of {} and resolution of {} at an angle {}:".format(theta, footprint, resolution))
-    print("s1vg={}".format(s1))
-    print("s2vg={}".format(s2))
+    if all(np.ndim(value) == 0 for value in (theta, footprint, resolution)):
+        movement = _Movement(True)
+        s1, s2 = movement.calculate_slit_gaps(theta, footprint, resolution, constants)
+        print("For a footprint of {} and resolution of {} at an angle {}:".format(footprint, resolution, theta))
+        print("s1vg={}".format(s1))
+        print("s2vg={}".format(s2))
+    else:
+        gaps = calculate_slit_gaps_for_angles(theta, footprint, resolution, constants)
+        print(slit_gaps_table(theta, footprint, resolution, gaps))
+        if not np.all(gaps.valid):
+            print("{} of {} angles have negative slit gaps".format(np.size(gaps.valid) - np.count_nonzero(gaps.valid),
+                                                                   np.size(gaps.valid)))
 
 
 def auto_height(laser_offset_block: str, fine_height_block: str, target: float = 0.0, continue_if_nan: bool = False,
-                dry_run: bool = False):
+                dry_run: bool = False, tolerance: float = None, max_iterations: int = 1, average_over: int = 1,
+                average_interval: float = AUTO_HEIGHT_AVERAGE_INTERVAL, movement=None):
     """
     Moves the sample fine height axis so that it is centred on the beam, based on the readout of a laser height gun.
+    By default a single correction is made; with a tolerance the laser offset is re-read after each move and the
+    correction repeated until the offset is within tolerance of the target or the maximum iterations are reached.
 
     Args:
         laser_offset_block: The name of the block for the laser offset from centre
@@ -276,7 +398,20 @@ def auto_height(laser_offset_block: str, fine_height_block: str, target: float =
         continue_if_nan: Defines what to do in case of invalid values. If True, ignore errors and continue execution.
             If False, break and wait for user input. (default: False)
         dry_run: If True just print what is going to happen; If False, set the auto height
-        
+        tolerance: How close the laser offset must be to the target to stop correcting; None to make max_iterations
+            corrections without checking the offset
+        max_iterations: Maximum number of corrections to make; at least 1
+        average_over: Number of laser offset reads to average for each correction, to reject noise
+        average_interval: Time in seconds between laser offset reads when averaging
+        movement (_Movement): movement to set the fine height through, so that it knows the new setpoint; None to set
+            it directly
+
+    Returns:
+        AutoHeightResult: whether the offset converged, the corrections made, the last residual offset from the target
+            and the time taken; None if an invalid value was read
+    Raises:
+        ValueError: if max_iterations is less than 1
+
         >>> auto_height(b.KEYENCE, b.HEIGHT2)
 
         Moves HEIGHT2 by (KEYENCE * (-1))
@@ -284,16 +419,53 @@ def auto_height(laser_offset_block: str, fine_height_block: str, target: float =
         >>> auto_height(b.KEYENCE, b.HEIGHT2, target=0.5, continue_if_nan=True)
 
         Moves HEIGHT2 by (target - b.KEYENCE) and does not interrupt script execution if an invalid value is read.
+
+        >>> auto_height(b.KEYENCE, b.HEIGHT2, tolerance=0.005, max_iterations=5, average_over=3)
+
+        Moves HEIGHT2 by (-1) * the average of 3 reads of KEYENCE, then re-reads KEYENCE and repeats until it is within
+        0.005 of 0 or 5 moves have been made.
     """
+    if max_iterations < 1:
+        raise ValueError("Auto height needs at least 1 iteration, not {}".format(max_iterations))
+    start_time = time.time()
     try:
-        target_height, current_height = _calculate_target_auto_height(laser_offset_block, fine_height_block, target)
-        if not dry_run:
-            g.cset(fine_height_block, target_height)
-            _auto_height_check_alarms(fine_height_block)
-            g.waitfor_move()
+        iterations = 0
+        residual = None
+        for iteration in range(max_iterations):
+            iteration_start = time.time()
+            target_height, current_height = _calculate_target_auto_height(
+                laser_offset_block, fine_height_block, target, average_over, average_interval)
+            residual = target_height - current_height
+            if tolerance is not None and abs(residual) <= tolerance:
+                break
+            if not dry_run:
+                if movement is not None:
+                    movement.set_block(fine_height_block, target_height)
+                else:
+                    g.cset(fine_height_block, target_height)
+                _auto_height_check_alarms(fine_height_block)
+                g.waitfor_move()
+            iterations += 1
+            print("Auto height iteration {}: residual {:.4g} ({:.2f} s)".format(
+                iteration + 1, residual, time.time() - iteration_start))
+            if dry_run:
+                break
+        else:
+            if tolerance is not None:
+                residual = target - _read_laser_offset(laser_offset_block, average_over, average_interval)
     except TypeError as e:
         prompt_user = not (continue_if_nan or dry_run)
-        general.utilities.io.alert_on_error("ERROR: cannot set auto height (invalid block value): {}".format(e), prompt_user)
+        _alert_on_error("ERROR: cannot set auto height (invalid block value): {}".format(e), prompt_user)
+        return None
+
+    converged = tolerance is None or abs(residual) <= tolerance
+    result = AutoHeightResult(converged, iterations, residual, time.time() - start_time)
+    print("Auto height took {:.2f} s: {} corrections, residual {:.4g}".format(result.seconds, result.iterations,
+                                                                              result.residual))
+    if not converged and not dry_run:
+        sys.stderr.write("Auto height did not converge to within {} of the target in {} iterations!\n".format(
+            tolerance, max_iterations))
+    return result
 
 
 def _auto_height_check_alarms(fine_height_block):
@@ -305,16 +477,29 @@ def _auto_height_check_alarms(fine_height_block):
     """
     alarm_lists = g.check_alarms(fine_height_block)
     if any(fine_height_block in alarm_list for alarm_list in alarm_lists):
-        general.utilities.io.alert_on_error(
+        _alert_on_error(
             "ERROR: cannot set auto height (target outside of range for fine height axis?)", True)
 
 
-def _calculate_target_auto_height(laser_offset_block, fine_height_block, target):
+def _alert_on_error(message, prompt_user):
+    """
+    Alert the user to an error; the IBEX scripting utilities are imported when needed so that scripts can be run
+    against a simulated backend without them.
+    Args:
+        message: the error message
+        prompt_user: True to wait for the user to respond before continuing
+    """
+    import general.utilities.io
+    general.utilities.io.alert_on_error(message, prompt_user)
+
+
+def _calculate_target_auto_height(laser_offset_block, fine_height_block, target, average_over=1,
+                                  average_interval=AUTO_HEIGHT_AVERAGE_INTERVAL):
     if laser_offset_block is None:
         raise TypeError("No block given for laser offset.")
     elif fine_height_block is None:
         raise TypeError("No block given for fine height.")
-    current_laser_offset = g.cget(laser_offset_block)["value"]
+    current_laser_offset = _read_laser_offset(laser_offset_block, average_over, average_interval)
     difference = target - current_laser_offset
 
     current_height = g.cget(fine_height_block)["value"]
@@ -324,13 +509,250 @@ def _calculate_target_auto_height(laser_offset_block, fine_height_block, target)
     return target_height, current_height
 
 
+def _read_laser_offset(laser_offset_block, average_over=1, average_interval=AUTO_HEIGHT_AVERAGE_INTERVAL):
+    """
+    Read the laser offset, averaging over several reads
+    Args:
+        laser_offset_block: The name of the block for the laser offset from centre
+        average_over: number of reads to average
+        average_interval: time in seconds between reads; simulated seconds if the genie backend is simulated
+
+    Returns: the average laser offset
+    Raises:
+        TypeError: if the laser offset is invalid
+    """
+    total = 0.0
+    for read_number in range(average_over):
+        if read_number > 0:
+            backend_sleep(average_interval)
+        total += g.cget(laser_offset_block)["value"]
+    return total / average_over
+
+
+def _print_time_estimate(movement, count_uamps, count_seconds, count_frames, count_target=None):
+    """
+    Print an estimate of how long the moves made by a movement and a count take, using the move time model.
+    Args:
+        movement (_Movement): movement which has made the moves, usually in a dry run
+        count_uamps: number of uamps counted for
+        count_seconds: number of seconds counted for
+        count_frames: number of frames counted for
+        count_target: statistics counted until
+    """
+    model = get_move_time_model()
+    start_positions = {}
+    for stage in movement.move_stages:
+        for block in stage:
+            if block not in start_positions:
+                start_positions[block] = movement.get_current_value(block)
+    move_time = model.stages_time(movement.move_stages, start_positions)
+    count_time = model.count_time(count_uamps, count_seconds, count_frames, count_target)
+    print("Estimated time: moving {}, counting {}, total {}".format(
+        format_seconds(move_time), format_seconds(count_time), format_seconds(move_time + count_time)))
+
+
+def _move_stages(setpoints):
+    """
+    Split setpoints into stages which can be dispatched together so that each block is moved only after the blocks
+    it depends on have finished moving.
+    Args:
+        setpoints: dictionary of block name to value
+
+    Returns: list of dictionaries of block name to value, in dispatch order
+    """
+    stage_of = {}
+
+    def _stage(block):
+        if block not in stage_of:
+            dependencies = list(MOVE_DEPENDENCIES.get(block, ()))
+            if block != "MODE":
+                dependencies.append("MODE")
+            stage_of[block] = max([_stage(dependency) + 1 for dependency in dependencies if dependency in setpoints],
+                                  default=0)
+        return stage_of[block]
+
+    stages = []
+    for block, value in setpoints.items():
+        stage = _stage(block)
+        while len(stages) <= stage:
+            stages.append(OrderedDict())
+        stages[stage][block] = value
+    return [stage for stage in stages if stage]
+
+
+@traced_methods(exclude=("move_plan", "is_unchanged", "move_statistics"))
 class _Movement(object):
     """
     Encapsulate instrument changes
     """
 
-    def __init__(self, dry_run):
+    def __init__(self, dry_run, skip_unchanged=False, check_limits=False):
+        """
+        Initialiser.
+        :param dry_run: True to only print what would happen; False to move the instrument
+        :param skip_unchanged: True to not send a setpoint for a block which is known to be within its tolerance of
+            that value already, and not to wait for a move if nothing has moved since the last wait
+        :param check_limits: True to check the setpoints of each move plan against their limits before it is
+            dispatched, see setpoint_limits.setpoint_problems
+        """
         self.dry_run = dry_run
+        self.skip_unchanged = skip_unchanged
+        self.check_limits = check_limits
+        self.setpoints = OrderedDict()  # last known setpoint for each block, recorded even in a dry run
+        self.move_log = []  # (block, value) for each setpoint sent, or which would be sent in a dry run
+        self.move_stages = []  # setpoints dispatched together, in order, or which would be dispatched in a dry run
+        self.moves_issued = 0
+        self.moves_skipped = 0
+        self.waits_skipped = 0
+        self.last_run_number = None  # run number of the last run begun by this movement
+        self.last_title = None  # title last set, or which would have been set, by this movement
+        self.multi_period_run = None  # multi_period.MultiPeriodRun to count in; None to count each step in its own run
+        self.constants = None  # constants of the step being run, which setpoints are checked against; None to read them
+        self._moved_since_wait = True  # something may be moving before this movement starts
+        self._move_plan = None
+
+    def seed_setpoints(self, blocks=SEED_BLOCKS):
+        """
+        Read the current values of blocks in one go and use them as the known setpoints, so that moves to where the
+        blocks already are can be skipped. Blocks which do not exist are ignored.
+        :param blocks: names of blocks to read
+        :return: snapshot of the blocks read
+        """
+        snapshot = self.take_snapshot(blocks)
+        for block, value in snapshot.values.items():
+            if value is not None:
+                self.setpoints[block] = value
+        return snapshot
+
+    def get_block_values(self, blocks):
+        """
+        Read several block values at once; the blocks are read concurrently
+        :param blocks: names of blocks to read
+        :return: dictionary of block name to value; None if the block does not exist
+        """
+        blocks = list(blocks)
+        with ThreadPoolExecutor(max_workers=max(len(blocks), 1)) as executor:
+            values = list(executor.map(self.get_current_value, blocks))
+        return OrderedDict(zip(blocks, values))
+
+    def is_unchanged(self, block, value):
+        """
+        :param block: block name
+        :param value: value the block is to be set to
+        :return: True if the block is known to be within its tolerance of the value; False otherwise
+        """
+        if block not in self.setpoints:
+            return False
+        current = self.setpoints[block]
+        try:
+            return abs(float(value) - float(current)) <= MOVE_TOLERANCES.get(block, DEFAULT_MOVE_TOLERANCE)
+        except (TypeError, ValueError):
+            return value == current
+
+    def move_statistics(self):
+        """
+        :return: summary of the moves issued and skipped by this movement
+        """
+        return "Moves issued {}, moves skipped {}, waits skipped {}".format(
+            self.moves_issued, self.moves_skipped, self.waits_skipped)
+
+    def _cset(self, block, value):
+        """
+        Set a block value if not in dry run; if a move plan is being collected the setpoint is added to the plan
+        instead
+        :param block: block name
+        :param value: value to set
+        :return: True if the setpoint was sent or added to the move plan; False if in dry run or it was skipped
+        """
+        if self.skip_unchanged and self.is_unchanged(block, value):
+            self.moves_skipped += 1
+            return False
+        self.setpoints[block] = value
+        self.moves_issued += 1
+        self.move_log.append((block, value))
+        if self._move_plan is not None:
+            self._move_plan[block] = value
+        else:
+            self.move_stages.append(OrderedDict([(block, value)]))
+        if self.dry_run:
+            return False
+
+        self._moved_since_wait = True
+        alarm_monitor = get_alarm_monitor()
+        if alarm_monitor is not None:
+            alarm_monitor.watch(block)
+        if self._move_plan is None:
+            with TRACER.span("cset", block, value):
+                g.cset(block, value)
+            if block == "MODE":
+                invalidate_instrument_constants()  # constants may depend on the mode so read them again on next use
+        return True
+
+    @contextmanager
+    def move_plan(self):
+        """
+        Collect all setpoints made in the context into a move plan and dispatch them together at the end of the
+        context, rather than one after another. Blocks are only held back where MOVE_DEPENDENCIES says they must wait
+        for another block. The caller is responsible for waiting for the final move to finish. If the context exits
+        with an exception, or when checking limits a setpoint is outside its limits, the collected setpoints are
+        discarded.
+        :raises SetpointLimitError: if checking limits, not in dry run and a setpoint is outside its limits
+        """
+        if self._move_plan is not None:
+            yield  # already collecting a plan, nested plans are part of the outer plan
+            return
+        self._move_plan = OrderedDict()
+        setpoints_before_plan = OrderedDict(self.setpoints)
+        moves_before_plan = len(self.move_log)
+        try:
+            yield
+            plan = self._move_plan
+            if self.check_limits:
+                self._check_limits(plan)
+        except BaseException:
+            self.setpoints = setpoints_before_plan
+            del self.move_log[moves_before_plan:]
+            raise
+        finally:
+            self._move_plan = None
+        self.dispatch_moves(plan)
+
+    def _check_limits(self, setpoints):
+        """
+        Check setpoints against their limits, using the constants of the step being run; in dry run the problems are
+        only printed
+        :param setpoints: dictionary of block name to value
+        :raises SetpointLimitError: if not in dry run and a setpoint is outside its limits
+        """
+        constants = self.constants if self.constants is not None else get_instrument_constants()
+        problems = ["{}={}: {}".format(block, value, problem) for block, value in setpoints.items()
+                    for problem in setpoint_problems(block, value, constants)]
+        if not problems:
+            return
+        error = SetpointLimitError(problems)
+        if not self.dry_run:
+            raise error
+        sys.stderr.write("{}\n".format(error))
+
+    def dispatch_moves(self, setpoints):
+        """
+        Dispatch a set of setpoints in as few batches as the dependencies between blocks allow, waiting for the move
+        between batches but not after the last one. In a dry run the batches are only recorded in move_stages.
+        Once the mode has been written the cached instrument constants are invalidated, as they may depend on the mode.
+        :param setpoints: dictionary of block name to value
+        """
+        stages = _move_stages(setpoints)
+        self.move_stages.extend(stages)
+        if self.dry_run:
+            return
+        for index, stage in enumerate(stages):
+            if index > 0:
+                with TRACER.span("waitfor_move"):
+                    g.waitfor_move()
+            with TRACER.span("cset", ", ".join(stage), ", ".join(str(value) for value in stage.values())):
+                g.cset(**stage)
+            if "MODE" in stage:
+                invalidate_instrument_constants()
 
     def change_to_mode_if_not_none(self, mode):
         """
@@ -340,12 +762,28 @@ class _Movement(object):
         """
         if mode is not None:
             print("Change to mode: {}".format(mode))
-            if not self.dry_run:
-                g.cset("MODE", mode)
+            mode_changes = not (self.skip_unchanged and self.is_unchanged("MODE", mode))
+            self._cset("MODE", mode)  # the constants are invalidated once the mode has been written
+            if mode_changes:
+                # the REFL server can move components when the mode changes so other setpoints are no longer known
+                self.setpoints = OrderedDict([("MODE", mode)])
+        elif "MODE" in self.setpoints:
+            mode = self.setpoints["MODE"]
         else:
             mode = self._get_block_value("MODE")
+            self.setpoints["MODE"] = mode
         return mode
 
+    def set_block(self, block, value):
+        """
+        Set any block if not in dry run, e.g. a flipper or a fine height axis, so that the movement knows its setpoint
+        :param block: block name
+        :param value: value to set
+        :return: True if the setpoint was sent or added to the move plan; False if in dry run or it was skipped
+        """
+        print("Block {} set to: {}".format(block, value))
+        return self._cset(block, value)
+
     def dry_run_warning(self):
         """
         Print a warning if in dry run
@@ -359,21 +797,36 @@ class _Movement(object):
         :param theta: new theta
         """
         print("Theta set to: {}".format(theta))
-        if not self.dry_run:
-            g.cset("THETA", theta)
+        self._cset("THETA", theta)
 
     def get_gaps(self, vertical):
         """
         :param vertical: True for vertical gaps; False for Horizontal gaps
         :return: dictionary of gaps
         """
-        v_or_h = "V" if vertical else "H"
-        gaps = OrderedDict()
-        for slit_num in [1, 2, 3, 4]:
-            gap_pv = "S{}{}G".format(slit_num, v_or_h)
-            gaps[gap_pv.lower()] = self._get_block_value(gap_pv)
+        gap_blocks = VERTICAL_GAP_BLOCKS if vertical else HORIZONTAL_GAP_BLOCKS
+        return self.take_snapshot(gap_blocks).gaps(vertical)
 
-        return gaps
+    def take_snapshot(self, blocks=GAP_BLOCKS):
+        """
+        Read a set of blocks in one go
+        :param blocks: names of the blocks to read
+        :return: immutable snapshot of the block values
+        """
+        return BlockSnapshot(self.get_block_values(blocks))
+
+    def known_snapshot(self, blocks=GAP_BLOCKS):
+        """
+        Snapshot of a set of blocks taken from the known setpoints, e.g. those seeded at the start; only blocks whose
+        setpoints are not known are read
+        :param blocks: names of the blocks
+        :return: immutable snapshot of the block values
+        """
+        values = OrderedDict((block, self.setpoints.get(block)) for block in blocks)
+        unknown = [block for block, value in values.items() if value is None]
+        if unknown:
+            values.update(self.get_block_values(unknown))
+        return BlockSnapshot(values)
 
     def _get_block_value(self, pv_name):
         """
@@ -389,9 +842,21 @@ class _Movement(object):
             raise KeyError("Block {} does not exist".format(pv_name))
         return block_value["value"]
 
+    def get_current_value(self, block):
+        """
+        :param block: block name
+        :return: current value of the block; None if the block does not exist
+        """
+        try:
+            return self._get_block_value(block)
+        except KeyError:
+            return None
+
     def update_title(self, title, subtitle, theta, smangle, add_current_gaps):
         """
-        Update the current title with or without gaps if not in dry run
+        Update the current title with or without gaps if not in dry run; the gaps are read back in one go, after the
+        move has been waited for, so that a slit which has not reached its setpoint is recorded where it is. In dry run
+        the gaps are the setpoints which would have been set.
         :param title: title to set
         :param subtitle: sub title to set
         :param theta: theta for the experiment
@@ -405,11 +870,15 @@ class _Movement(object):
             new_title = "{} SM={:.4g}".format(new_title, smangle)
 
         if add_current_gaps:
-            gaps = itertools.chain(self.get_gaps(vertical=True).values(), self.get_gaps(vertical=False).values())
+            snapshot = self.known_snapshot(GAP_BLOCKS) if self.dry_run else self.take_snapshot(GAP_BLOCKS)
+            gaps = itertools.chain(snapshot.gaps(vertical=True).values(), snapshot.gaps(vertical=False).values())
             new_title = "{} VGs ({:.3g} {:.3g} {:.3g} {:.3g}) HGs ({:.3g} {:.3g} {:.3g} {:.3g})".format(
                 new_title, *gaps)
 
-        if self.dry_run:
+        self.last_title = new_title
+        if self.multi_period_run is not None and self.multi_period_run.started:
+            print("Title for period {}: {}".format(self.multi_period_run.next_period, new_title))
+        elif self.dry_run:
             g.change_title(new_title)
             print("New Title: {}".format(new_title))
         else:
@@ -421,8 +890,7 @@ class _Movement(object):
         :param height_offset:
         """
         print("Sample: height offset from beam={}".format(height_offset))
-        if not self.dry_run:
-            g.cset("HEIGHT", height_offset)
+        self._cset("HEIGHT", height_offset)
 
     def set_height2_offset(self, height, constants):
         """
@@ -432,20 +900,19 @@ class _Movement(object):
         """
         if constants.has_height2:
             print("Sample: height2 offset from beam={}".format(height))
-            if not self.dry_run:
-                g.cset("HEIGHT2", height)
+            self._cset("HEIGHT2", height)
         elif height != 0:
             print("ERROR: Height 2 off set is being ignored")
 
     def set_translation(self, translation):
         """
-        Set the sample translation if not in dry run and wait for move
+        Set the sample translation if not in dry run and wait for move; in a move plan the wait is replaced by the
+        dependencies in MOVE_DEPENDENCIES
         :param translation: new translation
         """
         print("Translation to {}".format(translation))
-        if not self.dry_run:
-            g.cset("TRANS", translation)
-            g.waitfor_move()
+        if self._cset("TRANS", translation) and self._move_plan is None:
+            self.wait_for_move()
 
     def set_slit_gaps(self, theta, constants, s1vg, s2vg, s3vg, s4vg, sample):
         """
@@ -480,11 +947,10 @@ class _Movement(object):
         print("Slit gaps 1-4 set to: {}, {}, {}, {}".format(s1, s2, s3, s4))
         if s1 < 0.0 or s2 < 0.0 or s3 < 0.0 or s4 < 0.0:
             sys.stderr.write("Vertical slit gaps are being set to less than 0!\n")
-        if not self.dry_run:
-            g.cset("S1VG", s1)
-            g.cset("S2VG", s2)
-            g.cset("S3VG", s3)
-            g.cset("S4VG", s4)
+        self._cset("S1VG", s1)
+        self._cset("S2VG", s2)
+        self._cset("S3VG", s3)
+        self._cset("S4VG", s4)
 
     def calculate_slit_gaps(self, theta, footprint, resolution, constants):
         """
@@ -517,15 +983,14 @@ class _Movement(object):
         if any([_val_lt_0(s1hg), _val_lt_0(s2hg), _val_lt_0(s3hg), _val_lt_0(s4hg)]):
             sys.stderr.write("Horizontal slit gaps are being set to less than 0!\n")
 
-        if not self.dry_run:
-            if s1hg is not None:
-                g.cset("S1HG", s1hg)
-            if s2hg is not None:
-                g.cset("S2HG", s2hg)
-            if s3hg is not None:
-                g.cset("S3HG", s3hg)
-            if s4hg is not None:
-                g.cset("S4HG", s4hg)
+        if s1hg is not None:
+            self._cset("S1HG", s1hg)
+        if s2hg is not None:
+            self._cset("S2HG", s2hg)
+        if s3hg is not None:
+            self._cset("S3HG", s3hg)
+        if s4hg is not None:
+            self._cset("S4HG", s4hg)
 
     def change_to_soft_period_count(self, count=1):
         """
@@ -544,16 +1009,19 @@ class _Movement(object):
         :param psi: psi value to set
         """
         print("Sample: Phi={}, Psi={}".format(phi, psi))
-        if not self.dry_run:
-            g.cset("PHI", phi)
-            g.cset("PSI", psi)
+        self._cset("PHI", phi)
+        self._cset("PSI", psi)
 
     def wait_for_move(self):
         """
-        Wait for a move if not in dry run
+        Wait for a move if not in dry run; if skipping unchanged moves the wait is skipped when nothing has moved
         """
         if not self.dry_run:
+            if self.skip_unchanged and not self._moved_since_wait:
+                self.waits_skipped += 1
+                return
             g.waitfor_move()
+            self._moved_since_wait = False
 
     def set_smangle_if_not_none(self, smangle):
         """
@@ -563,9 +1031,8 @@ class _Movement(object):
         if smangle is not None:
             is_in_beam = "IN" if smangle > 0.0001 else "OUT"
             print("SM angle (in beam?): {} ({})".format(smangle, is_in_beam))
-            if not self.dry_run:
-                g.cset("SM2ANGLE", smangle)
-                g.cset("SM2INBEAM", is_in_beam)
+            self._cset("SM2ANGLE", smangle)
+            self._cset("SM2INBEAM", is_in_beam)
 
     def pause(self):
         """
@@ -605,25 +1072,41 @@ class _Movement(object):
         else:
             print("Wait for {} seconds".format(seconds))
 
-    def count_for(self, count_uamps, count_seconds, count_frames):
+    def count_for(self, count_uamps, count_seconds, count_frames, count_target=None):
         """
-        Count for one of uamps, seconds, frames if not None in that order
+        Count until the count target or for one of uamps, seconds, frames if not None in that order
         :param count_uamps: number of uamps to count for; None count in a different way
         :param count_seconds: number of seconds to count for; None count in a different way
         :param count_frames: number of frames to count for; None count in a different way
+        :param count_target: statistics to count until; None count in a different way
+        If a multi-period run is set the count is made in its next period instead of in a run of its own.
         """
-        if count_uamps is not None:
+        if self.multi_period_run is not None and any(
+                count is not None for count in (count_uamps, count_seconds, count_frames, count_target)):
+            self.multi_period_run.count(count_uamps, count_seconds, count_frames, count_target,
+                                        TRACER.current_step(), self.last_title)
+            self.last_run_number = self.multi_period_run.run_number
+
+        elif count_target is not None:
+            print("Count until {}".format(count_target))
+            if not self.dry_run:
+                self._begin()
+                counts, seconds = count_until(count_target)
+                g.end()
+                print("Counted {:.0f} counts in {:.1f} s".format(counts, seconds))
+
+        elif count_uamps is not None:
             print("Wait for {} uA".format(count_uamps))
             if not self.dry_run:
-                g.begin()
-                g.waitfor_uamps(count_uamps)
+                self._begin()
+                wait_for_count(uamps=count_uamps)
                 g.end()
 
         elif count_seconds is not None:
             print("Measure for {} s".format(count_seconds))
             if not self.dry_run:
-                g.begin()
-                g.waitfor_time(seconds=count_seconds)
+                self._begin()
+                wait_for_count(seconds=count_seconds)
                 g.end()
 
         elif count_frames is not None:
@@ -631,10 +1114,18 @@ class _Movement(object):
                 count_frames))
             if not self.dry_run:
                 final_frame = count_frames + g.get_frames()
-                g.begin()
-                g.waitfor_frames(final_frame)
+                self._begin()
+                wait_for_count(frames=final_frame)
                 g.end()
 
+    def _begin(self):
+        """
+        Begin a run, once no watched block is in alarm, and record its run number
+        """
+        check_alarms_before_counting()
+        g.begin()
+        self.last_run_number = g.get_runnumber()
+
     def is_in_setup(self):
         """
         :Returns True if DAE is in setup; in dry run mode will return True
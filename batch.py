@@ -0,0 +1,124 @@
+"""
+Run many samples at many angles, in the order which minimises the time spent moving between them
+"""
+from .move_time import get_move_time_model, format_seconds
+from .scan_plan import ScanPlan
+
+SAMPLE_MAJOR = "sample"  # all angles for one sample, then the next sample
+ANGLE_MAJOR = "angle"  # all samples at one angle, then the next angle; samples are visited back and forth
+OPTIMISED = "optimised"  # nearest neighbour tour of all sample and angle pairs
+AUTO = "auto"  # whichever of the above takes the least time to move
+ORDERS = (SAMPLE_MAJOR, ANGLE_MAJOR, OPTIMISED)
+
+
+def plan_samples(samples, angles, order=AUTO, model=None, **kwargs):
+    """
+    Create a scan plan which measures each sample at each angle.
+    Args:
+        samples (list[techniques.reflectometry.sample.Sample]): samples to measure
+        angles: angles to measure at; either numbers or dictionaries of run_angle arguments including the angle, e.g.
+            {"angle": 0.7, "count_uamps": 5}
+        order: SAMPLE_MAJOR, ANGLE_MAJOR, OPTIMISED or AUTO to choose the one with the least translation and theta
+            travel
+        model (techniques.reflectometry.move_time.MoveTimeModel): model used to estimate travel time; None for the
+            current move time model
+        kwargs: other arguments for run_angle used for every angle, e.g. mode
+
+    Returns:
+        ScanPlan: the plan
+    """
+    model = model if model is not None else get_move_time_model()
+    angle_arguments = [dict(angle) if isinstance(angle, dict) else {"angle": angle} for angle in angles]
+    points = [(sample, arguments) for sample in samples for arguments in angle_arguments]
+
+    orderings = {
+        SAMPLE_MAJOR: points,
+        ANGLE_MAJOR: _angle_major(samples, angle_arguments),
+        OPTIMISED: _nearest_neighbour_tour(points, model),
+    }
+    travel_times = {name: _travel_time(ordering, model) for name, ordering in orderings.items()}
+    if order == AUTO:
+        order = min(ORDERS, key=lambda name: travel_times[name])
+    elif order not in orderings:
+        raise ValueError("Unknown order {}, should be one of {}".format(order, ORDERS + (AUTO,)))
+
+    print("Estimated translation and theta travel: {}; using {} order".format(
+        ", ".join("{} {}".format(name, format_seconds(travel_times[name])) for name in ORDERS), order))
+
+    plan = ScanPlan(model)
+    for sample, arguments in orderings[order]:
+        step_arguments = dict(kwargs)
+        step_arguments.update(arguments)
+        plan.add_angle(sample, **step_arguments)
+    return plan
+
+
+def run_samples(samples, angles, order=AUTO, model=None, dry_run=False, **kwargs):
+    """
+    Measure each sample at each angle in the order which minimises the time spent moving between them.
+    Args:
+        samples (list[techniques.reflectometry.sample.Sample]): samples to measure
+        angles: angles to measure at; either numbers or dictionaries of run_angle arguments including the angle
+        order: SAMPLE_MAJOR, ANGLE_MAJOR, OPTIMISED or AUTO to choose the one with the least travel
+        model (techniques.reflectometry.move_time.MoveTimeModel): model used to estimate travel time; None for the
+            current move time model
+        dry_run: If True just print what would happen; If False, run the experiment
+        kwargs: other arguments for run_angle used for every angle, e.g. mode
+
+    Examples:
+        >>> run_samples([sample_1, sample_2, sample_3], [{"angle": 0.7, "count_uamps": 5},
+        >>>                                              {"angle": 2.3, "count_uamps": 20}], mode="NR")
+        Measures the three samples at both angles; the order is chosen automatically.
+
+    Returns:
+        ScanPlan: the plan which was run
+    """
+    plan = plan_samples(samples, angles, order, model, **kwargs)
+    if dry_run:
+        plan.dry_run()
+    else:
+        plan.run()
+    return plan
+
+
+def _angle_major(samples, angle_arguments):
+    """
+    Returns: all samples at each angle in turn, reversing the sample order at each angle so the translation stage
+        does not return to the start
+    """
+    ordering = []
+    for index, arguments in enumerate(angle_arguments):
+        ordered_samples = samples if index % 2 == 0 else list(reversed(samples))
+        ordering.extend((sample, arguments) for sample in ordered_samples)
+    return ordering
+
+
+def _nearest_neighbour_tour(points, model):
+    """
+    Returns: points ordered by starting at the first and always moving to the nearest (quickest to reach) unvisited one
+    """
+    if not points:
+        return []
+    remaining = list(points[1:])
+    tour = [points[0]]
+    while remaining:
+        nearest = min(remaining, key=lambda point: _point_move_time(tour[-1], point, model))
+        remaining.remove(nearest)
+        tour.append(nearest)
+    return tour
+
+
+def _point_move_time(start, end, model):
+    """
+    Returns: time to move from one sample and angle to another; translation and theta move at the same time
+    """
+    (start_sample, start_arguments), (end_sample, end_arguments) = start, end
+    return max(model.move_time("TRANS", start_sample.translation, end_sample.translation),
+               model.move_time("THETA", start_arguments["angle"], end_arguments["angle"]))
+
+
+def _travel_time(ordering, model):
+    """
+    Returns: total time to move through the samples and angles in order
+    """
+    return sum(_point_move_time(start, end, model) for start, end in zip(ordering, ordering[1:]))
@@ -0,0 +1,283 @@
+"""
+Benchmarks of script overhead against the simulated genie backend, with results saved to json so that versions can be
+compared. Run with:
+    python -m techniques.reflectometry.benchmark --output results.json --baseline previous_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .base import _Movement, run_angle, transmission
+from .genie_backend import use_backend
+from .instrument_constants import get_instrument_constants, invalidate_instrument_constants
+from .sample import Sample
+from .scan_plan import ScanPlan
+from .simulator import SimulatedGenie
+from .slit_gaps import calculate_slit_gaps_for_angles
+
+# Fractional increase in a benchmark's time which counts as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+# Blocks added to the simulator for auto height
+LASER_OFFSET_BLOCK = "LASER_OFFSET"
+FINE_HEIGHT_BLOCK = "FINE_HEIGHT"
+
+
+class CountingBackend(object):
+    """
+    Wraps a genie backend and counts the calls made to each function and the wall time spent in them
+    """
+    def __init__(self, backend):
+        """
+        Initialiser.
+        Args:
+            backend: the backend to wrap
+        """
+        self.backend = backend
+        self.calls = OrderedDict()
+        self.seconds = OrderedDict()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.backend, name)
+        if not callable(attribute):
+            return attribute
+
+        def _counted(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+        return _counted
+
+    def __repr__(self):
+        return "Counting backend: {}".format(dict(self.calls))
+
+
+def _samples(count):
+    """
+    Returns: samples spread along the translation stage
+    """
+    return [Sample("Sample {}".format(index + 1), "benchmark", 50.0 * index, 0.0, 0.0, 0.0, 0.0, 0.03, 60.0)
+            for index in range(count)]
+
+
+def _single_run_angle():
+    run_angle(_samples(1)[0], 0.7, count_uamps=5, mode="NR")
+
+
+def _single_transmission():
+    transmission(_samples(1)[0], "Direct beam", 0.5, 0.2, count_uamps=2, mode="NR")
+
+
+def _multi_sample_script():
+    """
+    Three samples at three angles with auto height and a transmission per sample, called one at a time
+    """
+    samples = _samples(3)
+    for sample in samples:
+        for angle in (0.5, 1.2, 2.3):
+            run_angle(sample, angle, count_uamps=5, mode="NR", do_auto_height=True,
+                      laser_offset_block=LASER_OFFSET_BLOCK, fine_height_block=FINE_HEIGHT_BLOCK)
+        transmission(sample, "{} transmission".format(sample.title), 0.5, 0.2, count_uamps=2, mode="NR")
+
+
+def _multi_sample_plan():
+    """
+    The multi sample script as an optimised scan plan
+    """
+    plan = ScanPlan()
+    for sample in _samples(3):
+        for angle in (0.5, 1.2, 2.3):
+            plan.add_angle(sample, angle, count_uamps=5, mode="NR", do_auto_height=True,
+                           laser_offset_block=LASER_OFFSET_BLOCK, fine_height_block=FINE_HEIGHT_BLOCK)
+        plan.add_transmission(sample, "{} transmission".format(sample.title), 0.5, 0.2, count_uamps=2, mode="NR")
+    plan.optimise()
+    plan.run(preflight=False)
+
+
+SCRIPT_BENCHMARKS = OrderedDict([
+    ("run_angle", _single_run_angle),
+    ("transmission", _single_transmission),
+    ("multi_sample_script", _multi_sample_script),
+    ("multi_sample_plan", _multi_sample_plan),
+])
+
+
+def benchmark_script(script, repeats=3):
+    """
+    Run a script against a fresh simulator several times, with the instrument constants re-read each time
+    Args:
+        script: function which runs the script
+        repeats: number of times to run it
+
+    Returns: dictionary of the fastest wall time, the simulated time, and the genie calls made in one run with the wall
+        time spent in each function
+    """
+    wall_times = []
+    for _ in range(repeats):
+        simulator = SimulatedGenie(blocks={LASER_OFFSET_BLOCK: 0.1, FINE_HEIGHT_BLOCK: 0.0})
+        backend = CountingBackend(simulator)
+        invalidate_instrument_constants()
+        with use_backend(backend), contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            script()
+            wall_times.append(time.perf_counter() - start)
+    invalidate_instrument_constants()
+    statistics = simulator.statistics()
+    return OrderedDict([
+        ("wall_seconds", min(wall_times)),
+        ("simulated_seconds", statistics["simulated_seconds"]),
+        ("moving_seconds", statistics["moving_seconds"]),
+        ("counting_seconds", statistics["counting_seconds"]),
+        ("overhead_seconds", statistics["simulated_seconds"] - statistics["counting_seconds"]),
+        ("calls", backend.calls),
+        ("call_seconds", backend.seconds),
+    ])
+
+
+def benchmark_slit_gaps(angle_count=10000):
+    """
+    Time slit gap calculations one angle at a time and vectorised over many angles
+    Args:
+        angle_count: number of angles to calculate for
+
+    Returns: dictionary of the angles per second for each calculation
+    """
+    with use_backend(SimulatedGenie()):
+        constants = get_instrument_constants(force_refresh=True)
+    invalidate_instrument_constants()
+    theta = np.linspace(0.1, constants.max_theta, angle_count)
+    movement = _Movement(True)
+
+    start = time.perf_counter()
+    for angle in theta:
+        movement.calculate_slit_gaps(angle, 60.0, 0.03, constants)
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calculate_slit_gaps_for_angles(theta, 60.0, 0.03, constants)
+    vectorised_seconds = time.perf_counter() - start
+
+    return OrderedDict([
+        ("angles", angle_count),
+        ("scalar_angles_per_second", angle_count / scalar_seconds),
+        ("vectorised_angles_per_second", angle_count / vectorised_seconds),
+    ])
+
+
+def run_benchmarks(repeats=3, label=None):
+    """
+    Run all the benchmarks
+    Args:
+        repeats: number of times to run each script; the fastest is kept
+        label: label for the results, e.g. a version or commit
+
+    Returns: dictionary of results
+    """
+    return OrderedDict([
+        ("label", label),
+        ("time", time.time()),
+        ("python", platform.python_version()),
+        ("scripts", OrderedDict((name, benchmark_script(script, repeats))
+                                for name, script in SCRIPT_BENCHMARKS.items())),
+        ("slit_gaps", benchmark_slit_gaps()),
+    ])
+
+
+def save_results(results, filename):
+    """
+    Save benchmark results to a json file
+    """
+    with open(filename, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+
+def load_results(filename):
+    """
+    Returns: benchmark results loaded from a json file
+    """
+    with open(filename) as results_file:
+        return json.load(results_file, object_pairs_hook=OrderedDict)
+
+
+def compare_results(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compare two sets of results
+    Args:
+        baseline: results to compare against
+        current: new results
+        threshold: fractional increase in time (or decrease in throughput) which counts as a regression
+
+    Returns: list of (benchmark, measure, baseline value, current value, regressed) for each measure in both results
+    """
+    comparisons = []
+    for name, result in current["scripts"].items():
+        baseline_result = baseline["scripts"].get(name)
+        if baseline_result is None:
+            continue
+        for measure in ("wall_seconds", "simulated_seconds", "overhead_seconds"):
+            old, new = baseline_result[measure], result[measure]
+            comparisons.append((name, measure, old, new, new > old * (1.0 + threshold)))
+        old_calls, new_calls = sum(baseline_result["calls"].values()), sum(result["calls"].values())
+        comparisons.append((name, "genie_calls", old_calls, new_calls, new_calls > old_calls))
+    for measure in ("scalar_angles_per_second", "vectorised_angles_per_second"):
+        old, new = baseline["slit_gaps"][measure], current["slit_gaps"][measure]
+        comparisons.append(("slit_gaps", measure, old, new, new < old * (1.0 - threshold)))
+    return comparisons
+
+
+def format_results(results, comparisons=None):
+    """
+    Returns: results, and comparisons if given, as a table
+    """
+    lines = ["{:<22} {:>10} {:>12} {:>12} {:>8} {:>8} {:>8} {:>10}".format(
+        "script", "wall ms", "simulated s", "overhead s", "csets", "cgets", "calls", "genie ms")]
+    for name, result in results["scripts"].items():
+        calls = result["calls"]
+        lines.append("{:<22} {:>10.2f} {:>12.1f} {:>12.1f} {:>8} {:>8} {:>8} {:>10.2f}".format(
+            name, 1000.0 * result["wall_seconds"], result["simulated_seconds"], result["overhead_seconds"],
+            calls.get("cset", 0), calls.get("cget", 0), sum(calls.values()),
+            1000.0 * sum(result.get("call_seconds", {}).values())))
+    slit_gaps = results["slit_gaps"]
+    lines.append("slit gaps: {:.0f} angles/s one at a time, {:.0f} angles/s vectorised".format(
+        slit_gaps["scalar_angles_per_second"], slit_gaps["vectorised_angles_per_second"]))
+    for name, measure, old, new, regressed in comparisons or []:
+        lines.append("{:<22} {:<30} {:>12.4g} -> {:>12.4g} {}".format(
+            name, measure, old, new, "REGRESSED" if regressed else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """
+    Run the benchmarks from the command line; exits with 1 if any measure regressed against the baseline
+    """
+    parser = argparse.ArgumentParser(description="Benchmark reflectometry script overhead against a simulator")
+    parser.add_argument("--repeats", type=int, default=3, help="times to run each script")
+    parser.add_argument("--label", help="label for the results, e.g. a version")
+    parser.add_argument("--output", help="json file to save the results to")
+    parser.add_argument("--baseline", help="json file of results to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="fractional change which counts as a regression")
+    arguments = parser.parse_args(argv)
+
+    results = run_benchmarks(arguments.repeats, arguments.label)
+    comparisons = None
+    if arguments.baseline:
+        comparisons = compare_results(load_results(arguments.baseline), results, arguments.threshold)
+    print(format_results(results, comparisons))
+    if arguments.output:
+        save_results(results, arguments.output)
+    return 1 if comparisons and any(comparison[4] for comparison in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
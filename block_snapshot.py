@@ -0,0 +1,89 @@
+"""
+Snapshot of block values read at one time
+"""
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+SLITS = [1, 2, 3, 4]
+
+VERTICAL_GAP_BLOCKS = tuple("S{}VG".format(slit_num) for slit_num in SLITS)
+HORIZONTAL_GAP_BLOCKS = tuple("S{}HG".format(slit_num) for slit_num in SLITS)
+GAP_BLOCKS = VERTICAL_GAP_BLOCKS + HORIZONTAL_GAP_BLOCKS
+
+
+class BlockSnapshot(object):
+    """
+    Immutable set of block values read at one time
+    """
+    __slots__ = ("_values", "_timestamp")
+
+    def __init__(self, values, timestamp=None):
+        """
+        Initialiser.
+        Args:
+            values: dictionary of block name to value; None if the block does not exist
+            timestamp: time the values were read; None for now
+        """
+        object.__setattr__(self, "_values", MappingProxyType(OrderedDict(values)))
+        object.__setattr__(self, "_timestamp", time.time() if timestamp is None else timestamp)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Block snapshot is immutable")
+
+    @property
+    def values(self):
+        """
+        Returns: read only dictionary of block name to value
+        """
+        return self._values
+
+    @property
+    def timestamp(self):
+        """
+        Returns: time the snapshot was taken
+        """
+        return self._timestamp
+
+    def __getitem__(self, block):
+        """
+        Args:
+            block: block name
+
+        Returns: value of the block
+        Raises:
+            KeyError: if the block is not in the snapshot or does not exist
+        """
+        value = self._values.get(block)
+        if value is None:
+            raise KeyError("Block {} does not exist".format(block))
+        return value
+
+    def __contains__(self, block):
+        return self._values.get(block) is not None
+
+    def get(self, block, default=None):
+        """
+        Args:
+            block: block name
+            default: value if the block is not in the snapshot or does not exist
+
+        Returns: value of the block
+        """
+        value = self._values.get(block)
+        return default if value is None else value
+
+    def gaps(self, vertical):
+        """
+        Args:
+            vertical: True for vertical gaps; False for Horizontal gaps
+
+        Returns: dictionary of gaps keyed by lower case gap name, e.g. s1vg, as _Movement.get_gaps
+        Raises:
+            KeyError: if a gap is not in the snapshot or does not exist
+        """
+        gap_blocks = VERTICAL_GAP_BLOCKS if vertical else HORIZONTAL_GAP_BLOCKS
+        return OrderedDict((gap_block.lower(), self[gap_block]) for gap_block in gap_blocks)
+
+    def __repr__(self):
+        return "Block snapshot at {}: {}".format(time.ctime(self._timestamp), dict(self._values))
@@ -0,0 +1,92 @@
+"""
+The genie backend the scripts talk to. Modules use the g proxy from here rather than importing genie_python directly,
+so that a simulated backend can be swapped in to run scripts without the IBEX stack.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns: the current genie backend; genie_python is imported the first time if no backend has been set
+    """
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                from genie_python import genie
+                _BACKEND = genie
+    return _BACKEND
+
+
+def set_backend(backend):
+    """
+    Set the genie backend used by all the scripts
+    Args:
+        backend: object with the genie functions, e.g. the genie_python genie module or a
+            techniques.reflectometry.simulator.SimulatedGenie; None to go back to genie_python
+    """
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = backend
+
+
+@contextmanager
+def use_backend(backend):
+    """
+    Use a genie backend within the context and restore the previous one afterwards
+    Args:
+        backend: object with the genie functions
+
+    Examples:
+        >>> with use_backend(SimulatedGenie(time_scale=None)):
+        >>>     run_angle(sample_1, 0.7, count_uamps=5)
+    """
+    global _BACKEND
+    with _BACKEND_LOCK:
+        previous = _BACKEND
+        _BACKEND = backend
+    try:
+        yield backend
+    finally:
+        with _BACKEND_LOCK:
+            _BACKEND = previous
+
+
+def monotonic():
+    """
+    Returns: current time in seconds; simulated time if the backend is simulated
+    """
+    backend = get_backend()
+    return backend.monotonic() if getattr(backend, "is_simulated", False) else time.monotonic()
+
+
+def sleep(seconds):
+    """
+    Wait for a number of seconds; simulated seconds if the backend is simulated
+    Args:
+        seconds: seconds to wait for
+    """
+    backend = get_backend()
+    if getattr(backend, "is_simulated", False):
+        backend.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+class _GenieProxy(object):
+    """
+    Forwards every attribute to the current genie backend, so it can be used in place of the genie module
+    """
+    def __getattr__(self, name):
+        return getattr(get_backend(), name)
+
+    def __repr__(self):
+        return "Genie proxy for {!r}".format(_BACKEND)
+
+
+g = _GenieProxy()
@@ -1,7 +1,31 @@
 """
 Instrument specific constants
 """
-from genie_python import genie as g
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .genie_backend import g
+from .tracing import traced
+
+# Time in seconds a set of instrument constants is reused for before it is re-read from the REFL server
+DEFAULT_CONSTANTS_TTL = 3600.0
+
+REFLECTOMETRY_CONSTANT_PV = "REFL_01:CONST:{}"
+
+# Names of the values on the REFL server needed to build the instrument constants
+CONSTANT_VALUE_NAMES = ("S1_Z", "S2_Z", "SM2_Z", "SAMPLE_Z", "S3_Z", "S4_Z", "PD_Z", "S3_MAX", "S4_MAX", "MAX_THETA",
+                        "NATURAL_ANGLE", "HAS_HEIGHT2")
+
+# Maximum number of REFL server PVs read concurrently
+CONSTANTS_READ_WORKERS = len(CONSTANT_VALUE_NAMES)
+
+# Version of the constants snapshot file format
+CONSTANTS_SNAPSHOT_VERSION = 1
 
 
 class InstrumentConstant(object):
@@ -37,46 +61,378 @@ class InstrumentConstant(object):
         )
 
 
-def get_instrument_constants():
+class InstrumentConstantsCache(object):
     """
-    Returns: constants for the current instrument from PVs defined in the refl server
+    Cache of the instrument constants so that the REFL server PVs are read once per script rather than once per step
+    """
+    def __init__(self, ttl=DEFAULT_CONSTANTS_TTL):
+        """
+        Initialiser.
+        Args:
+            ttl: time in seconds that cached constants are valid for; None for never expire
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._constants = None
+        self._fetched_at = None
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    @property
+    def generation(self):
+        """
+        Returns: number of times the cache has been invalidated
+        """
+        return self._generation
+
+    def get(self, fetch, force_refresh=False):
+        """
+        Get the cached constants, fetching them if they are missing, expired or a refresh is forced
+        Args:
+            fetch: function which returns fresh constants
+            force_refresh: True to ignore any cached value and fetch again
+
+        Returns: the instrument constants
+        """
+        with self._lock:
+            if not force_refresh and self._is_valid():
+                self.hits += 1
+                return self._constants
+            self.misses += 1
+            constants = fetch()
+            self.put(constants)
+            return constants
+
+    def put(self, constants, generation=None):
+        """
+        Store a set of constants in the cache
+        Args:
+            constants: constants to store
+            generation: generation of the cache when the constants were fetched; if the cache has been invalidated
+                since, they are out of date and not stored. None to always store them
+
+        Returns: True if the constants were stored
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._constants = constants
+            self._fetched_at = time.time()
+            return True
+
+    def invalidate(self):
+        """
+        Throw away the cached constants so that the next get reads them from the REFL server
+        """
+        with self._lock:
+            self._constants = None
+            self._fetched_at = None
+            self._generation += 1
+
+    def age(self):
+        """
+        Returns: age of the cached constants in seconds; None if nothing is cached
+        """
+        with self._lock:
+            if self._fetched_at is None:
+                return None
+            return time.time() - self._fetched_at
+
+    def _is_valid(self):
+        if self._constants is None:
+            return False
+        return self.ttl is None or self.age() < self.ttl
+
+    def __repr__(self):
+        return "Instrument constants cache: hits={}, misses={}, ttl={}, age={}".format(
+            self.hits, self.misses, self.ttl, self.age())
+
+
+_CONSTANTS_CACHE = InstrumentConstantsCache()
+
+
+@traced()
+def get_instrument_constants(force_refresh=False):
+    """
+    Get the instrument constants; these are cached for the cache time to live so that a script reads them once.
+    Args:
+        force_refresh: True to re-read the constants from the REFL server even if they are cached
+
+    Returns: constants for the current instrument from PVs defined in the refl server, or from the constants snapshot
+        if one is being used
+    """
+    return _CONSTANTS_CACHE.get(_fetch_instrument_constants, force_refresh)
+
+
+def _fetch_instrument_constants():
+    """
+    Returns: constants from the snapshot if it is used first (verifying them against the REFL server in the
+        background the first time), otherwise from the REFL server falling back to the snapshot if the server can not
+        be read
+    """
+    global _SNAPSHOT_CHECKED
+    if _SNAPSHOT_FILENAME is not None and _SNAPSHOT_FIRST:
+        constants, snapshot = load_constants_snapshot(_SNAPSHOT_FILENAME)
+        if not _SNAPSHOT_CHECKED:
+            _SNAPSHOT_CHECKED = True
+            threading.Thread(target=_verify_in_background, args=(_SNAPSHOT_FILENAME, _CONSTANTS_CACHE.generation),
+                             name="verify constants", daemon=True).start()
+        return constants
+    try:
+        return read_instrument_constants()
+    except ValueError as e:
+        if _SNAPSHOT_FILENAME is None:
+            raise
+        constants, snapshot = load_constants_snapshot(_SNAPSHOT_FILENAME)
+        sys.stderr.write("Could not read instrument constants ({}); using snapshot from {}\n".format(
+            e, time.ctime(snapshot["timestamp"])))
+        return constants
+
+
+def invalidate_instrument_constants():
+    """
+    Invalidate the cached instrument constants, e.g. after the REFL server has restarted or the mode has changed, so
+    that they are re-read on next use.
+    """
+    _CONSTANTS_CACHE.invalidate()
+
+
+def set_instrument_constants_ttl(ttl):
+    """
+    Set the time the instrument constants are cached for.
+    Args:
+        ttl: time to live in seconds; None for never expire; 0 to always read from the REFL server
+    """
+    _CONSTANTS_CACHE.ttl = ttl
+
+
+def get_instrument_constants_cache():
+    """
+    Returns: the instrument constants cache, e.g. to inspect its hits and misses counters
+    """
+    return _CONSTANTS_CACHE
+
+
+@traced()
+def read_instrument_constants(pv_source=None):
+    """
+    Read the instrument constants from the REFL server PVs in a single batched read, bypassing the cache.
+    Args:
+        pv_source: object with a get_pv(pv_name, is_local) method to read PVs from; None for genie
+
+    Returns: constants for the current instrument read directly from PVs defined in the refl server
     """
     try:
-        s1_z = get_reflectometry_value("S1_Z")
-        s2_z = get_reflectometry_value("S2_Z")
-        sm_z = get_reflectometry_value("SM2_Z") # set to SM2_Z for now, needs updating to include both.
-        sample_z = get_reflectometry_value("SAMPLE_Z")
-        s3_z = get_reflectometry_value("S3_Z")
-        s4_z = get_reflectometry_value("S4_Z")
-        pd_z = get_reflectometry_value("PD_Z")
-        s3_max = get_reflectometry_value("S3_MAX")
-        s4_max = get_reflectometry_value("S4_MAX")
-        max_theta = get_reflectometry_value("MAX_THETA")
-        natural_angle = get_reflectometry_value("NATURAL_ANGLE")
-        has_height2 = get_reflectometry_value("HAS_HEIGHT2") == "YES"
-
-        return InstrumentConstant(
-            s1s2=s2_z - s1_z,
-            s2sa=sample_z - s2_z,
-            max_theta=max_theta,  # usual maximum angle
-            s4max=s4_max,  # max s4_vg at max Theta
-            s3max=s3_max,  # max s4_vg at max Theta
-            sm_sa=sample_z - sm_z,
-            incoming_beam_angle=natural_angle,
-            has_height2=has_height2)
+        return _constants_from_values(get_reflectometry_values(CONSTANT_VALUE_NAMES, pv_source))
     except Exception as e:
         raise ValueError("No instrument value pvs to calculated requested result: {}".format(e))
 
 
-def get_reflectometry_value(value_name):
+def _constants_from_values(values):
+    """
+    Returns: instrument constants built from the REFL server values
+    """
+    sm_z = values["SM2_Z"]  # set to SM2_Z for now, needs updating to include both.
+
+    return InstrumentConstant(
+        s1s2=values["S2_Z"] - values["S1_Z"],
+        s2sa=values["SAMPLE_Z"] - values["S2_Z"],
+        max_theta=values["MAX_THETA"],  # usual maximum angle
+        s4max=values["S4_MAX"],  # max s4_vg at max Theta
+        s3max=values["S3_MAX"],  # max s4_vg at max Theta
+        sm_sa=values["SAMPLE_Z"] - sm_z,
+        incoming_beam_angle=values["NATURAL_ANGLE"],
+        has_height2=values["HAS_HEIGHT2"] == "YES")
+
+
+def get_reflectometry_value(value_name, pv_source=None):
     """
     :param value_name: name of the value
+    :param pv_source: object with a get_pv(pv_name, is_local) method to read the PV from; None for genie
     :return: value for the value_name stored in the pv on the REFL server
     :raises IOError: if PV does not exist
     """
-    pv_name = "REFL_01:CONST:{}".format(value_name)
-    value = g.get_pv(pv_name, is_local=True)
+    if pv_source is None:
+        pv_source = g
+    pv_name = REFLECTOMETRY_CONSTANT_PV.format(value_name)
+    value = pv_source.get_pv(pv_name, is_local=True)
     if value is None:
         raise IOError("PV {} does not exist".format(pv_name))
 
     return value
+
+
+def get_reflectometry_values(value_names, pv_source=None, max_workers=CONSTANTS_READ_WORKERS):
+    """
+    Read several values from the REFL server at once; the PVs are read concurrently so the time taken is roughly that
+    of a single read.
+    :param value_names: names of the values
+    :param pv_source: object with a get_pv(pv_name, is_local) method to read the PVs from; None for genie
+    :param max_workers: maximum number of concurrent reads; 1 to read serially
+    :return: dictionary of value name to value stored in the pv on the REFL server
+    :raises IOError: if any of the PVs do not exist; the error lists all missing PVs
+    """
+    value_names = list(value_names)
+
+    def _read(value_name):
+        try:
+            return get_reflectometry_value(value_name, pv_source)
+        except Exception as e:
+            return e
+
+    if (max_workers is None or max_workers > 1) and len(value_names) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            values = list(executor.map(_read, value_names))
+    else:
+        values = [_read(value_name) for value_name in value_names]
+    results = OrderedDict(zip(value_names, values))
+
+    errors = [str(value) for value in results.values() if isinstance(value, Exception)]
+    if errors:
+        raise IOError(", ".join(errors))
+    return results
+
+
+class LocalPVSource(object):
+    """
+    Stand in for the REFL server PVs so that the constants can be read without EPICS
+    """
+    def __init__(self, values=None):
+        """
+        Initialiser.
+        Args:
+            values: dictionary of value name (e.g. S1_Z) to value; names not given do not exist
+        """
+        self.pvs = {}
+        for name, value in (values or {}).items():
+            self.set_value(name, value)
+
+    def set_value(self, value_name, value):
+        """
+        Set a value on the stand in REFL server
+        Args:
+            value_name: name of the value, e.g. S1_Z
+            value: value to set
+        """
+        self.pvs[REFLECTOMETRY_CONSTANT_PV.format(value_name)] = value
+
+    def get_pv(self, pv_name, is_local=False):
+        """
+        Args:
+            pv_name: name of the pv
+            is_local: ignored; present to match the genie signature
+
+        Returns: value of the pv; None if it does not exist
+        """
+        return self.pvs.get(pv_name)
+
+    def __repr__(self):
+        return "Local PV source: {}".format(self.pvs)
+
+
+_SNAPSHOT_FILENAME = None
+_SNAPSHOT_FIRST = False
+# True once the snapshot used first has been, or is being, checked against the REFL server
+_SNAPSHOT_CHECKED = False
+
+
+def save_constants_snapshot(filename, pv_source=None):
+    """
+    Read the REFL server values the instrument constants are built from and save them to a snapshot file, with a
+    format version, the time they were read and a hash of the values to detect a corrupted or edited file.
+    Args:
+        filename: name of the file to write
+        pv_source: object with a get_pv(pv_name, is_local) method to read PVs from; None for genie
+
+    Returns: the snapshot as a dictionary
+    """
+    values = get_reflectometry_values(CONSTANT_VALUE_NAMES, pv_source)
+    snapshot = OrderedDict([("version", CONSTANTS_SNAPSHOT_VERSION), ("timestamp", time.time()),
+                            ("hash", _values_hash(values)), ("values", values)])
+    with open(filename, "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+    return snapshot
+
+
+def load_constants_snapshot(filename):
+    """
+    Load instrument constants from a snapshot file
+    Args:
+        filename: name of the file written by save_constants_snapshot
+
+    Returns: the instrument constants and the snapshot as a dictionary
+    Raises:
+        ValueError: if the file is a different version or its hash does not match its values
+    """
+    with open(filename) as snapshot_file:
+        snapshot = json.load(snapshot_file, object_pairs_hook=OrderedDict)
+    if snapshot.get("version") != CONSTANTS_SNAPSHOT_VERSION:
+        raise ValueError("Constants snapshot {} is version {}, expected {}".format(
+            filename, snapshot.get("version"), CONSTANTS_SNAPSHOT_VERSION))
+    if snapshot.get("hash") != _values_hash(snapshot.get("values", {})):
+        raise ValueError("Constants snapshot {} does not match its hash".format(filename))
+    return _constants_from_values(snapshot["values"]), snapshot
+
+
+def verify_constants_snapshot(filename, pv_source=None):
+    """
+    Compare a snapshot with the values on the REFL server
+    Args:
+        filename: name of the snapshot file
+        pv_source: object with a get_pv(pv_name, is_local) method to read PVs from; None for genie
+
+    Returns: dictionary of the name of each value which has changed to its (snapshot value, REFL server value)
+    """
+    _, snapshot = load_constants_snapshot(filename)
+    live_values = get_reflectometry_values(CONSTANT_VALUE_NAMES, pv_source)
+    return OrderedDict((name, (snapshot["values"].get(name), value)) for name, value in live_values.items()
+                       if snapshot["values"].get(name) != value)
+
+
+def use_constants_snapshot(filename, snapshot_first=False):
+    """
+    Use a constants snapshot. By default it is only used if the REFL server can not be read, e.g. for dry runs and
+    planning offline. With snapshot_first the snapshot is used straight away and checked against the REFL server in the
+    background; if they differ a warning is written and the constants from the REFL server are used from then on.
+    Args:
+        filename: name of the snapshot file; None to stop using a snapshot
+        snapshot_first: True to use the snapshot before reading the REFL server
+    """
+    global _SNAPSHOT_FILENAME, _SNAPSHOT_FIRST, _SNAPSHOT_CHECKED
+    _SNAPSHOT_FILENAME = filename
+    _SNAPSHOT_FIRST = snapshot_first
+    _SNAPSHOT_CHECKED = False
+    invalidate_instrument_constants()
+
+
+def _verify_in_background(filename, generation):
+    """
+    Check a snapshot against the REFL server. If it has drifted the snapshot is no longer used first, so later fetches
+    read the REFL server, and the cached constants are replaced unless the cache has been invalidated since the
+    snapshot was loaded (its generation has changed).
+    """
+    global _SNAPSHOT_FIRST, _SNAPSHOT_CHECKED
+    try:
+        drift = verify_constants_snapshot(filename)
+        constants = read_instrument_constants() if drift else None
+    except Exception as e:
+        sys.stderr.write("Could not verify constants snapshot {} against the REFL server: {}\n".format(filename, e))
+        if filename == _SNAPSHOT_FILENAME:
+            _SNAPSHOT_CHECKED = False  # check again on the next fetch
+        return
+    if drift:
+        changes = ", ".join("{} {} -> {}".format(name, old, new) for name, (old, new) in drift.items())
+        sys.stderr.write("Constants snapshot {} differs from the REFL server, using its values: {}\n".format(
+            filename, changes))
+        if filename == _SNAPSHOT_FILENAME:
+            _SNAPSHOT_FIRST = False
+        _CONSTANTS_CACHE.put(constants, generation)
+
+
+def _values_hash(values):
+    """
+    Returns: hash of the values, independent of their order
+    """
+    content = json.dumps(sorted(values.items()), separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
@@ -0,0 +1,75 @@
+"""
+Append only journal of completed experiment steps, so that an interrupted script can be resumed
+"""
+import json
+import os
+import time
+from collections import namedtuple
+
+JournalEntry = namedtuple("JournalEntry", ["key", "description", "sample", "angle", "counts", "run", "time"])
+JournalEntry.__doc__ = """
+A completed step: its key, description, sample title, angle (None for a transmission), counts (dictionary of count type
+to amount), run number (None if it did not count) and the time it completed
+"""
+
+
+class ExperimentJournal(object):
+    """
+    Journal of completed steps written as one compact json object per line; each line is flushed to disk before the
+    next step starts so that the journal survives a crash or power cut.
+    """
+    def __init__(self, filename):
+        """
+        Initialiser.
+        Args:
+            filename: name of the journal file; it is created if it does not exist and appended to if it does
+        """
+        self.filename = filename
+
+    def record(self, key, description, sample, angle, counts, run):
+        """
+        Record a completed step
+        Args:
+            key: unique key for the step
+            description: description of the step
+            sample: title of the sample
+            angle: angle measured at; None for a transmission
+            counts: dictionary of count type to amount, e.g. {"count_uamps": 5}
+            run: run number the step was written to; None if it did not count
+
+        Returns:
+            JournalEntry: the entry recorded
+        """
+        entry = JournalEntry(key, description, sample, angle, counts, run, time.time())
+        line = json.dumps(entry._asdict(), separators=(",", ":"), default=str)
+        with open(self.filename, "a") as journal_file:
+            journal_file.write(line + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        return entry
+
+    def entries(self):
+        """
+        Returns:
+            list[JournalEntry]: the entries in the journal in the order they were recorded; a partly written last line,
+                e.g. from a crash, is ignored
+        """
+        if not os.path.exists(self.filename):
+            return []
+        entries = []
+        with open(self.filename) as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(JournalEntry(**json.loads(line)))
+                except (ValueError, TypeError):
+                    continue
+        return entries
+
+    def completed_keys(self):
+        """
+        Returns: dictionary of the key of each completed step to its journal entry
+        """
+        return {entry.key: entry for entry in self.entries()}
+
+    def __repr__(self):
+        return "Experiment journal: {}".format(self.filename)
@@ -0,0 +1,145 @@
+"""
+Kinetic (time resolved) measurements: set the geometry once, then count many short slices one after another with as
+little dead time between them as possible
+"""
+import time
+from collections import namedtuple
+
+from .alarm_monitor import alarm_guard, check_alarms_before_counting, release_paused_run
+from .base import _Movement, _run_angle
+from .genie_backend import g, monotonic
+from .instrument_constants import get_instrument_constants
+from .multi_period import wait_for_counts
+from .tracing import TRACER
+
+# Title of each slice; formatted with the title set by run_angle and the slice number
+DEFAULT_SLICE_TITLE = "{title} slice {slice}"
+
+KineticSlice = namedtuple("KineticSlice", ["slice", "title", "run", "period", "start", "end", "dead_time"])
+KineticSlice.__doc__ = """
+One slice of a kinetic measurement: its number (from 1), title, run number, period (None if counted in runs), the times
+counting started and ended (seconds since the epoch) and the dead time in seconds between the end of counting the
+previous slice and the start of counting this one (None for the first slice)
+"""
+
+
+class KineticsResult(object):
+    """
+    The slices counted in a kinetic measurement
+    """
+    def __init__(self, slices):
+        """
+        Initialiser.
+        Args:
+            slices (list[KineticSlice]): the slices
+        """
+        self.slices = list(slices)
+
+    def dead_times(self):
+        """
+        Returns: dead time in seconds before each slice after the first
+        """
+        return [kinetic_slice.dead_time for kinetic_slice in self.slices if kinetic_slice.dead_time is not None]
+
+    def report(self):
+        """
+        Returns: summary of the dead time between slices
+        """
+        dead_times = self.dead_times()
+        if not dead_times:
+            return "{} slices, no dead time measured".format(len(self.slices))
+        return "{} slices, dead time between slices: mean {:.3f} s, max {:.3f} s, total {:.3f} s".format(
+            len(self.slices), sum(dead_times) / len(dead_times), max(dead_times), sum(dead_times))
+
+    def __repr__(self):
+        return "Kinetics result: {}".format(self.report())
+
+
+def run_kinetics(sample, angle, slices, count_uamps=None, count_seconds=None, count_frames=None, use_periods=False,
+                 slice_title=DEFAULT_SLICE_TITLE, dry_run=False, **kwargs):
+    """
+    Move to an angle once, as run_angle does, then count a number of slices one after another without moving or
+    reading anything between them. Each slice is its own run with its own title, or with periods each slice is a
+    period of one run (the run keeps the first slice's title and the slice titles are only recorded). The time each
+    slice starts and ends and the dead time between slices are recorded.
+    Args:
+        sample (techniques.reflectometry.sample.Sample): The sample to measure
+        angle: The angle to measure at
+        slices: number of slices to count
+        count_uamps: current to count each slice for; None for use count_seconds
+        count_seconds: time to count each slice for if uamps not set; None for use count_frames
+        count_frames: frames to count each slice for if uamps and seconds are not set
+        use_periods: True to count the slices into periods of one run; False to count each one as a run
+        slice_title: title for each slice, formatted with title (the run_angle title) and slice (the slice number)
+        dry_run: If True just print what would happen; If False, run the experiment
+        kwargs: other arguments for run_angle, e.g. mode
+
+    Examples:
+        >>> result = run_kinetics(my_sample, 0.7, 60, count_seconds=10, mode="NR")
+        Counts 60 runs of 10 s each at 0.7 and prints the dead time between them.
+
+    Returns:
+        KineticsResult: the slices counted
+    """
+    if count_uamps is None and count_seconds is None and count_frames is None:
+        raise ValueError("A kinetic measurement needs count_uamps, count_seconds or count_frames")
+    print("** Kinetics {} **".format(sample.title))
+
+    with TRACER.step("Kinetics {} th={}".format(sample.title, angle)), alarm_guard():
+        movement = _Movement(dry_run, skip_unchanged=True, check_limits=True)
+        movement.dry_run_warning()
+        constants = get_instrument_constants()
+        movement.seed_setpoints()
+        movement.change_to_soft_period_count(slices if use_periods else 1)
+        _run_angle(movement, constants, sample, angle, **kwargs)
+        movement.wait_for_move()
+        titles = [slice_title.format(title=movement.last_title, slice=index + 1) for index in range(slices)]
+        if dry_run:
+            for title in titles:
+                print("Slice: {}".format(title))
+            result = KineticsResult([])
+        else:
+            result = _count_slices(titles, use_periods, count_uamps, count_seconds, count_frames)
+    print(result.report())
+    return result
+
+
+def _count_slices(titles, use_periods, count_uamps, count_seconds, count_frames):
+    """
+    Count each slice in a tight loop; nothing is printed until the loop finishes. The alarms are checked before each
+    slice begins or resumes counting. If a slice fails the run is ended.
+    """
+    slices = []
+    previous_end = None
+    run = None
+    try:
+        for index, title in enumerate(titles):
+            period = index + 1 if use_periods else None
+            check_alarms_before_counting()
+            if not use_periods:
+                g.change_title(title)
+                g.begin()
+                run = g.get_runnumber()
+            elif index == 0:
+                g.change_title(title)
+                g.begin(period=period)
+                run = g.get_runnumber()
+            else:
+                g.change_period(period)
+                g.resume()
+            start, start_time = monotonic(), time.time()
+            wait_for_counts(count_uamps, count_seconds, count_frames)
+            end, end_time = monotonic(), time.time()
+            if use_periods:
+                release_paused_run()
+                if g.get_runstate() == "RUNNING":
+                    g.pause()
+            else:
+                g.end()
+            dead_time = None if previous_end is None else start - previous_end
+            previous_end = end
+            slices.append(KineticSlice(index + 1, title, run, period, start_time, end_time, dead_time))
+    finally:
+        if g.get_runstate() != "SETUP":
+            g.end()
+    return KineticsResult(slices)
@@ -0,0 +1,212 @@
+"""
+Model of how long moves and counts take, used to estimate the time an experiment will take in a dry run
+"""
+import json
+from math import sqrt
+
+# Proton current, in uA, used to estimate how long a count in uamps takes
+DEFAULT_PROTON_CURRENT = 40.0
+
+# Frame rate, in Hz, used to estimate how long a count in frames takes
+DEFAULT_FRAME_RATE = 10.0
+
+
+class AxisKinematics(object):
+    """
+    Kinematics of a single axis (block); moves are modelled as a trapezoidal velocity profile followed by a settle time
+    """
+    def __init__(self, velocity, acceleration, settle_time=0.0):
+        """
+        Initialiser.
+        Args:
+            velocity: maximum velocity in block units per second
+            acceleration: acceleration in block units per second squared
+            settle_time: time in seconds for the axis to settle after the move (or to change, for non-numeric blocks)
+        """
+        self.velocity = float(velocity)
+        self.acceleration = float(acceleration)
+        self.settle_time = float(settle_time)
+
+    def move_time(self, start, end):
+        """
+        Time for a move of the axis
+        Args:
+            start: start position; None if unknown in which case the move is assumed to start from 0
+            end: end position
+
+        Returns: time for the move in seconds; 0 if the axis does not move
+        """
+        if start == end:
+            return 0.0
+        try:
+            distance = abs(float(end) - float(start if start is not None else 0.0))
+        except (TypeError, ValueError):
+            return self.settle_time  # not a position, e.g. a mode or IN/OUT, so it only takes the time to change
+
+        ramp_distance = self.velocity ** 2 / self.acceleration
+        if distance >= ramp_distance:
+            travel_time = distance / self.velocity + self.velocity / self.acceleration
+        else:
+            travel_time = 2.0 * sqrt(distance / self.acceleration)
+        return travel_time + self.settle_time
+
+    def __repr__(self):
+        return "velocity={}, acceleration={}, settle_time={}".format(self.velocity, self.acceleration,
+                                                                     self.settle_time)
+
+
+# Kinematics used for blocks not in the model
+DEFAULT_AXIS = AxisKinematics(velocity=1.0, acceleration=1.0, settle_time=1.0)
+
+# Typical kinematics for each block; these should be overridden with values for the instrument from a file
+DEFAULT_AXES = {
+    "TRANS": AxisKinematics(velocity=2.0, acceleration=4.0, settle_time=1.0),
+    "THETA": AxisKinematics(velocity=0.1, acceleration=0.2, settle_time=2.0),
+    "PHI": AxisKinematics(velocity=0.2, acceleration=0.5, settle_time=1.0),
+    "PSI": AxisKinematics(velocity=0.2, acceleration=0.5, settle_time=1.0),
+    "HEIGHT": AxisKinematics(velocity=0.5, acceleration=1.0, settle_time=1.0),
+    "HEIGHT2": AxisKinematics(velocity=1.0, acceleration=2.0, settle_time=1.0),
+    "SM2ANGLE": AxisKinematics(velocity=0.05, acceleration=0.1, settle_time=2.0),
+    "SM2INBEAM": AxisKinematics(velocity=1.0, acceleration=1.0, settle_time=20.0),
+    "MODE": AxisKinematics(velocity=1.0, acceleration=1.0, settle_time=2.0),
+}
+for _slit in [1, 2, 3, 4]:
+    DEFAULT_AXES["S{}VG".format(_slit)] = AxisKinematics(velocity=0.5, acceleration=2.0, settle_time=0.5)
+    DEFAULT_AXES["S{}HG".format(_slit)] = AxisKinematics(velocity=2.0, acceleration=4.0, settle_time=0.5)
+
+
+class MoveTimeModel(object):
+    """
+    Estimates how long moves and counts take
+    """
+    def __init__(self, axes=None, default_axis=DEFAULT_AXIS, proton_current=DEFAULT_PROTON_CURRENT,
+                 frame_rate=DEFAULT_FRAME_RATE):
+        """
+        Initialiser.
+        Args:
+            axes: dictionary of block name to AxisKinematics; these override the default axes
+            default_axis: kinematics for blocks which are not in axes or the default axes
+            proton_current: proton current in uA used to convert uamps to time
+            frame_rate: frame rate in Hz used to convert frames to time
+        """
+        self.axes = dict(DEFAULT_AXES)
+        self.axes.update(axes or {})
+        self.default_axis = default_axis
+        self.proton_current = float(proton_current)
+        self.frame_rate = float(frame_rate)
+
+    @staticmethod
+    def from_file(filename):
+        """
+        Load a model from a json file of the form:
+            {"proton_current": 40, "frame_rate": 10,
+             "axes": {"TRANS": {"velocity": 2, "acceleration": 4, "settle_time": 1}, ...}}
+        All entries are optional; anything missing uses the defaults.
+        Args:
+            filename: name of the file
+
+        Returns:
+            MoveTimeModel: the model
+        """
+        with open(filename) as model_file:
+            config = json.load(model_file)
+        axes = {block: AxisKinematics(**kinematics) for block, kinematics in config.get("axes", {}).items()}
+        return MoveTimeModel(axes, proton_current=config.get("proton_current", DEFAULT_PROTON_CURRENT),
+                             frame_rate=config.get("frame_rate", DEFAULT_FRAME_RATE))
+
+    def axis(self, block):
+        """
+        Args:
+            block: block name
+
+        Returns:
+            AxisKinematics: kinematics for the block
+        """
+        return self.axes.get(block, self.default_axis)
+
+    def move_time(self, block, start, end):
+        """
+        Args:
+            block: block name
+            start: start position; None if unknown
+            end: end position
+
+        Returns: time in seconds to move the block
+        """
+        return self.axis(block).move_time(start, end)
+
+    def stages_time(self, stages, start_positions):
+        """
+        Time to make a set of moves where the blocks in each stage move together and each stage waits for the one
+        before it to finish. A block may move in several stages; each move starts where the one before it ended.
+        Args:
+            stages: list of dictionaries of block name to end position
+            start_positions: dictionary of block name to start position; missing blocks have unknown start positions
+
+        Returns: time in seconds for all the moves
+        """
+        positions = dict(start_positions)
+        total = 0.0
+        for stage in stages:
+            total += max([self.move_time(block, positions.get(block), end) for block, end in stage.items()],
+                         default=0.0)
+            positions.update(stage)
+        return total
+
+    def count_time(self, count_uamps=None, count_seconds=None, count_frames=None, count_target=None):
+        """
+        Time to count until the count target or for one of uamps, seconds, frames if not None in that order, as in
+        _Movement.count_for
+        Args:
+            count_uamps: number of uamps to count for
+            count_seconds: number of seconds to count for
+            count_frames: number of frames to count for
+            count_target (techniques.reflectometry.adaptive_counting.CountTarget): statistics to count until
+
+        Returns: time in seconds to count; 0 if no count is given
+        """
+        if count_target is not None:
+            return count_target.estimated_seconds()
+        elif count_uamps is not None:
+            return 3600.0 * count_uamps / self.proton_current
+        elif count_seconds is not None:
+            return float(count_seconds)
+        elif count_frames is not None:
+            return count_frames / self.frame_rate
+        return 0.0
+
+    def __repr__(self):
+        return "Move time model: proton_current={}, frame_rate={}, axes={}".format(
+            self.proton_current, self.frame_rate, self.axes)
+
+
+_MOVE_TIME_MODEL = MoveTimeModel()
+
+
+def get_move_time_model():
+    """
+    Returns:
+        MoveTimeModel: the model used to estimate times in dry runs
+    """
+    return _MOVE_TIME_MODEL
+
+
+def set_move_time_model(model):
+    """
+    Set the model used to estimate times in dry runs
+    Args:
+        model (MoveTimeModel|str): the model, or the name of a json file to load it from
+    """
+    global _MOVE_TIME_MODEL
+    if not isinstance(model, MoveTimeModel):
+        model = MoveTimeModel.from_file(model)
+    _MOVE_TIME_MODEL = model
+
+
+def format_seconds(seconds):
+    """
+    Returns: seconds formatted as h:mm:ss
+    """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
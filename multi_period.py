@@ -0,0 +1,165 @@
+"""
+Multi-period acquisition: write a sequence of counts into successive soft periods of a single run, pausing to move
+between them, rather than beginning and ending a run for each count
+"""
+import json
+from collections import OrderedDict, namedtuple
+
+from .adaptive_counting import count_until
+from .alarm_monitor import check_alarms_before_counting, release_paused_run, wait_for_count
+from .genie_backend import g
+
+PeriodRecord = namedtuple("PeriodRecord", ["period", "description", "title", "counts"])
+PeriodRecord.__doc__ = """
+What was counted in a period: the period number, a description of the step, the title it would have had as its own run
+and the counts (dictionary of count type to amount)
+"""
+
+
+def wait_for_counts(count_uamps, count_seconds, count_frames, count_target=None):
+    """
+    Wait while the run counts for one of count target, uamps, seconds or frames; uamps and frames are counted from where
+    the run is now, so a period or resumed run counts only its own share
+    Args:
+        count_uamps: number of uamps to count for; None count in a different way
+        count_seconds: number of seconds to count for; None count in a different way
+        count_frames: number of frames to count for; None count in a different way
+        count_target (techniques.reflectometry.adaptive_counting.CountTarget): statistics to count until; None count in
+            a different way
+    """
+    if count_target is not None:
+        count_until(count_target)
+    elif count_uamps is not None:
+        wait_for_count(uamps=g.get_uamps() + count_uamps)
+    elif count_seconds is not None:
+        wait_for_count(seconds=count_seconds)
+    elif count_frames is not None:
+        wait_for_count(frames=g.get_frames() + count_frames)
+
+
+class MultiPeriodRun(object):
+    """
+    A run whose periods are counted one after another. The first count begins the run in period 1; each later count
+    changes period while the run is paused, resumes, and pauses again when it has counted, so the instrument can move
+    between periods. A count can also be made into a given period, e.g. to add to a period counted earlier. The run
+    title is the title when the run began; each period's title is kept in its record.
+    """
+    def __init__(self, periods, dry_run=False):
+        """
+        Initialiser.
+        Args:
+            periods: number of soft periods in the run
+            dry_run: True to just print what would happen
+        """
+        self.periods = periods
+        self.dry_run = dry_run
+        self.records = []
+        self.run_number = None
+        self.started = False
+        self.saved = False  # True once the run has ended with its periods saved
+
+    @property
+    def next_period(self):
+        """
+        Returns: the period after the highest period counted so far
+        """
+        return max([record.period for record in self.records], default=0) + 1
+
+    def periods_counted(self):
+        """
+        Returns: number of different periods counted
+        """
+        return len(set(record.period for record in self.records))
+
+    def count(self, count_uamps, count_seconds, count_frames, count_target=None, description=None, title=None,
+              period=None):
+        """
+        Count into a period for one of count target, uamps, seconds or frames, as _Movement.count_for does
+        Args:
+            count_uamps: number of uamps to count for; None count in a different way
+            count_seconds: number of seconds to count for; None count in a different way
+            count_frames: number of frames to count for; None count in a different way
+            count_target (techniques.reflectometry.adaptive_counting.CountTarget): statistics to count until; None
+                count in a different way
+            description: description of what is being counted, for the record
+            title: title of what is being counted, for the record
+            period: period to count into; None for the next period
+
+        Returns:
+            PeriodRecord: the record of the period
+        """
+        period = period if period is not None else self.next_period
+        if not 1 <= period <= self.periods:
+            raise ValueError("Period {} is not one of the {} periods of the run".format(period, self.periods))
+        counts = OrderedDict((name, value) for name, value in (
+            ("count_target", count_target), ("count_uamps", count_uamps), ("count_seconds", count_seconds),
+            ("count_frames", count_frames)) if value is not None)
+        print("Count period {} of {}: {}".format(period, self.periods, ", ".join(
+            "{}={}".format(name, value) for name, value in counts.items())))
+
+        if not self.dry_run:
+            check_alarms_before_counting()
+            if not self.started:
+                g.begin(period=period)
+                self.run_number = g.get_runnumber()
+                self.started = True
+            else:
+                g.change_period(period)
+                g.resume()
+            wait_for_counts(count_uamps, count_seconds, count_frames, count_target)
+            release_paused_run()  # the run stays paused while moving to the next period, even when the alarms clear
+            if g.get_runstate() == "RUNNING":
+                g.pause()
+
+        record = PeriodRecord(period, description, title, counts)
+        self.records.append(record)
+        return record
+
+    def end(self):
+        """
+        End the run if it has begun
+        """
+        print("Multi-period run {} ended after {} of {} periods".format(self.run_number, self.periods_counted(),
+                                                                        self.periods))
+        if self.started and not self.dry_run:
+            g.end()
+            self.saved = True
+        self.started = False
+
+    def abort(self):
+        """
+        Stop the run if it has begun. The periods already counted are kept by ending the run; it is only aborted if
+        none has been counted yet.
+        """
+        print("Multi-period run {} stopped after {} of {} periods".format(self.run_number, self.periods_counted(),
+                                                                          self.periods))
+        if self.started and not self.dry_run:
+            if self.records:
+                g.end()
+                self.saved = True
+            else:
+                g.abort()
+        self.started = False
+
+    def period_map(self):
+        """
+        Returns: table of the period each step was counted in
+        """
+        lines = ["{:>6}  {}".format("period", "step")]
+        for record in self.records:
+            lines.append("{:>6}  {} ({})".format(record.period, record.description, record.title))
+        return "\n".join(lines)
+
+    def save(self, filename):
+        """
+        Save the run number and period records to a json file, to use when reducing the data
+        Args:
+            filename: name of the file
+        """
+        with open(filename, "w") as period_file:
+            periods = [record._asdict() for record in self.records]
+            json.dump(OrderedDict([("run", self.run_number), ("periods", periods)]), period_file, indent=2, default=str)
+
+    def __repr__(self):
+        return "Multi-period run {}: {} of {} periods counted".format(self.run_number, self.periods_counted(),
+                                                                      self.periods)
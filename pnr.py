@@ -0,0 +1,177 @@
+"""
+Polarised neutron reflectometry: count each flipper state at an angle without moving anything else between them
+"""
+from collections import OrderedDict, namedtuple
+
+from .alarm_monitor import alarm_guard
+from .base import _Movement, _run_angle, _print_time_estimate
+from .genie_backend import g
+from .instrument_constants import get_instrument_constants
+from .multi_period import MultiPeriodRun
+from .tracing import TRACER
+
+StateCount = namedtuple("StateCount", ["state", "period", "run", "counts"])
+StateCount.__doc__ = """
+A count of one flipper state: the state, the period it was counted in (None if counted in runs), the run number and the
+counts (dictionary of count type to amount)
+"""
+
+
+class FlipperConfig(object):
+    """
+    The spin states to measure, the block values which select each one, and how much of the count each one gets
+    """
+    def __init__(self, states, dwell_ratios=None, settle_seconds=0.0):
+        """
+        Initialiser.
+        Args:
+            states: ordered dictionary of state name to a dictionary of block name to value which selects the state,
+                e.g. OrderedDict([("up", {"FLIPPER": "OFF"}), ("down", {"FLIPPER": "ON"})])
+            dwell_ratios: dictionary of state name to its share of the count; None to count each state equally
+            settle_seconds: time to wait after changing state before counting
+        """
+        self.states = OrderedDict(states)
+        self.dwell_ratios = OrderedDict((state, float((dwell_ratios or {}).get(state, 1.0))) for state in self.states)
+        if any(ratio <= 0 for ratio in self.dwell_ratios.values()):
+            raise ValueError("Dwell ratios must be positive: {}".format(dict(self.dwell_ratios)))
+        self.settle_seconds = settle_seconds
+
+    def fractions(self):
+        """
+        Returns: dictionary of state name to the fraction of the count it gets
+        """
+        total = sum(self.dwell_ratios.values())
+        return OrderedDict((state, ratio / total) for state, ratio in self.dwell_ratios.items())
+
+    def __repr__(self):
+        return "Flipper config: states={}, dwell ratios={}, settle {} s".format(
+            dict(self.states), dict(self.dwell_ratios), self.settle_seconds)
+
+
+def interleaved_schedule(flipper, cycles=1):
+    """
+    Split each state's count into cycles and order them so that beam drift affects all states alike: the state order
+    is reversed every other cycle (e.g. up down down up) and the same state twice in a row is counted as one.
+    Args:
+        flipper (FlipperConfig): the states to count
+        cycles: number of times to cycle through the states
+
+    Returns: list of (state, fraction of the total count)
+    """
+    if cycles < 1:
+        raise ValueError("Cycles must be at least 1, not {}".format(cycles))
+    fractions = flipper.fractions()
+    schedule = []
+    for cycle in range(cycles):
+        states = list(fractions) if cycle % 2 == 0 else list(reversed(fractions))
+        for state in states:
+            fraction = fractions[state] / cycles
+            if schedule and schedule[-1][0] == state:
+                schedule[-1] = (state, schedule[-1][1] + fraction)
+            else:
+                schedule.append((state, fraction))
+    return schedule
+
+
+def run_angle_pnr(sample, angle, flipper, count_uamps=None, count_seconds=None, count_frames=None, cycles=1,
+                  use_periods=True, dry_run=False, **kwargs):
+    """
+    Move to an angle once, as run_angle does, then count each flipper state in turn without moving anything else.
+    The count is shared between the states by their dwell ratios. With periods each state is counted into its own
+    period of one run, pausing to change state; otherwise each state is counted as a separate run.
+    Args:
+        sample (techniques.reflectometry.sample.Sample): The sample to measure
+        angle: The angle to measure at
+        flipper (FlipperConfig): the states to count
+        count_uamps: total current for all the states; None for use count_seconds
+        count_seconds: total time for all the states if uamps not set; None for use count_frames
+        count_frames: total frames for all the states if uamps and seconds are not set
+        cycles: number of times to cycle through the states, to average out drift in the beam
+        use_periods: True to count the states into periods of one run; False to count each one as a run
+        dry_run: If True just print what would happen; If False, run the experiment
+        kwargs: other arguments for run_angle, e.g. mode="PNR"
+
+    Examples:
+        >>> flipper = FlipperConfig(OrderedDict([("up", {"FLIPPER": "OFF"}), ("down", {"FLIPPER": "ON"})]),
+        >>>                         dwell_ratios={"up": 1, "down": 2})
+        >>> run_angle_pnr(my_sample, 0.7, flipper, count_uamps=30, cycles=2, mode="PNR")
+        Counts 5 uamps up, 20 uamps down and 5 uamps up into periods 1 and 2 of one run.
+
+    Returns:
+        list[StateCount]: what was counted for each state, in the order it was counted
+    """
+    if count_uamps is None and count_seconds is None and count_frames is None:
+        raise ValueError("A PNR measurement needs count_uamps, count_seconds or count_frames")
+    schedule = interleaved_schedule(flipper, cycles)
+    print("** Run angle PNR {} **".format(sample.title))
+
+    with TRACER.step("Run angle PNR {} th={}".format(sample.title, angle)), alarm_guard():
+        movement = _Movement(dry_run, skip_unchanged=True, check_limits=True)
+        movement.dry_run_warning()
+        constants = get_instrument_constants()
+        movement.seed_setpoints()
+        movement.change_to_soft_period_count(len(flipper.states) if use_periods else 1)
+        _run_angle(movement, constants, sample, angle, **kwargs)
+        state_counts = _count_states(movement, flipper, schedule, use_periods, count_uamps, count_seconds,
+                                     count_frames)
+    if dry_run:
+        _print_time_estimate(movement, count_uamps, count_seconds, count_frames)
+    return state_counts
+
+
+def _count_states(movement, flipper, schedule, use_periods, count_uamps, count_seconds, count_frames):
+    """
+    Count each state in the schedule; only the flipper blocks are set between counts. If a count fails the run is
+    ended and the flipper is set back to the first state.
+    """
+    count_name, total = next((name, value) for name, value in (  # the first given is counted, as in count_for
+        ("count_uamps", count_uamps), ("count_seconds", count_seconds), ("count_frames", count_frames))
+        if value is not None)
+    periods = {state: index + 1 for index, state in enumerate(flipper.states)}
+    title = movement.last_title
+    period_run = MultiPeriodRun(len(flipper.states), movement.dry_run) if use_periods else None
+    state_counts = []
+    completed = False
+    try:
+        for state, fraction in schedule:
+            amount = total * fraction
+            if count_name == "count_frames":
+                amount = int(round(amount))
+            counts = OrderedDict([(count_name, amount)])
+            period = periods[state] if use_periods else None
+            print("Flipper state {} ({}): {}={:.4g}".format(
+                state, "period {}".format(period) if use_periods else "new run", count_name, amount))
+            _set_state(movement, flipper, state)
+
+            count_arguments = OrderedDict([("count_uamps", None), ("count_seconds", None), ("count_frames", None)])
+            count_arguments.update(counts)
+            if use_periods:
+                period_run.count(description=state, title="{} {}".format(title, state), period=period,
+                                 **count_arguments)
+                run = period_run.run_number
+            else:
+                if not movement.dry_run:
+                    g.change_title("{} {}".format(title, state))
+                movement.count_for(**count_arguments)
+                run = movement.last_run_number
+            state_counts.append(StateCount(state, period, run, counts))
+        completed = True
+    finally:
+        if period_run is not None:
+            period_run.end()
+        elif not movement.dry_run and g.get_runstate() != "SETUP":
+            g.end()  # the run of a state whose count failed
+        if not completed and not movement.dry_run:
+            _set_state(movement, flipper, next(iter(flipper.states)))
+    return state_counts
+
+
+def _set_state(movement, flipper, state):
+    """
+    Set the flipper blocks for a state and wait for them to settle
+    """
+    for block, value in flipper.states[state].items():
+        movement.set_block(block, value)
+    movement.wait_for_move()
+    if flipper.settle_seconds:
+        movement.wait_for_seconds(flipper.settle_seconds)
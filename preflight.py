@@ -0,0 +1,106 @@
+"""
+Pre-flight validation: run every step of a script through the normal calculations in dry run and report every setpoint
+which the beamline would refuse, before anything moves. run_angle and transmission make the same checks on their own
+setpoints; see setpoint_limits.
+"""
+import contextlib
+import io
+from collections import namedtuple
+
+from .base import _Movement
+from .instrument_constants import get_instrument_constants
+from .setpoint_limits import get_block_limits, setpoint_problems
+
+Violation = namedtuple("Violation", ["step_index", "step", "block", "value", "problem"])
+Violation.__doc__ = """
+A setpoint which would fail: the index of the step in the script, its description, the block, the value it would be set
+to and what is wrong with it; block and value are None if the step could not be calculated at all
+"""
+
+
+class PreflightError(ValueError):
+    """
+    A script failed pre-flight validation
+    """
+    def __init__(self, report):
+        """
+        Initialiser.
+        Args:
+            report (PreflightReport): the failed report
+        """
+        super(PreflightError, self).__init__("Script failed pre-flight validation:\n{}".format(report))
+        self.report = report
+
+
+class PreflightReport(object):
+    """
+    All the violations found in a script
+    """
+    def __init__(self, step_count, violations, limits_checked=True):
+        """
+        Initialiser.
+        Args:
+            step_count: number of steps checked
+            violations (list[Violation]): the violations found
+            limits_checked: False if no block limits were known, so blocks were not checked against their ranges
+        """
+        self.step_count = step_count
+        self.violations = list(violations)
+        self.limits_checked = limits_checked
+
+    @property
+    def ok(self):
+        """
+        Returns: True if there are no violations
+        """
+        return not self.violations
+
+    def raise_if_failed(self):
+        """
+        Raises:
+            PreflightError: if there are any violations
+        """
+        if not self.ok:
+            raise PreflightError(self)
+
+    def __repr__(self):
+        limits = "" if self.limits_checked else " (no block limits set, see set_block_limits)"
+        if self.ok:
+            return "Pre-flight: {} steps OK{}".format(self.step_count, limits)
+        lines = ["Pre-flight: {} violations in {} steps{}".format(len(self.violations), self.step_count, limits)]
+        for violation in self.violations:
+            setpoint = "" if violation.block is None else " {}={}".format(violation.block, violation.value)
+            lines.append("  Step {} ({}):{} {}".format(violation.step_index + 1, violation.step, setpoint,
+                                                       violation.problem))
+        return "\n".join(lines)
+
+
+def check_steps(steps, constants=None, block_limits=None):
+    """
+    Run each step in dry run and check every setpoint it makes, see setpoint_limits.setpoint_problems. A step which
+    raises an error while being calculated is reported too.
+    Args:
+        steps (list[techniques.reflectometry.scan_plan.PlanStep]): steps to check
+        constants (techniques.reflectometry.instrument_constants.InstrumentConstant): instrument constants; None to
+            read them
+        block_limits: dictionary of block name to (low, high) range; None for the limits set with set_block_limits
+
+    Returns:
+        PreflightReport: the report of all violations
+    """
+    constants = constants if constants is not None else get_instrument_constants()
+    block_limits = block_limits if block_limits is not None else get_block_limits()
+    movement = _Movement(True)
+    violations = []
+    for index, step in enumerate(steps):
+        moves_before_step = len(movement.move_log)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                step.execute(movement, constants)
+        except Exception as e:
+            violations.append(Violation(index, step.describe(), None, None, "could not be calculated: {}".format(e)))
+            continue
+        for block, value in movement.move_log[moves_before_step:]:
+            for problem in setpoint_problems(block, value, constants, block_limits):
+                violations.append(Violation(index, step.describe(), block, value, problem))
+    return PreflightReport(len(steps), violations, limits_checked=bool(block_limits))
@@ -0,0 +1,213 @@
+"""
+Plan the angles, slit gaps and counts needed to measure a sample over a Q range
+"""
+import math
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .instrument_constants import get_instrument_constants
+from .move_time import get_move_time_model, format_seconds
+from .slit_gaps import calculate_slit_gaps_for_angles
+
+# Wavelength band in Angstrom used for each angle; set these to the band of the instrument being used
+DEFAULT_WAVELENGTH_MIN = 2.0
+DEFAULT_WAVELENGTH_MAX = 14.0
+
+# Count time is allocated in proportion to theta to this power: reflectivity falls as Q^-4 while the slits, which open
+# in proportion to theta at a fixed resolution, let through flux in proportion to theta^2
+DEFAULT_COUNT_EXPONENT = 2.0
+
+# Number of decimal places angles are rounded (down) to
+ANGLE_DECIMALS = 3
+
+PlannedAngle = namedtuple("PlannedAngle", ["angle", "q_min", "q_max", "s1vg", "s2vg", "s3vg", "s4vg", "count_seconds"])
+PlannedAngle.__doc__ = """
+One angle of a Q range plan: the angle, the Q range it covers, its vertical slit gaps and the time to count for
+"""
+
+
+class QRangePlan(object):
+    """
+    Angles, slit gaps and count times which cover a Q range
+    """
+    def __init__(self, angles, count_in_uamps=True, model=None):
+        """
+        Initialiser.
+        Args:
+            angles (list[PlannedAngle]): the planned angles
+            count_in_uamps: True to count each angle for uamps; False to count for seconds
+            model (techniques.reflectometry.move_time.MoveTimeModel): model used to convert seconds to uamps; None for
+                the current move time model
+        """
+        self.angles = list(angles)
+        self.count_in_uamps = count_in_uamps
+        self.model = model if model is not None else get_move_time_model()
+
+    def run_angle_arguments(self):
+        """
+        Returns: list of dictionaries of run_angle arguments, one for each angle; these can be passed to run_angle as
+            keyword arguments or used as the angles of batch.run_samples
+        """
+        arguments = []
+        for planned in self.angles:
+            angle_arguments = OrderedDict([("angle", planned.angle), ("s1vg", planned.s1vg), ("s2vg", planned.s2vg),
+                                           ("s3vg", planned.s3vg), ("s4vg", planned.s4vg)])
+            if self.count_in_uamps:
+                angle_arguments["count_uamps"] = planned.count_seconds * self.model.proton_current / 3600.0
+            else:
+                angle_arguments["count_seconds"] = planned.count_seconds
+            arguments.append(angle_arguments)
+        return arguments
+
+    def add_to(self, scan_plan, sample, **kwargs):
+        """
+        Add each angle to a scan plan
+        Args:
+            scan_plan (techniques.reflectometry.scan_plan.ScanPlan): plan to add the angles to
+            sample (techniques.reflectometry.sample.Sample): sample to measure
+            kwargs: other arguments for run_angle used for every angle, e.g. mode
+        """
+        for angle_arguments in self.run_angle_arguments():
+            step_arguments = dict(kwargs)
+            step_arguments.update(angle_arguments)
+            scan_plan.add_angle(sample, **step_arguments)
+
+    def count_seconds(self):
+        """
+        Returns: total time counting in seconds
+        """
+        return sum(planned.count_seconds for planned in self.angles)
+
+    def table(self):
+        """
+        Returns: the plan as a table with one row per angle
+        """
+        lines = ["{:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+            "theta", "q_min", "q_max", "s1vg", "s2vg", "s3vg", "s4vg", "count")]
+        for planned in self.angles:
+            lines.append("{:8.3f} {:8.4f} {:8.4f} {:8.4g} {:8.4g} {:8.4g} {:8.4g} {:>8}".format(
+                *planned[:7], format_seconds(planned.count_seconds)))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Q range plan: {} angles counting for {}\n{}".format(len(self.angles),
+                                                                    format_seconds(self.count_seconds()), self.table())
+
+
+def plan_q_range(q_min, q_max, time_budget, sample=None, resolution=None, footprint=None, overlap=0.1, constants=None,
+                 wavelength_min=DEFAULT_WAVELENGTH_MIN, wavelength_max=DEFAULT_WAVELENGTH_MAX,
+                 count_exponent=DEFAULT_COUNT_EXPONENT, count_in_uamps=True, model=None):
+    """
+    Plan the angles needed to cover a Q range, the slit gaps for each and how to share the time budget between them so
+    that the statistics are similar across the Q range.
+    Angles are chosen so the Q range measured at each angle (set by the wavelength band) overlaps the next by the
+    overlap fraction; s1 and s2 are set from the footprint and resolution and s3 and s4 scale with theta up to their
+    maximum gaps. The time to move between angles is estimated with the move time model and taken off the budget.
+    Args:
+        q_min: smallest Q to measure in inverse Angstrom
+        q_max: largest Q to measure in inverse Angstrom
+        time_budget: total time in seconds for the sample, including moving between angles
+        sample (techniques.reflectometry.sample.Sample): sample to take the resolution and footprint from
+        resolution: resolution to use; None for the sample resolution
+        footprint: footprint to use; None for the sample footprint
+        overlap: fraction of the Q range of each angle which overlaps the next angle
+        constants (techniques.reflectometry.instrument_constants.InstrumentConstant): instrument constants; None to
+            read them
+        wavelength_min: shortest wavelength used in Angstrom
+        wavelength_max: longest wavelength used in Angstrom
+        count_exponent: count time is in proportion to theta to this power
+        count_in_uamps: True to count each angle for uamps; False to count for seconds
+        model (techniques.reflectometry.move_time.MoveTimeModel): model used to estimate moves and convert seconds to
+            uamps; None for the current move time model
+
+    Examples:
+        >>> plan = plan_q_range(0.01, 0.3, 3 * 3600, sample_1)
+        >>> for angle_arguments in plan.run_angle_arguments():
+        >>>     run_angle(sample_1, **angle_arguments)
+
+    Returns:
+        QRangePlan: the plan
+    """
+    resolution = resolution if resolution is not None else _from_sample(sample, "resolution")
+    footprint = footprint if footprint is not None else _from_sample(sample, "footprint")
+    constants = constants if constants is not None else get_instrument_constants()
+    model = model if model is not None else get_move_time_model()
+    if not 0.0 < q_min < q_max:
+        raise ValueError("Q range must have 0 < q_min < q_max, not {} to {}".format(q_min, q_max))
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("Overlap must be at least 0 and less than 1, not {}".format(overlap))
+    if not 0.0 < wavelength_min < wavelength_max:
+        raise ValueError("Wavelength band must have 0 < min < max, not {} to {}".format(
+            wavelength_min, wavelength_max))
+
+    theta = np.array(_angles_for_q_range(q_min, q_max, overlap, wavelength_min, wavelength_max))
+    if theta[-1] > constants.max_theta:
+        raise ValueError("Q max of {} needs theta {:.3f} which is above the maximum theta {}".format(
+            q_max, theta[-1], constants.max_theta))
+
+    gaps = calculate_slit_gaps_for_angles(theta, footprint, resolution, constants)
+    if not np.all(gaps.valid):
+        raise ValueError("Footprint {} and resolution {} give negative slit gaps at theta {}".format(
+            footprint, resolution, ", ".join("{:.3f}".format(angle) for angle in theta[~gaps.valid])))
+    s3 = np.minimum(gaps.s3, constants.s3max)
+    s4 = np.minimum(gaps.s4, constants.s4max)
+
+    move_seconds = sum(
+        max(model.move_time(block, start, end) for block, start, end in zip(
+            ("THETA", "S1VG", "S2VG", "S3VG", "S4VG"),
+            (theta[index - 1], gaps.s1[index - 1], gaps.s2[index - 1], s3[index - 1], s4[index - 1]),
+            (theta[index], gaps.s1[index], gaps.s2[index], s3[index], s4[index])))
+        for index in range(1, len(theta)))
+    count_budget = time_budget - move_seconds
+    if count_budget <= 0:
+        raise ValueError("Time budget {} is used up moving between the {} angles ({})".format(
+            format_seconds(time_budget), len(theta), format_seconds(move_seconds)))
+
+    weights = theta ** count_exponent
+    count_seconds = count_budget * weights / np.sum(weights)
+
+    q_factor = 4.0 * math.pi * np.sin(np.radians(theta))
+    angles = [PlannedAngle(*[float(value) for value in row]) for row in zip(
+        theta, q_factor / wavelength_max, q_factor / wavelength_min, gaps.s1, gaps.s2, s3, s4, count_seconds)]
+    return QRangePlan(angles, count_in_uamps, model)
+
+
+def _angles_for_q_range(q_min, q_max, overlap, wavelength_min, wavelength_max):
+    """
+    Returns: angles, in degrees and rounded down, from the one whose longest wavelength reaches q_min to the one
+        whose shortest wavelength just reaches q_max (rounded up); each one's Q range overlaps the next by the overlap
+        fraction
+    """
+    step = (wavelength_max / wavelength_min) ** (1.0 - overlap)
+    scale = 10 ** ANGLE_DECIMALS
+    sin_theta = q_min * wavelength_max / (4.0 * math.pi)
+    angles = []
+    while True:
+        if sin_theta >= 1.0:
+            raise ValueError("Q max of {} can not be reached with a shortest wavelength of {}".format(
+                q_max, wavelength_min))
+        angle = math.floor(math.degrees(math.asin(sin_theta)) * scale) / scale
+        if angles and angle <= angles[-1]:
+            angle = angles[-1] + 1.0 / scale
+        if 4.0 * math.pi * math.sin(math.radians(angle)) / wavelength_min >= q_max:
+            angles.append(max(_theta_for_q(q_max, wavelength_min, scale), angles[-1] + 1.0 / scale if angles else 0.0))
+            return angles
+        angles.append(angle)
+        sin_theta = math.sin(math.radians(angle)) * step
+
+
+def _theta_for_q(q, wavelength, scale):
+    """
+    Returns: angle in degrees, rounded up, at which the wavelength reaches q
+    """
+    return math.ceil(math.degrees(math.asin(q * wavelength / (4.0 * math.pi))) * scale) / scale
+
+
+def _from_sample(sample, name):
+    """
+    Returns: the attribute of the sample; raises ValueError if there is no sample
+    """
+    if sample is None:
+        raise ValueError("A sample or a {} must be given".format(name))
+    return getattr(sample, name)
@@ -82,6 +82,10 @@ class Sample:
     A sample definition
 
     """
+    # __dict__ is kept so that scripts can still set attributes of their own on a sample
+    __slots__ = ("title", "subtitle", "translation", "height2_offset", "phi_offset", "psi_offset", "height",
+                 "resolution", "footprint", "__dict__")
+
     def __init__(self, title, subtitle, translation, height2_offset, phi_offset, psi_offset, height,
                  resolution, footprint):
         """
@@ -109,4 +113,6 @@ class Sample:
         self.height2_offset = height2_offset
 
     def __repr__(self):
-        return "Sample: {}".format(self.__dict__)
+        values = {name: getattr(self, name) for name in Sample.__slots__ if name != "__dict__"}
+        values.update(self.__dict__)
+        return "Sample: {}".format(values)
@@ -0,0 +1,223 @@
+"""
+Sample tables: a whole sample sheet held as columns, loaded in one pass and validated all at once
+"""
+import csv
+from collections import OrderedDict
+
+import numpy as np
+
+from .sample import Sample
+
+TEXT_COLUMNS = ("title", "subtitle")
+NUMERIC_COLUMNS = ("translation", "height2_offset", "phi_offset", "psi_offset", "height", "resolution", "footprint")
+COLUMNS = TEXT_COLUMNS + NUMERIC_COLUMNS  # in the order of the Sample arguments
+
+
+class SampleTableError(ValueError):
+    """
+    A sample table has invalid values
+    """
+    def __init__(self, problems):
+        """
+        Initialiser.
+        Args:
+            problems: list of descriptions of each problem
+        """
+        super(SampleTableError, self).__init__("Invalid sample table:\n  {}".format("\n  ".join(problems)))
+        self.problems = list(problems)
+
+
+class SampleTable(object):
+    """
+    Samples held as one array per column; indexing or iterating gives Sample objects which can be passed to run_angle
+    and transmission.
+
+    Examples:
+        >>> samples = SampleTable.from_csv("C:/scripts/changer_1.csv", defaults={"subtitle": "D2O"})
+        >>> samples.raise_if_invalid(limits={"translation": (0, 300)})
+        >>> for sample in samples:
+        >>>     run_angle(sample, 0.7, count_uamps=5)
+        >>> run_angle(samples["Sample 3"], 2.3, count_uamps=20)
+    """
+    def __init__(self, columns):
+        """
+        Initialiser.
+        Args:
+            columns: dictionary of column name to a list or array of values; all of COLUMNS are needed and must be the
+                same length
+        """
+        missing = [name for name in COLUMNS if name not in columns]
+        if missing:
+            raise ValueError("Sample table is missing columns: {}".format(", ".join(missing)))
+        self.columns = OrderedDict()
+        for name in TEXT_COLUMNS:
+            self.columns[name] = np.array(["" if value is None else str(value) for value in columns[name]],
+                                          dtype=object)
+        for name in NUMERIC_COLUMNS:
+            self.columns[name] = np.asarray(columns[name], dtype=float)
+        lengths = set(len(column) for column in self.columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Sample table columns have different lengths: {}".format(
+                ", ".join("{}={}".format(name, len(column)) for name, column in self.columns.items())))
+
+    @staticmethod
+    def from_rows(rows, defaults=None):
+        """
+        Create a table from rows
+        Args:
+            rows: list of dictionaries of column name to value
+            defaults: dictionary of column name to value used for columns missing from a row
+
+        Returns:
+            SampleTable: the table
+        """
+        defaults = defaults or {}
+        rows = list(rows)
+        columns = {}
+        for name in COLUMNS:
+            values = [row.get(name, defaults.get(name)) for row in rows]
+            if any(value is None or value == "" for value in values) and name in NUMERIC_COLUMNS:
+                missing_rows = [index + 1 for index, value in enumerate(values) if value is None or value == ""]
+                raise ValueError("No {} for rows {} and no default".format(name, missing_rows))
+            columns[name] = values
+        return SampleTable(columns)
+
+    @staticmethod
+    def from_csv(filename, defaults=None):
+        """
+        Load a table from a csv file whose header row has the column names; columns not in the file are taken from
+        the defaults
+        Args:
+            filename: name of the file
+            defaults: dictionary of column name to value used for missing columns or empty cells
+
+        Returns:
+            SampleTable: the table
+        """
+        with open(filename, newline="") as csv_file:
+            rows = [{name.strip(): value.strip() for name, value in row.items() if name is not None and value}
+                    for row in csv.DictReader(csv_file)]
+        return SampleTable.from_rows(rows, defaults)
+
+    @staticmethod
+    def from_parquet(filename, defaults=None):
+        """
+        Load a table from a parquet file; this needs pandas with a parquet engine installed
+        Args:
+            filename: name of the file
+            defaults: dictionary of column name to value used for missing columns
+
+        Returns:
+            SampleTable: the table
+        """
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError("Loading a sample table from parquet needs pandas with pyarrow or fastparquet")
+        frame = pandas.read_parquet(filename)
+        defaults = defaults or {}
+        columns = {}
+        for name in COLUMNS:
+            if name in frame.columns:
+                columns[name] = frame[name].to_numpy()
+            elif name in defaults:
+                columns[name] = [defaults[name]] * len(frame)
+            else:
+                raise ValueError("No {} column in {} and no default".format(name, filename))
+        return SampleTable(columns)
+
+    def to_csv(self, filename):
+        """
+        Save the table to a csv file which from_csv can load
+        Args:
+            filename: name of the file
+        """
+        with open(filename, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(COLUMNS)
+            writer.writerows(zip(*[self.columns[name] for name in COLUMNS]))
+
+    def validate(self, limits=None):
+        """
+        Check every row at once: numbers must be finite, resolution and footprint positive, titles present and unique,
+        and columns within their limits
+        Args:
+            limits: dictionary of column name to (low, high) range, e.g. {"translation": (0, 300)}
+
+        Returns: list of descriptions of each problem; empty if the table is valid
+        """
+        checks = []
+        for name in NUMERIC_COLUMNS:
+            checks.append((~np.isfinite(self.columns[name]), "{} is not a number".format(name)))
+        for name in ("resolution", "footprint"):
+            checks.append((self.columns[name] <= 0.0, "{} must be positive".format(name)))
+        titles = self.columns["title"]
+        checks.append((titles == "", "title is empty"))
+        _, first_index, counts = np.unique(titles.astype(str), return_index=True, return_counts=True)
+        duplicated = np.zeros(len(self), dtype=bool)
+        duplicated[first_index[counts > 1]] = True
+        checks.append((duplicated, "title is used more than once"))
+        for name, (low, high) in (limits or {}).items():
+            column = self.columns[name]
+            checks.append(((column < low) | (column > high), "{} is outside {} to {}".format(name, low, high)))
+
+        problems = []
+        for mask, problem in checks:
+            for index in np.flatnonzero(mask):
+                problems.append("row {} ({}): {}".format(index + 1, titles[index], problem))
+        return problems
+
+    def raise_if_invalid(self, limits=None):
+        """
+        Args:
+            limits: dictionary of column name to (low, high) range
+
+        Raises:
+            SampleTableError: if validate finds any problems
+        """
+        problems = self.validate(limits)
+        if problems:
+            raise SampleTableError(problems)
+
+    def select(self, mask):
+        """
+        Args:
+            mask: boolean array, or array of row indices, of the rows to keep
+
+        Returns:
+            SampleTable: a table of the selected rows
+        """
+        return SampleTable(OrderedDict((name, column[mask]) for name, column in self.columns.items()))
+
+    def index_of(self, title):
+        """
+        Returns: index of the first row with the title
+        Raises:
+            KeyError: if no row has the title
+        """
+        matches = np.flatnonzero(self.columns["title"] == title)
+        if len(matches) == 0:
+            raise KeyError("No sample with title {}".format(title))
+        return int(matches[0])
+
+    def __len__(self):
+        return len(self.columns["title"])
+
+    def __getitem__(self, key):
+        """
+        Args:
+            key: row index or sample title
+
+        Returns:
+            techniques.reflectometry.sample.Sample: the sample in the row
+        """
+        index = self.index_of(key) if isinstance(key, str) else key
+        return Sample(*[self.columns[name][index].item() if name in NUMERIC_COLUMNS else self.columns[name][index]
+                        for name in COLUMNS])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "Sample table: {} samples ({})".format(len(self), ", ".join(self.columns["title"]))
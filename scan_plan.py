@@ -0,0 +1,376 @@
+"""
+Scan plans: compile a list of run_angle and transmission steps into an optimised schedule
+"""
+import contextlib
+import hashlib
+import io
+import json
+from collections import OrderedDict, namedtuple
+from inspect import signature
+
+from .alarm_monitor import alarm_guard
+from .base import _Movement, _run_angle, _transmission
+from .instrument_constants import get_instrument_constants
+from .journal import ExperimentJournal
+from .move_time import get_move_time_model, format_seconds
+from .multi_period import MultiPeriodRun
+from .preflight import check_steps
+from .tracing import TRACER
+
+StepPreview = namedtuple("StepPreview", ["step", "moves", "move_seconds", "count_seconds"])
+StepPreview.__doc__ = """
+What a step in a plan will do: the moves it makes (block to value, excluding those unchanged from the previous step),
+the estimated time to make them and the estimated counting time
+"""
+
+
+class PlanStep(object):
+    """
+    A single run_angle or transmission in a scan plan
+    """
+    RUN_ANGLE = "run_angle"
+    TRANSMISSION = "transmission"
+
+    def __init__(self, kind, sample, arguments):
+        """
+        Initialiser.
+        Args:
+            kind: RUN_ANGLE or TRANSMISSION
+            sample (techniques.reflectometry.sample.Sample): the sample to measure
+            arguments: dictionary of the arguments for run_angle or transmission, other than the sample and dry_run
+        """
+        self.kind = kind
+        self.sample = sample
+        self.arguments = arguments
+
+    @property
+    def mode(self):
+        """
+        Returns: mode the step is run in; None for the current mode
+        """
+        return self.arguments.get("mode")
+
+    @property
+    def translation(self):
+        """
+        Returns: translation the step is run at
+        """
+        return self.sample.translation
+
+    @property
+    def title(self):
+        """
+        Returns: title of the step
+        """
+        if self.kind == PlanStep.TRANSMISSION:
+            return self.arguments["title"]
+        return self.sample.title
+
+    def execute(self, movement, constants):
+        """
+        Perform the step
+        Args:
+            movement (_Movement): object that does movement required (or prints message for a dry run)
+            constants: instrument constants
+        """
+        if self.kind == PlanStep.TRANSMISSION:
+            _transmission(movement, constants, self.sample, **self.arguments)
+        else:
+            _run_angle(movement, constants, self.sample, **self.arguments)
+
+    def count_seconds(self, model):
+        """
+        Estimate the time the step counts for
+        Args:
+            model (techniques.reflectometry.move_time.MoveTimeModel): model used to convert counts to time
+
+        Returns: estimated counting time in seconds; 0 if the step does not count
+        """
+        return model.count_time(self.arguments.get("count_uamps"), self.arguments.get("count_seconds"),
+                                self.arguments.get("count_frames"), self.arguments.get("count_target"))
+
+    def key(self):
+        """
+        Returns: key identifying what the step does, which is the same each time the script is run
+        """
+        content = json.dumps([self.kind, self.sample.title, self.translation, self.arguments], sort_keys=True,
+                             default=str)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def counts(self):
+        """
+        Returns: dictionary of the count arguments given for the step
+        """
+        return OrderedDict((name, self.arguments[name])
+                           for name in ("count_target", "count_uamps", "count_seconds", "count_frames")
+                           if self.arguments.get(name) is not None)
+
+    def describe(self):
+        """
+        Returns: short description of the step
+        """
+        if self.kind == PlanStep.TRANSMISSION:
+            return "Transmission {}".format(self.title)
+        return "Run angle {} th={}".format(self.title, self.arguments["angle"])
+
+    def __repr__(self):
+        return "Plan step: {} {}".format(self.kind, self.arguments)
+
+
+class ScanPlan(object):
+    """
+    A list of run_angle and transmission steps which are run together. Constants are read and the number of soft
+    periods set once for the whole plan, and moves which do not change a block from where it already is are skipped.
+
+    Examples:
+        >>> plan = ScanPlan()
+        >>> plan.add_angle(sample_1, 0.7, count_uamps=5, mode="NR")
+        >>> plan.add_angle(sample_2, 0.7, count_uamps=5, mode="NR")
+        >>> plan.add_transmission(sample_1, "Direct beam", 0.1, 0.2, count_uamps=2)
+        >>> plan.add_angle(sample_1, 2.3, count_uamps=20, mode="NR")
+        >>> plan.optimise()
+        >>> plan.dry_run()
+        >>> plan.run()
+    """
+
+    def __init__(self, model=None):
+        """
+        Initialiser.
+        Args:
+            model (techniques.reflectometry.move_time.MoveTimeModel): model used to estimate the time moves and counts
+                take; None for the current move time model
+        """
+        self.steps = []
+        self.model = model
+
+    def add_angle(self, sample, angle, **kwargs):
+        """
+        Add a run_angle step to the plan
+        Args:
+            sample (techniques.reflectometry.sample.Sample): The sample to measure
+            angle: The angle to measure at
+            kwargs: other arguments as for run_angle, except dry_run
+
+        Returns:
+            PlanStep: the step added
+        """
+        arguments = _bind_arguments(_run_angle, sample, angle=angle, **kwargs)
+        return self._add(PlanStep(PlanStep.RUN_ANGLE, sample, arguments))
+
+    def add_transmission(self, sample, title, s1vg, s2vg, **kwargs):
+        """
+        Add a transmission step to the plan
+        Args:
+            sample (techniques.reflectometry.sample.Sample): The sample to measure
+            title: Title to set
+            s1vg: slit 1 vertical gap
+            s2vg: slit 2 vertical gap
+            kwargs: other arguments as for transmission, except dry_run
+
+        Returns:
+            PlanStep: the step added
+        """
+        arguments = _bind_arguments(_transmission, sample, title=title, s1vg=s1vg, s2vg=s2vg, **kwargs)
+        return self._add(PlanStep(PlanStep.TRANSMISSION, sample, arguments))
+
+    def _add(self, step):
+        self.steps.append(step)
+        return step
+
+    def optimise(self):
+        """
+        Reorder the steps to minimise the number of mode changes and the distance the translation stage travels.
+        Steps are grouped by mode, in the order the modes first appear; within a mode steps are grouped by translation
+        and the translations are visited in one sweep starting from the end nearest the previous translation. Steps at
+        the same mode and translation stay in the order they were added. A step with no mode is replaced by a copy
+        with the mode of the step before it so that it still runs in the same mode after reordering; the steps added
+        are not changed.
+
+        Returns: this plan
+        """
+        steps_by_mode = OrderedDict()
+        current_mode = None
+        for step in self.steps:
+            if step.mode is not None:
+                current_mode = step.mode
+            elif current_mode is not None:
+                step = PlanStep(step.kind, step.sample, OrderedDict(step.arguments, mode=current_mode))
+            steps_by_mode.setdefault(current_mode, []).append(step)
+
+        ordered_steps = []
+        for mode_steps in steps_by_mode.values():
+            translations = sorted(set(step.translation for step in mode_steps))
+            if ordered_steps:
+                last_translation = ordered_steps[-1].translation
+                if abs(last_translation - translations[-1]) < abs(last_translation - translations[0]):
+                    translations.reverse()
+            for translation in translations:
+                ordered_steps.extend(step for step in mode_steps if step.translation == translation)
+
+        self.steps = ordered_steps
+        return self
+
+    def preview(self):
+        """
+        Work out what each step will do without moving anything.
+
+        Returns:
+            list[StepPreview]: the moves and estimated times for each step
+        """
+        model = self.model if self.model is not None else get_move_time_model()
+        movement = _Movement(True, skip_unchanged=True)
+        constants = get_instrument_constants()
+        movement.seed_setpoints()
+        previews = []
+        for step in self.steps:
+            positions = OrderedDict(movement.setpoints)
+            moves_before_step = len(movement.move_log)
+            stages_before_step = len(movement.move_stages)
+            with contextlib.redirect_stdout(io.StringIO()):
+                step.execute(movement, constants)
+            moves = OrderedDict(movement.move_log[moves_before_step:])
+            stages = movement.move_stages[stages_before_step:]
+            for block in moves:
+                if block not in positions:
+                    positions[block] = movement.get_current_value(block)
+            move_seconds = model.stages_time(stages, positions)
+            previews.append(StepPreview(step, moves, move_seconds, step.count_seconds(model)))
+        return previews
+
+    def dry_run(self):
+        """
+        Print the moves each step will make and the estimated time the plan will take.
+
+        Returns:
+            list[StepPreview]: the moves and estimated times for each step
+        """
+        previews = self.preview()
+        for index, preview in enumerate(previews):
+            moves = ", ".join("{}={}".format(block, value) for block, value in preview.moves.items())
+            print("Step {}: {}: moves ({}) {}; count {}".format(
+                index + 1, preview.step.describe(), moves or "none", format_seconds(preview.move_seconds),
+                format_seconds(preview.count_seconds)))
+
+        move_seconds = sum(preview.move_seconds for preview in previews)
+        count_seconds = sum(preview.count_seconds for preview in previews)
+        print("Total: {} steps, {} moves; moving {}, counting {}, estimated time {}".format(
+            len(previews), sum(len(preview.moves) for preview in previews), format_seconds(move_seconds),
+            format_seconds(count_seconds), format_seconds(move_seconds + count_seconds)))
+        print(self.check())
+        return previews
+
+    def check(self, block_limits=None):
+        """
+        Check every step in the plan before anything moves, see preflight.check_steps
+        Args:
+            block_limits: dictionary of block name to (low, high) range; None for the limits set with
+                set_block_limits
+
+        Returns:
+            techniques.reflectometry.preflight.PreflightReport: the report of all violations
+        """
+        return check_steps(self.steps, block_limits=block_limits)
+
+    def step_keys(self):
+        """
+        Returns: key for each step; identical steps are numbered so that each key is unique
+        """
+        occurrences = {}
+        keys = []
+        for step in self.steps:
+            key = step.key()
+            occurrences[key] = occurrences.get(key, 0) + 1
+            keys.append("{}#{}".format(key, occurrences[key]))
+        return keys
+
+    def run(self, dry_run=False, journal=None, resume=False, preflight=True, multi_period=False, period_file=None):
+        """
+        Run all the steps in the plan
+        Args:
+            dry_run: If True just print what would happen; If False, run the plan
+            journal (str|techniques.reflectometry.journal.ExperimentJournal): journal, or its file name, to record
+                each completed step in; None for no journal. The steps of a multi-period run are recorded only once
+                the run has ended and its periods are saved
+            resume: True to skip the steps which the journal records as already completed
+            preflight: True to check every step first and refuse to start if any would fail
+            multi_period: True to count every step into its own soft period of a single run, pausing to move between
+                periods, rather than a run per step; repeating a step counts it again in the next period
+            period_file: json file to save the period each step was counted in to; None to only print it
+
+        Examples:
+            >>> plan.run(journal="C:/scripts/overnight.journal")
+            If the script is interrupted it can be run again with resume to carry on from the first incomplete step:
+            >>> plan.run(journal="C:/scripts/overnight.journal", resume=True)
+        """
+        if journal is not None and not isinstance(journal, ExperimentJournal):
+            journal = ExperimentJournal(journal)
+        if resume and journal is None:
+            raise ValueError("A journal is needed to resume a plan")
+        completed = journal.completed_keys() if resume else {}
+        if preflight:
+            report = self.check()
+            print(report)
+            if not dry_run:
+                report.raise_if_failed()
+
+        movement = _Movement(dry_run, skip_unchanged=True, check_limits=True)
+        movement.dry_run_warning()
+        movement.seed_setpoints()
+        if multi_period:
+            periods = sum(1 for step, key in zip(self.steps, self.step_keys())
+                          if step.counts() and key not in completed)
+            movement.multi_period_run = MultiPeriodRun(periods, dry_run)
+            movement.change_to_soft_period_count(periods)
+        else:
+            movement.change_to_soft_period_count()
+        held_entries = [] if multi_period else None
+        try:
+            self._run_steps(movement, journal, completed, dry_run, held_entries)
+        finally:
+            if movement.multi_period_run is not None:
+                movement.multi_period_run.end()
+                if journal is not None and movement.multi_period_run.saved:
+                    for entry in held_entries:
+                        journal.record(*entry)
+                print(movement.multi_period_run.period_map())
+                if period_file is not None:
+                    movement.multi_period_run.save(period_file)
+        print(movement.move_statistics())
+
+    def _run_steps(self, movement, journal, completed, dry_run, held_entries=None):
+        """
+        Run each step which has not already been completed, recording it in the journal. The constants are got for
+        each step, as a step which changes mode invalidates them. If held_entries is a list the journal entries are
+        added to it instead of being recorded, for a multi-period run whose counts are only saved when the run ends.
+        """
+        for index, (step, key) in enumerate(zip(self.steps, self.step_keys())):
+            if key in completed:
+                print("** Step {} of {}: {} already completed (run {}), skipping **".format(
+                    index + 1, len(self.steps), step.describe(), completed[key].run))
+                continue
+            print("** Step {} of {}: {} **".format(index + 1, len(self.steps), step.describe()))
+            movement.last_run_number = None
+            with TRACER.step(step.describe()), alarm_guard():
+                step.execute(movement, get_instrument_constants())
+            if journal is not None and not dry_run:
+                entry = (key, step.describe(), step.sample.title, step.arguments.get("angle"), step.counts(),
+                         movement.last_run_number)
+                if held_entries is not None:
+                    held_entries.append(entry)
+                else:
+                    journal.record(*entry)
+
+    def __repr__(self):
+        return "Scan plan: {}".format(self.steps)
+
+
+def _bind_arguments(function, sample, **kwargs):
+    """
+    Check the arguments are valid for a step function and return them as a dictionary, excluding movement, constants
+    and sample.
+    Raises:
+        TypeError: if the arguments are not valid for the function
+    """
+    arguments = signature(function).bind(None, None, sample, **kwargs).arguments
+    return OrderedDict((name, value) for name, value in arguments.items()
+                       if name not in ("movement", "constants", "sample"))
@@ -0,0 +1,84 @@
+"""
+Limits on the setpoints a script may send, checked before a step moves anything
+"""
+import json
+
+from .block_snapshot import HORIZONTAL_GAP_BLOCKS, VERTICAL_GAP_BLOCKS
+
+# Range, as (low, high), each block may be set to, e.g. {"HEIGHT": (-10.0, 10.0), "TRANS": (-100.0, 300.0)}. No ranges
+# are known by default: the stage ranges of the instrument must be supplied with set_block_limits, otherwise only the
+# checks against the instrument constants are made.
+DEFAULT_BLOCK_LIMITS = {}
+
+
+class SetpointLimitError(ValueError):
+    """
+    A step would send setpoints which the beamline would refuse
+    """
+    def __init__(self, problems):
+        """
+        Initialiser.
+        Args:
+            problems: list of descriptions of each problem
+        """
+        super(SetpointLimitError, self).__init__("Setpoints outside their limits:\n  {}".format(
+            "\n  ".join(problems)))
+        self.problems = list(problems)
+
+
+_BLOCK_LIMITS = dict(DEFAULT_BLOCK_LIMITS)
+
+
+def get_block_limits():
+    """
+    Returns: dictionary of block name to the (low, high) range it may be set to; empty if no limits have been set
+    """
+    return _BLOCK_LIMITS
+
+
+def set_block_limits(limits):
+    """
+    Set the range each block may be set to
+    Args:
+        limits: dictionary of block name to (low, high) range, or the name of a json file of the form
+            {"HEIGHT": [-10, 10], "TRANS": [-100, 300]}
+    """
+    global _BLOCK_LIMITS
+    if not isinstance(limits, dict):
+        with open(limits) as limits_file:
+            limits = json.load(limits_file)
+    _BLOCK_LIMITS = {block: tuple(limit) for block, limit in limits.items()}
+
+
+def setpoint_problems(block, value, constants, block_limits=None):
+    """
+    Check a setpoint: theta must not be above the maximum theta, no slit gap may be negative, slit 3 and 4 vertical
+    gaps must not be above their maximums and each block must be within its limits.
+    Args:
+        block: block name
+        value: value the block would be set to
+        constants (techniques.reflectometry.instrument_constants.InstrumentConstant): instrument constants
+        block_limits: dictionary of block name to (low, high) range; None for the limits set with set_block_limits
+
+    Returns: list of what is wrong with setting the block to the value; empty if nothing is
+    """
+    block_limits = block_limits if block_limits is not None else get_block_limits()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return []  # not a position, e.g. a mode or IN/OUT
+
+    problems = []
+    if block == "THETA" and value > constants.max_theta:
+        problems.append("theta above maximum of {}".format(constants.max_theta))
+    if block in VERTICAL_GAP_BLOCKS + HORIZONTAL_GAP_BLOCKS and value < 0.0:
+        problems.append("negative slit gap")
+    if block == "S3VG" and value > constants.s3max:
+        problems.append("gap above s3 maximum of {}".format(constants.s3max))
+    if block == "S4VG" and value > constants.s4max:
+        problems.append("gap above s4 maximum of {}".format(constants.s4max))
+    if block in block_limits:
+        low, high = block_limits[block]
+        if not low <= value <= high:
+            problems.append("outside range {} to {}".format(low, high))
+    return problems
@@ -0,0 +1,386 @@
+"""
+In-process simulation of the genie functions the scripts use, so scripts can be run and timed without an instrument.
+Time is simulated: waits move the simulated clock on, optionally sleeping for the wait divided by a time scale, so an
+overnight script can be simulated in seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .instrument_constants import REFLECTOMETRY_CONSTANT_PV
+from .move_time import MoveTimeModel
+
+# Block values the simulated instrument starts with
+DEFAULT_SIMULATED_BLOCKS = OrderedDict([
+    ("MODE", "NR"), ("TRANS", 0.0), ("THETA", 0.0), ("PHI", 0.0), ("PSI", 0.0), ("HEIGHT", 0.0), ("HEIGHT2", 0.0),
+    ("SM2ANGLE", 0.0), ("SM2INBEAM", "OUT"),
+    ("S1VG", 1.0), ("S2VG", 1.0), ("S3VG", 1.0), ("S4VG", 1.0),
+    ("S1HG", 30.0), ("S2HG", 30.0), ("S3HG", 30.0), ("S4HG", 30.0),
+])
+
+# Values of the simulated REFL server constants
+DEFAULT_SIMULATED_CONSTANTS = OrderedDict([
+    ("S1_Z", 0.0), ("S2_Z", 1940.5), ("SM2_Z", 1800.0), ("SAMPLE_Z", 2304.5), ("S3_Z", 2600.0), ("S4_Z", 5000.0),
+    ("PD_Z", 5500.0), ("S3_MAX", 10.0), ("S4_MAX", 12.0), ("MAX_THETA", 4.8), ("NATURAL_ANGLE", 1.5),
+    ("HAS_HEIGHT2", "YES"),
+])
+
+# Total detector count rate, in counts per second, while the simulated run is counting
+DEFAULT_COUNT_RATE = 1000.0
+
+# Number of detector spectra the counts are shared between
+DEFAULT_SPECTRUM_COUNT = 100
+
+
+class _SimulatedBlock(object):
+    """
+    A block which moves from its start value to its setpoint in a fixed time
+    """
+    __slots__ = ("start_value", "setpoint", "start_time", "duration")
+
+    def __init__(self, value, now):
+        self.start_value = value
+        self.setpoint = value
+        self.start_time = now
+        self.duration = 0.0
+
+    def value(self, now):
+        """
+        Returns: value at the given time; numeric values move linearly, others change when the move finishes
+        """
+        if now >= self.end_time():
+            return self.setpoint
+        try:
+            fraction = (now - self.start_time) / self.duration
+            return self.start_value + (float(self.setpoint) - float(self.start_value)) * fraction
+        except (TypeError, ValueError):
+            return self.start_value
+
+    def end_time(self):
+        """
+        Returns: time the current move finishes
+        """
+        return self.start_time + self.duration
+
+
+class SimulatedGenie(object):
+    """
+    Simulated genie backend: blocks move in the time the move time model gives, the DAE goes through its run states and
+    accrues frames, uamps and counts while running, and the REFL server constants are simulated PVs.
+
+    Examples:
+        >>> with use_backend(SimulatedGenie(time_scale=None)) as simulator:
+        >>>     run_angle(sample_1, 0.7, count_uamps=5)
+        >>> print(simulator.statistics())
+    """
+    is_simulated = True
+
+    def __init__(self, blocks=None, constants=None, model=None, time_scale=None, count_rate=DEFAULT_COUNT_RATE,
+                 spectrum_count=DEFAULT_SPECTRUM_COUNT):
+        """
+        Initialiser.
+        Args:
+            blocks: dictionary of block name to starting value; these override the default blocks
+            constants: dictionary of REFL server value name (e.g. S1_Z) to value; these override the default constants
+            model (techniques.reflectometry.move_time.MoveTimeModel): model of move times, proton current and frame
+                rate; None for the default model
+            time_scale: simulated seconds per real second; waits sleep for their simulated time divided by this; None
+                to not sleep at all
+            count_rate: total detector counts per second while running
+            spectrum_count: number of spectra the counts are shared between
+        """
+        self.model = model if model is not None else MoveTimeModel()
+        self.time_scale = time_scale
+        self.count_rate = count_rate
+        self.spectrum_count = spectrum_count
+        self.now = 0.0
+        self._lock = threading.RLock()
+
+        block_values = OrderedDict(DEFAULT_SIMULATED_BLOCKS)
+        block_values.update(blocks or {})
+        self.blocks = OrderedDict((name, _SimulatedBlock(value, self.now)) for name, value in block_values.items())
+        constant_values = OrderedDict(DEFAULT_SIMULATED_CONSTANTS)
+        constant_values.update(constants or {})
+        self.pvs = {REFLECTOMETRY_CONSTANT_PV.format(name): value for name, value in constant_values.items()}
+        self.alarms = {}
+
+        self.run_state = "SETUP"
+        self.run_number = 1  # number of the run in progress, or of the next run when in setup
+        self.runs = 0
+        self.title = ""
+        self.period = 1
+        self.number_of_periods = 1
+        self.running_seconds = 0.0
+        self.period_seconds = {}  # seconds counted into each period of the current run
+
+        self.cset_calls = 0
+        self.moving_seconds = 0.0
+        self.counting_seconds = 0.0
+        self.waited_seconds = 0.0
+
+    # clock
+
+    def monotonic(self):
+        """
+        Returns: simulated time in seconds
+        """
+        return self.now
+
+    def sleep(self, seconds):
+        """
+        Let simulated time pass
+        Args:
+            seconds: simulated seconds to pass
+        """
+        self._advance(seconds)
+
+    def _advance(self, seconds):
+        if seconds <= 0:
+            return
+        if self.time_scale is not None:
+            time.sleep(seconds / self.time_scale)
+        with self._lock:
+            if self.run_state == "RUNNING":
+                self.running_seconds += seconds
+                self.period_seconds[self.period] = self.period_seconds.get(self.period, 0.0) + seconds
+                self.counting_seconds += seconds
+            self.now += seconds
+            self.waited_seconds += seconds
+
+    # blocks
+
+    def cset(self, block=None, value=None, runcontrol=None, lowlimit=None, highlimit=None, wait=False,
+             verbose=False, **pars):
+        """
+        Set one block, or several given as keyword arguments, moving from their current values
+        Raises:
+            ValueError: if a block does not exist, as genie does; nothing is set
+        """
+        setpoints = dict(pars)
+        if block is not None:
+            setpoints[block] = value
+        with self._lock:
+            unknown = [name for name in setpoints if name not in self.blocks]
+            if unknown:
+                raise ValueError("No block with the name {} exists".format(", ".join(unknown)))
+            for name, setpoint in setpoints.items():
+                start_value = self.blocks[name].value(self.now)
+                moving = _SimulatedBlock(start_value, self.now)
+                moving.setpoint = setpoint
+                moving.duration = self.model.move_time(name, start_value, setpoint)
+                self.blocks[name] = moving
+                self.cset_calls += 1
+        if wait:
+            self.waitfor_move(*setpoints.keys())
+
+    def cget(self, block):
+        """
+        Returns: dictionary of the block's name and current value; None if the block does not exist
+        """
+        with self._lock:
+            simulated_block = self.blocks.get(block)
+            if simulated_block is None:
+                return None
+            return {"name": block, "value": simulated_block.value(self.now), "unit": "",
+                    "alarm": self.alarms.get(block, "NO_ALARM")}
+
+    def waitfor_move(self, *blocks, **kwargs):
+        """
+        Wait until the given blocks, or all blocks, have finished moving
+        """
+        with self._lock:
+            names = blocks if blocks else self.blocks.keys()
+            end_time = max([self.blocks[name].end_time() for name in names if name in self.blocks] + [self.now])
+            seconds = end_time - self.now
+        self.moving_seconds += seconds
+        self._advance(seconds)
+
+    def set_alarm(self, block, severity="MAJOR"):
+        """
+        Put a block into alarm; severity None takes it out of alarm
+        """
+        if severity is None:
+            self.alarms.pop(block, None)
+        else:
+            self.alarms[block] = severity
+
+    def check_alarms(self, *blocks):
+        """
+        Returns: lists of the given blocks in minor, major and invalid alarm
+        """
+        return tuple([block for block in blocks if self.alarms.get(block) == severity]
+                     for severity in ("MINOR", "MAJOR", "INVALID"))
+
+    # pvs
+
+    def get_pv(self, name, is_local=False):
+        """
+        Returns: value of the simulated pv; None if it does not exist
+        """
+        return self.pvs.get(name)
+
+    def set_pv(self, name, value, wait=False, is_local=False):
+        """
+        Set a simulated pv
+        """
+        self.pvs[name] = value
+
+    # dae
+
+    def begin(self, period=1, meas_id=None, meas_type="", meas_subid="", sample_id="", delayed=False, quiet=False,
+              paused=False, verbose=False):
+        """
+        Start a run
+        """
+        self._require_state("begin", "SETUP")
+        self.runs += 1
+        self.running_seconds = 0.0
+        self.period_seconds = {}
+        self.period = period
+        self.run_state = "PAUSED" if paused else "RUNNING"
+
+    def end(self, verbose=False):
+        """
+        End the run
+        """
+        self._require_state("end", "RUNNING", "PAUSED")
+        self.run_state = "SETUP"
+        self.run_number += 1
+
+    def abort(self, verbose=False):
+        """
+        Abort the run
+        """
+        self._require_state("abort", "RUNNING", "PAUSED")
+        self.run_state = "SETUP"  # no data is saved so the next run has the same number
+
+    def pause(self, verbose=False):
+        """
+        Pause the run
+        """
+        self._require_state("pause", "RUNNING")
+        self.run_state = "PAUSED"
+
+    def resume(self, verbose=False):
+        """
+        Resume the run
+        """
+        self._require_state("resume", "PAUSED")
+        self.run_state = "RUNNING"
+
+    def _require_state(self, action, *states):
+        if self.run_state not in states:
+            raise ValueError("Can not {} when the run state is {}".format(action, self.run_state))
+
+    def get_runstate(self):
+        """
+        Returns: SETUP, RUNNING or PAUSED
+        """
+        return self.run_state
+
+    def get_runnumber(self):
+        """
+        Returns: the number of the run in progress as a string; in setup, as on IBEX, the number the next run will have
+        """
+        return "{:08d}".format(self.run_number)
+
+    def get_uamps(self, period=False):
+        """
+        Returns: uamps counted in the current run, or in its current period if period is True
+        """
+        return self._counted_seconds(period) * self.model.proton_current / 3600.0
+
+    def get_frames(self, period=False):
+        """
+        Returns: frames counted in the current run, or in its current period if period is True
+        """
+        return int(self._counted_seconds(period) * self.model.frame_rate)
+
+    def _counted_seconds(self, period):
+        return self.period_seconds.get(self.period, 0.0) if period else self.running_seconds
+
+    def get_totalcounts(self):
+        """
+        Returns: detector counts in the current run
+        """
+        return self.running_seconds * self.count_rate
+
+    def integrate_spectrum(self, spectrum, period=1, t_min=None, t_max=None):
+        """
+        Returns: counts in one spectrum in the given period of the current run
+        """
+        return self.period_seconds.get(period, 0.0) * self.count_rate / self.spectrum_count
+
+    def waitfor_time(self, seconds=None, minutes=None, hours=None, time=None, quiet=False):
+        """
+        Wait for a time
+        """
+        self._advance((seconds or 0.0) + 60.0 * (minutes or 0.0) + 3600.0 * (hours or 0.0))
+
+    def waitfor_uamps(self, uamps):
+        """
+        Wait until the run has counted the uamps
+        """
+        self._wait_while_running(uamps, self.get_uamps(), 3600.0 / self.model.proton_current)
+
+    def waitfor_frames(self, frames):
+        """
+        Wait until the run has counted the frames
+        """
+        self._wait_while_running(frames, self.get_frames(), 1.0 / self.model.frame_rate)
+
+    def _wait_while_running(self, target, current, seconds_per_unit):
+        if current >= target:
+            return
+        if self.run_state != "RUNNING":
+            raise ValueError("Waiting to count while the run state is {} would never finish".format(self.run_state))
+        self._advance((target - current) * seconds_per_unit)
+
+    def change_title(self, title):
+        """
+        Set the run title
+        """
+        self.title = title
+
+    def get_title(self):
+        """
+        Returns: the run title
+        """
+        return self.title
+
+    def change_number_soft_periods(self, number, enforce=False):
+        """
+        Set the number of software periods
+        """
+        self.number_of_periods = number
+
+    def get_number_periods(self):
+        """
+        Returns: the number of periods
+        """
+        return self.number_of_periods
+
+    def change_period(self, period):
+        """
+        Set the current period
+        """
+        if not 1 <= period <= self.number_of_periods:
+            raise ValueError("Period {} is not between 1 and {}".format(period, self.number_of_periods))
+        self.period = period
+
+    def get_period(self):
+        """
+        Returns: the current period
+        """
+        return self.period
+
+    def statistics(self):
+        """
+        Returns: dictionary of simulated time in total, spent moving and spent counting, and the number of setpoints
+        """
+        return OrderedDict([("simulated_seconds", self.now), ("moving_seconds", self.moving_seconds),
+                            ("counting_seconds", self.counting_seconds), ("cset_calls", self.cset_calls),
+                            ("runs", self.runs)])
+
+    def __repr__(self):
+        return "Simulated genie: t={:.1f} s, run state {}, run {}".format(self.now, self.run_state, self.run_number)
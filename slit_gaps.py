@@ -0,0 +1,71 @@
+"""
+Vectorised slit gap calculations for planning and validating whole angle lists
+"""
+from collections import namedtuple
+
+import numpy as np
+
+SlitGaps = namedtuple("SlitGaps", ["s1", "s2", "s3", "s4", "valid"])
+SlitGaps.__doc__ = """
+Vertical slit gaps for a set of angles; each is an array, valid is a boolean mask which is True where no gap is negative
+"""
+
+
+def calculate_slit_gaps_for_angles(theta, footprint, resolution, constants, s1vg=None, s2vg=None, s3vg=None,
+                                   s4vg=None):
+    """
+    Calculate the vertical slit gaps for many angles at once, the same way as _Movement.set_slit_gaps does for one.
+    Arguments are broadcast against each other so, for example, an array of theta can be used with a single footprint
+    or an array of footprints for each sample.
+    Args:
+        theta: angles theta is set to
+        footprint: footprint of the beam on the sample
+        resolution: resolution required
+        constants: instrument constants
+        s1vg: s1 vertical gap set by user; None use footprint calculated gap
+        s2vg: s2 vertical gap set by user; None use footprint calculated gap
+        s3vg: s3 vertical gap set by user; None use fraction of maximum based on theta
+        s4vg: s4 vertical gap set by user; None use fraction of maximum based on theta
+
+    Returns:
+        SlitGaps: arrays of gaps for slits 1-4 and a mask of which angles have valid (non-negative) gaps
+    """
+    theta = np.asarray(theta, dtype=float)
+    footprint = np.asarray(footprint, dtype=float)
+    resolution = np.asarray(resolution, dtype=float)
+
+    s1sa = constants.s1s2 + constants.s2sa
+    footprint_at_theta = footprint * np.sin(np.radians(theta))
+    s1 = 2 * s1sa * np.tan(np.radians(resolution * theta)) - footprint_at_theta
+    s2 = (constants.s1s2 * (footprint_at_theta + s1) / s1sa) - s1
+
+    factor = theta / constants.max_theta
+    s3 = constants.s3max * factor
+    s4 = constants.s4max * factor
+
+    s1, s2, s3, s4 = [gap if user_gap is None else np.asarray(user_gap, dtype=float)
+                      for gap, user_gap in zip((s1, s2, s3, s4), (s1vg, s2vg, s3vg, s4vg))]
+    s1, s2, s3, s4 = [np.array(gap) for gap in np.broadcast_arrays(s1, s2, s3, s4)]
+    valid = (s1 >= 0.0) & (s2 >= 0.0) & (s3 >= 0.0) & (s4 >= 0.0)
+    return SlitGaps(s1, s2, s3, s4, valid)
+
+
+def slit_gaps_table(theta, footprint, resolution, gaps):
+    """
+    Format slit gaps as a table with one row per angle
+    Args:
+        theta: angles the gaps were calculated for
+        footprint: footprints the gaps were calculated for
+        resolution: resolutions the gaps were calculated for
+        gaps (SlitGaps): the calculated gaps
+
+    Returns: the table as a string
+    """
+    theta, footprint, resolution = np.broadcast_arrays(theta, footprint, resolution, gaps.s1)[:3]
+    lines = ["{:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {}".format(
+        "theta", "footprint", "resolution", "s1vg", "s2vg", "s3vg", "s4vg", "")]
+    for row in zip(theta.ravel(), footprint.ravel(), resolution.ravel(), gaps.s1.ravel(), gaps.s2.ravel(),
+                   gaps.s3.ravel(), gaps.s4.ravel(), gaps.valid.ravel()):
+        lines.append("{:10.4g} {:10.4g} {:10.4g} {:10.4g} {:10.4g} {:10.4g} {:10.4g} {}".format(
+            *row[:7], "" if row[7] else "NEGATIVE GAP"))
+    return "\n".join(lines)
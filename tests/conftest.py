@@ -0,0 +1,92 @@
+"""
+Fixtures for running the scripts against the simulated genie backend. The package is imported as
+techniques.reflectometry, as on the instrument, so this checkout is made that package wherever it is checked out. The
+tests need pytest, numpy, future and six.
+"""
+import os
+import sys
+import types
+
+import pytest
+
+
+def _use_checkout_as_package():
+    """
+    Make techniques.reflectometry import the modules of this checkout
+    """
+    techniques = sys.modules.setdefault("techniques", types.ModuleType("techniques"))
+    techniques.__path__ = getattr(techniques, "__path__", [])
+    reflectometry = types.ModuleType("techniques.reflectometry")
+    reflectometry.__path__ = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    sys.modules["techniques.reflectometry"] = reflectometry
+    techniques.reflectometry = reflectometry
+
+
+_use_checkout_as_package()
+
+from techniques.reflectometry.alarm_monitor import stop_alarm_monitor  # noqa: E402
+from techniques.reflectometry.genie_backend import use_backend  # noqa: E402
+from techniques.reflectometry.instrument_constants import (  # noqa: E402
+    REFLECTOMETRY_CONSTANT_PV, invalidate_instrument_constants, use_constants_snapshot)
+from techniques.reflectometry.sample import Sample  # noqa: E402
+from techniques.reflectometry.setpoint_limits import set_block_limits  # noqa: E402
+from techniques.reflectometry.simulator import SimulatedGenie  # noqa: E402
+
+
+class RecordingGenie(SimulatedGenie):
+    """
+    Simulated genie which records each block it is asked to set, in order
+    """
+    def __init__(self, *args, **kwargs):
+        super(RecordingGenie, self).__init__(*args, **kwargs)
+        self.set_blocks = []
+
+    def cset(self, block=None, value=None, *args, **pars):
+        self.set_blocks.extend(([block] if block is not None else []) + list(pars))
+        return super(RecordingGenie, self).cset(block, value, *args, **pars)
+
+
+@pytest.fixture
+def simulator():
+    """
+    A simulated instrument used as the genie backend, with fresh instrument constants and no alarm monitor or
+    constants snapshot left over afterwards
+    """
+    invalidate_instrument_constants()
+    with use_backend(RecordingGenie()) as backend:
+        yield backend
+    stop_alarm_monitor()
+    use_constants_snapshot(None)
+
+
+@pytest.fixture
+def constant_for_mode(simulator, monkeypatch):
+    """
+    Returns: function which makes writing a mode set a REFL server constant, as changing mode can on the beamline
+    """
+    def _constant_for_mode(mode, name, constant):
+        cset = simulator.cset
+
+        def _cset(block=None, value=None, *args, **pars):
+            cset(block, value, *args, **pars)
+            if mode in (value if block == "MODE" else None, pars.get("MODE")):
+                simulator.set_pv(REFLECTOMETRY_CONSTANT_PV.format(name), constant)
+        monkeypatch.setattr(simulator, "cset", _cset)
+    return _constant_for_mode
+
+
+@pytest.fixture
+def block_limits():
+    """
+    Returns: function which sets block limits for the test only
+    """
+    yield set_block_limits
+    set_block_limits({})
+
+
+@pytest.fixture
+def sample():
+    """
+    A sample on the simulated instrument
+    """
+    return Sample("Sample 1", "test", 0.0, 0.0, 0.0, 0.0, 0.0, 0.03, 60.0)
@@ -0,0 +1,157 @@
+"""
+Tests of the alarm monitor pausing the run and stopping the script. The monitor is polled by the tests rather than by
+its thread, so that the alarms change at known points of the simulated time.
+"""
+import pytest
+
+from techniques.reflectometry import alarm_monitor, kinetics
+from techniques.reflectometry.alarm_monitor import MAJOR, PAUSE, RAISE, AlarmMonitor, BlockInAlarmError, wait_for_count
+from techniques.reflectometry.base import _Movement
+from techniques.reflectometry.kinetics import run_kinetics
+from techniques.reflectometry.multi_period import MultiPeriodRun
+
+
+@pytest.fixture
+def use_monitor(monkeypatch, simulator):
+    """
+    Returns: function which makes an alarm monitor, watching theta, the one the scripts use
+    """
+    def _use_monitor(mode):
+        monitor = AlarmMonitor(mode, blocks=("THETA", ), dae=simulator)
+        monkeypatch.setattr(alarm_monitor, "_ALARM_MONITOR", monitor)
+        return monitor
+    return _use_monitor
+
+
+class _AlarmUntil(object):
+    """
+    Alarm source with theta in alarm until a simulated time
+    """
+    def __init__(self, simulator, clear_at):
+        self.simulator = simulator
+        self.clear_at = clear_at
+
+    def alarms(self, blocks):
+        return {"THETA": MAJOR} if self.simulator.monotonic() < self.clear_at else {}
+
+
+def test_alarm_while_running_pauses_and_resumes_when_cleared(simulator, use_monitor):
+    monitor = use_monitor(PAUSE)
+    simulator.begin()
+
+    simulator.set_alarm("THETA")
+    monitor.poll()
+    assert simulator.get_runstate() == "PAUSED"
+
+    simulator.set_alarm("THETA", None)
+    monitor.poll()
+    assert simulator.get_runstate() == "RUNNING"
+
+
+def test_alarm_in_raise_mode_pauses_and_raises_once(simulator, use_monitor):
+    monitor = use_monitor(RAISE)
+    simulator.begin()
+
+    simulator.set_alarm("THETA")
+    monitor.poll()
+
+    assert simulator.get_runstate() == "PAUSED"
+    with pytest.raises(BlockInAlarmError):
+        monitor.raise_if_signalled()
+    monitor.raise_if_signalled()
+
+
+def test_signalled_alarm_stops_the_count(simulator, use_monitor):
+    monitor = use_monitor(RAISE)
+    simulator.begin()
+    simulator.set_alarm("THETA")
+    monitor.poll()
+
+    with pytest.raises(BlockInAlarmError):
+        wait_for_count(seconds=100)
+    assert simulator.monotonic() < 100
+
+
+def test_raise_mode_does_not_begin_a_run_with_a_block_in_alarm(simulator, use_monitor):
+    use_monitor(RAISE)
+    simulator.set_alarm("THETA")
+
+    with pytest.raises(BlockInAlarmError):
+        _Movement(False).count_for(None, 10, None)
+    assert simulator.runs == 0
+    assert simulator.get_runstate() == "SETUP"
+
+
+@pytest.mark.parametrize("use_periods", [False, True])
+def test_raise_mode_does_not_count_a_kinetic_slice_with_a_block_in_alarm(simulator, sample, use_monitor, monkeypatch,
+                                                                         use_periods):
+    use_monitor(RAISE)
+    wait_for_counts = kinetics.wait_for_counts
+
+    def _alarm_after_counting(*args):
+        wait_for_counts(*args)
+        simulator.set_alarm("THETA")
+    monkeypatch.setattr(kinetics, "wait_for_counts", _alarm_after_counting)
+
+    with pytest.raises(BlockInAlarmError):
+        run_kinetics(sample, 0.7, 3, count_seconds=10, use_periods=use_periods, mode="NR")
+    assert simulator.runs == 1
+    assert simulator.counting_seconds == pytest.approx(10)
+    assert simulator.get_runstate() == "SETUP"
+
+
+def test_pause_mode_waits_for_alarms_to_clear_before_counting(simulator, use_monitor):
+    monitor = use_monitor(PAUSE)
+    monitor.source = _AlarmUntil(simulator, clear_at=30)
+
+    _Movement(False).count_for(None, 10, None)
+
+    assert simulator.runs == 1
+    assert simulator.monotonic() >= 40
+    assert simulator.counting_seconds == pytest.approx(10)
+
+
+def test_run_ended_by_the_script_is_not_resumed(simulator, use_monitor):
+    monitor = use_monitor(PAUSE)
+    simulator.begin()
+    simulator.set_alarm("THETA")
+    monitor.poll()
+
+    simulator.end()
+    simulator.set_alarm("THETA", None)
+    monitor.poll()
+
+    assert simulator.get_runstate() == "SETUP"
+    assert not monitor.paused_run
+
+
+def test_period_paused_by_the_monitor_is_left_paused_for_the_move_to_the_next(simulator, use_monitor, monkeypatch):
+    monitor = use_monitor(PAUSE)
+    simulator.change_number_soft_periods(2)
+    waitfor_time = simulator.waitfor_time
+
+    def _alarm_while_counting(**kwargs):
+        simulator.set_alarm("THETA")
+        monitor.poll()
+        waitfor_time(**kwargs)
+    monkeypatch.setattr(simulator, "waitfor_time", _alarm_while_counting)
+    period_run = MultiPeriodRun(2)
+
+    period_run.count(None, 10, None)
+    simulator.set_alarm("THETA", None)
+    monitor.poll()
+
+    assert simulator.get_runstate() == "PAUSED"
+    period_run.end()
+
+
+def test_seconds_count_ending_between_polls_does_not_sleep_a_negative_time(simulator, use_monitor, monkeypatch):
+    def _sleep(seconds):
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative")
+    use_monitor(RAISE)
+    monitor_clock = iter([0.0, 0.5, 10.5, 11.0])
+    monkeypatch.setattr(alarm_monitor, "monotonic", lambda: next(monitor_clock))
+    monkeypatch.setattr(alarm_monitor, "backend_sleep", _sleep)
+
+    wait_for_count(seconds=10)
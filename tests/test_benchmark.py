@@ -0,0 +1,21 @@
+"""
+Tests of the script benchmarks
+"""
+from techniques.reflectometry.benchmark import SCRIPT_BENCHMARKS, benchmark_script, format_results
+
+
+def test_results_have_the_time_spent_in_each_genie_call():
+    result = benchmark_script(SCRIPT_BENCHMARKS["run_angle"], repeats=1)
+
+    assert list(result["call_seconds"]) == list(result["calls"])
+    assert all(seconds >= 0 for seconds in result["call_seconds"].values())
+
+
+def test_results_from_before_call_seconds_can_be_formatted():
+    result = benchmark_script(SCRIPT_BENCHMARKS["run_angle"], repeats=1)
+    del result["call_seconds"]
+
+    table = format_results({"scripts": {"run_angle": result},
+                            "slit_gaps": {"scalar_angles_per_second": 1.0, "vectorised_angles_per_second": 1.0}})
+
+    assert table.splitlines()[1].startswith("run_angle")
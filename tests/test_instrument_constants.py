@@ -0,0 +1,95 @@
+"""
+Tests of the instrument constants cache and snapshots
+"""
+import json
+import threading
+
+import pytest
+
+from techniques.reflectometry.instrument_constants import (
+    REFLECTOMETRY_CONSTANT_PV, get_instrument_constants, get_instrument_constants_cache,
+    invalidate_instrument_constants, load_constants_snapshot, save_constants_snapshot, use_constants_snapshot,
+    verify_constants_snapshot)
+
+MAX_THETA_PV = REFLECTOMETRY_CONSTANT_PV.format("MAX_THETA")
+
+
+@pytest.fixture
+def snapshot_file(simulator, tmp_path):
+    """
+    Returns: name of a snapshot of the simulated constants, which have a maximum theta of 4.8
+    """
+    filename = str(tmp_path / "constants.json")
+    save_constants_snapshot(filename)
+    return filename
+
+
+def _wait_for_verification():
+    for thread in threading.enumerate():
+        if thread.name == "verify constants":
+            thread.join()
+
+
+def test_snapshot_loads_the_saved_constants(snapshot_file):
+    constants, snapshot = load_constants_snapshot(snapshot_file)
+
+    assert constants.max_theta == 4.8
+    assert snapshot["values"]["MAX_THETA"] == 4.8
+
+
+def test_edited_snapshot_is_refused(snapshot_file):
+    with open(snapshot_file) as saved:
+        snapshot = json.load(saved)
+    snapshot["values"]["MAX_THETA"] = 10.0
+    with open(snapshot_file, "w") as saved:
+        json.dump(snapshot, saved)
+
+    with pytest.raises(ValueError):
+        load_constants_snapshot(snapshot_file)
+
+
+def test_verify_reports_drift(simulator, snapshot_file):
+    assert verify_constants_snapshot(snapshot_file) == {}
+
+    simulator.set_pv(MAX_THETA_PV, 5.0)
+
+    assert verify_constants_snapshot(snapshot_file) == {"MAX_THETA": (4.8, 5.0)}
+
+
+def test_snapshot_is_used_when_the_refl_server_can_not_be_read(simulator, snapshot_file):
+    use_constants_snapshot(snapshot_file)
+    del simulator.pvs[MAX_THETA_PV]
+
+    assert get_instrument_constants().max_theta == 4.8
+
+
+def test_snapshot_first_is_used_until_the_check_finds_drift(simulator, snapshot_file):
+    simulator.set_pv(MAX_THETA_PV, 5.0)
+    use_constants_snapshot(snapshot_file, snapshot_first=True)
+
+    assert get_instrument_constants().max_theta == 4.8
+    _wait_for_verification()
+    assert get_instrument_constants().max_theta == 5.0
+
+    invalidate_instrument_constants()
+    assert get_instrument_constants().max_theta == 5.0
+
+
+def test_snapshot_first_without_drift_keeps_using_the_snapshot(simulator, snapshot_file):
+    use_constants_snapshot(snapshot_file, snapshot_first=True)
+    get_instrument_constants()
+    _wait_for_verification()
+
+    simulator.set_pv(MAX_THETA_PV, 5.0)
+    invalidate_instrument_constants()
+
+    assert get_instrument_constants().max_theta == 4.8
+
+
+def test_late_put_does_not_overwrite_an_invalidate(simulator):
+    cache = get_instrument_constants_cache()
+    generation = cache.generation
+    invalidate_instrument_constants()
+
+    assert not cache.put(get_instrument_constants(force_refresh=True), generation)
+    assert cache.put(get_instrument_constants(force_refresh=True), cache.generation)
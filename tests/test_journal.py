@@ -0,0 +1,63 @@
+"""
+Tests of the experiment journal and resuming a scan plan from it
+"""
+import pytest
+
+from techniques.reflectometry.journal import ExperimentJournal
+from techniques.reflectometry.scan_plan import ScanPlan
+
+
+def _plan(sample, angles):
+    plan = ScanPlan()
+    for angle in angles:
+        plan.add_angle(sample, angle, count_uamps=5, mode="NR")
+    return plan
+
+
+def test_completed_steps_are_journalled_with_their_runs(simulator, sample, tmp_path):
+    journal = ExperimentJournal(str(tmp_path / "plan.journal"))
+
+    _plan(sample, (0.5, 1.2)).run(journal=journal)
+
+    entries = journal.entries()
+    assert [entry.angle for entry in entries] == [0.5, 1.2]
+    assert [entry.run for entry in entries] == ["00000001", "00000002"]
+
+
+def test_resume_skips_the_completed_steps(simulator, sample, tmp_path):
+    journal_file = str(tmp_path / "plan.journal")
+    _plan(sample, (0.5, 1.2)).run(journal=journal_file)
+
+    _plan(sample, (0.5, 1.2, 2.3)).run(journal=journal_file, resume=True)
+
+    assert simulator.runs == 3
+    assert [entry.angle for entry in ExperimentJournal(journal_file).entries()] == [0.5, 1.2, 2.3]
+
+
+def test_partly_written_last_line_is_ignored(tmp_path):
+    journal_file = tmp_path / "plan.journal"
+    journal = ExperimentJournal(str(journal_file))
+    journal.record("step#1", "step", "Sample 1", 0.5, {"count_uamps": 5}, "00000001")
+    with open(str(journal_file), "a") as partial:
+        partial.write('{"key":"step#2","desc')
+
+    assert list(journal.completed_keys()) == ["step#1"]
+
+
+def test_multi_period_steps_are_journalled_once_the_run_has_ended(simulator, sample, tmp_path):
+    journal = ExperimentJournal(str(tmp_path / "plan.journal"))
+
+    _plan(sample, (0.5, 1.2)).run(journal=journal, multi_period=True)
+
+    assert [entry.run for entry in journal.entries()] == ["00000001", "00000001"]
+
+
+def test_multi_period_steps_are_not_journalled_if_the_run_does_not_end(simulator, sample, tmp_path, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise RuntimeError("end failed")
+    monkeypatch.setattr(simulator, "end", _fail)
+    journal = ExperimentJournal(str(tmp_path / "plan.journal"))
+
+    with pytest.raises(RuntimeError):
+        _plan(sample, (0.5, 1.2)).run(journal=journal, multi_period=True)
+    assert journal.entries() == []
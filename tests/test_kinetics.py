@@ -0,0 +1,48 @@
+"""
+Tests of kinetic measurements
+"""
+import pytest
+
+from techniques.reflectometry import kinetics
+from techniques.reflectometry.kinetics import run_kinetics
+
+
+def test_each_slice_has_the_number_of_its_own_run(simulator, sample):
+    result = run_kinetics(sample, 0.7, 3, count_seconds=10, mode="NR")
+
+    assert [kinetic_slice.run for kinetic_slice in result.slices] == ["00000001", "00000002", "00000003"]
+    assert simulator.get_runnumber() == "00000004"
+
+
+def test_slices_in_periods_share_one_run(simulator, sample):
+    result = run_kinetics(sample, 0.7, 3, count_seconds=10, use_periods=True, mode="NR")
+
+    assert [(kinetic_slice.run, kinetic_slice.period) for kinetic_slice in result.slices] == [
+        ("00000001", 1), ("00000001", 2), ("00000001", 3)]
+    assert simulator.runs == 1
+    assert simulator.get_runstate() == "SETUP"
+
+
+def test_no_dead_time_between_simulated_slices(simulator, sample):
+    result = run_kinetics(sample, 0.7, 3, count_seconds=10, mode="NR")
+
+    assert result.dead_times() == [pytest.approx(0.0), pytest.approx(0.0)]
+
+
+@pytest.mark.parametrize("use_periods", [False, True])
+def test_failed_slice_ends_the_run(simulator, sample, monkeypatch, use_periods):
+    def _fail(*args):
+        simulator.sleep(5)
+        raise RuntimeError("count failed")
+    monkeypatch.setattr(kinetics, "wait_for_counts", _fail)
+
+    with pytest.raises(RuntimeError):
+        run_kinetics(sample, 0.7, 3, count_seconds=10, use_periods=use_periods, mode="NR")
+    assert simulator.get_runstate() == "SETUP"
+
+
+def test_dry_run_counts_nothing(simulator, sample):
+    result = run_kinetics(sample, 0.7, 3, count_seconds=10, dry_run=True, mode="NR")
+
+    assert result.slices == []
+    assert simulator.runs == 0
@@ -0,0 +1,122 @@
+"""
+Tests of counting several steps into the periods of one run
+"""
+import json
+
+import pytest
+
+from techniques.reflectometry import base
+from techniques.reflectometry.adaptive_counting import CountTarget, SpectraCountReader
+from techniques.reflectometry.multi_period import MultiPeriodRun
+from techniques.reflectometry.scan_plan import ScanPlan
+
+
+def test_plan_counts_each_step_into_its_own_period_of_one_run(simulator, sample, tmp_path):
+    plan = ScanPlan()
+    for angle in (0.5, 1.2, 2.3):
+        plan.add_angle(sample, angle, count_seconds=10, mode="NR")
+    period_file = str(tmp_path / "periods.json")
+
+    plan.run(multi_period=True, period_file=period_file)
+
+    assert simulator.runs == 1
+    assert simulator.get_runstate() == "SETUP"
+    assert simulator.get_number_periods() == 3
+    assert simulator.counting_seconds == pytest.approx(30)
+    with open(period_file) as saved:
+        periods = json.load(saved)
+    assert periods["run"] == "00000001"
+    assert [period["period"] for period in periods["periods"]] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("choice", ["A", "E", "K"])
+def test_ctrl_c_between_periods_keeps_the_periods_counted(simulator, sample, monkeypatch, choice):
+    waitfor_move = simulator.waitfor_move
+    interrupted = []
+
+    def _waitfor_move(*blocks, **kwargs):
+        if simulator.get_runstate() == "PAUSED" and not interrupted:
+            interrupted.append(True)
+            raise KeyboardInterrupt()
+        waitfor_move(*blocks, **kwargs)
+    monkeypatch.setattr(simulator, "waitfor_move", _waitfor_move)
+    monkeypatch.setattr(base, "input", lambda prompt: choice)
+    plan = ScanPlan()
+    plan.add_angle(sample, 0.5, count_seconds=10, mode="NR")
+    plan.add_transmission(sample, "Direct beam", 0.1, 0.2, count_seconds=10)
+
+    with pytest.raises(KeyboardInterrupt):
+        plan.run(multi_period=True)
+    assert simulator.get_runstate() == "SETUP"
+    assert simulator.get_runnumber() == "00000002"
+    assert simulator.counting_seconds == pytest.approx(10)
+
+
+def test_counts_are_paused_between_periods(simulator):
+    simulator.change_number_soft_periods(2)
+    period_run = MultiPeriodRun(2)
+
+    period_run.count(None, 10, None)
+    assert simulator.get_runstate() == "PAUSED"
+    assert simulator.get_period() == 1
+
+    period_run.count(None, 10, None)
+    assert simulator.get_period() == 2
+    period_run.end()
+    assert simulator.runs == 1
+    assert simulator.get_runstate() == "SETUP"
+
+
+def test_a_period_can_be_counted_into_again(simulator):
+    simulator.change_number_soft_periods(2)
+    period_run = MultiPeriodRun(2)
+    for period in (1, 2, 1):
+        period_run.count(None, 10, None, period=period)
+    period_run.end()
+
+    assert [record.period for record in period_run.records] == [1, 2, 1]
+    assert period_run.periods_counted() == 2
+    assert period_run.next_period == 3
+
+
+def test_spectra_are_read_from_the_period_being_counted(simulator):
+    simulator.change_number_soft_periods(2)
+    period_run = MultiPeriodRun(2)
+    target = CountTarget(total_counts=500, max_seconds=60, reader=SpectraCountReader(range(1, 11)))
+
+    period_run.count(None, None, None, count_target=target)
+    period_run.count(None, None, None, count_target=target)
+    period_run.end()
+
+    assert simulator.period_seconds[2] == pytest.approx(simulator.period_seconds[1])
+    assert simulator.period_seconds[2] < 60
+
+
+def test_abort_before_a_period_is_counted_saves_nothing(simulator):
+    period_run = MultiPeriodRun(2)
+    simulator.begin()
+    period_run.started = True
+
+    period_run.abort()
+
+    assert simulator.get_runnumber() == "00000001"
+    assert not period_run.saved
+
+
+def test_counting_past_the_last_period_fails_before_counting(simulator):
+    period_run = MultiPeriodRun(1)
+    period_run.count(None, 10, None)
+
+    with pytest.raises(ValueError):
+        period_run.count(None, 10, None)
+    assert simulator.counting_seconds == pytest.approx(10)
+    period_run.end()
+
+
+def test_dry_run_does_not_begin_a_run(simulator):
+    period_run = MultiPeriodRun(2, dry_run=True)
+    period_run.count(5, None, None)
+    period_run.end()
+
+    assert simulator.runs == 0
+    assert period_run.run_number is None
@@ -0,0 +1,34 @@
+"""
+Tests of planning the angles for a Q range
+"""
+import pytest
+
+from techniques.reflectometry.q_planner import plan_q_range
+
+
+@pytest.mark.parametrize("q_max", [0.3, 0.5])
+def test_top_angle_ends_at_q_max(simulator, sample, q_max):
+    plan = plan_q_range(0.01, q_max, 3 * 3600, sample)
+
+    assert plan.angles[-1].q_max == pytest.approx(q_max, abs=1e-3)
+    assert plan.angles[-2].q_max < q_max
+
+
+def test_angles_cover_the_q_range_with_overlap(simulator, sample):
+    plan = plan_q_range(0.01, 0.3, 3 * 3600, sample)
+
+    assert plan.angles[0].q_min <= 0.01
+    for lower, upper in zip(plan.angles, plan.angles[1:]):
+        assert upper.q_min < lower.q_max
+
+
+def test_count_time_is_shared_by_the_capped_angles(simulator, sample):
+    plan = plan_q_range(0.01, 0.5, 3 * 3600, sample)
+    bottom, top = plan.angles[0], plan.angles[-1]
+
+    assert top.count_seconds / bottom.count_seconds == pytest.approx((top.angle / bottom.angle) ** 2)
+
+
+def test_q_max_above_the_maximum_theta_is_refused(simulator, sample):
+    with pytest.raises(ValueError):
+        plan_q_range(0.01, 0.6, 3 * 3600, sample)
@@ -0,0 +1,28 @@
+"""
+Tests of running scan plans
+"""
+import pytest
+
+from techniques.reflectometry.scan_plan import ScanPlan
+from techniques.reflectometry.setpoint_limits import SetpointLimitError
+
+
+def test_steps_after_a_mode_change_use_the_constants_of_the_new_mode(simulator, sample, constant_for_mode):
+    constant_for_mode("LIQUID", "NATURAL_ANGLE", 2.5)
+    plan = ScanPlan()
+    plan.add_angle(sample, 0.5, count_seconds=10, mode="LIQUID")
+    plan.add_angle(sample, 0.7, count_seconds=10, mode="LIQUID")
+
+    plan.run(preflight=False)
+
+    assert simulator.cget("SM2ANGLE")["value"] == pytest.approx((2.5 - 0.7) / 2)
+
+
+def test_limits_are_checked_without_preflight(simulator, sample, block_limits):
+    block_limits({"THETA": (0.0, 0.5)})
+    plan = ScanPlan()
+    plan.add_angle(sample, 0.7, count_seconds=10, mode="NR")
+
+    with pytest.raises(SetpointLimitError):
+        plan.run(preflight=False)
+    assert simulator.runs == 0
@@ -0,0 +1,34 @@
+"""
+Tests of checking setpoints against their limits before moving
+"""
+import pytest
+
+from techniques.reflectometry.base import run_angle
+from techniques.reflectometry.instrument_constants import get_instrument_constants
+from techniques.reflectometry.setpoint_limits import SetpointLimitError
+
+
+def test_setpoint_outside_its_limits_moves_nothing(simulator, sample, block_limits):
+    block_limits({"THETA": (0.0, 0.5)})
+
+    with pytest.raises(SetpointLimitError):
+        run_angle(sample, 0.7, count_uamps=5, mode="NR")
+    assert simulator.set_blocks == []
+    assert simulator.runs == 0
+
+
+def test_dry_run_only_reports_setpoints_outside_their_limits(simulator, sample, block_limits, capsys):
+    block_limits({"THETA": (0.0, 0.5)})
+
+    run_angle(sample, 0.7, count_uamps=5, mode="NR", dry_run=True)
+
+    assert "THETA=0.7: outside range 0.0 to 0.5" in capsys.readouterr().err
+
+
+def test_constants_are_read_again_once_the_mode_is_written(simulator, sample, constant_for_mode):
+    get_instrument_constants()
+    constant_for_mode("LIQUID", "MAX_THETA", 9.9)
+
+    run_angle(sample, 0.5, mode="LIQUID")
+
+    assert get_instrument_constants().max_theta == 9.9
@@ -0,0 +1,32 @@
+"""
+Tests of the simulated genie backend
+"""
+import pytest
+
+from techniques.reflectometry.base import run_angle
+
+
+def test_run_angle_counts_one_run_and_moves_the_blocks(simulator, sample):
+    run_angle(sample, 0.7, count_uamps=5, mode="NR")
+
+    assert simulator.runs == 1
+    assert simulator.get_runstate() == "SETUP"
+    assert simulator.cget("THETA")["value"] == pytest.approx(0.7)
+    assert simulator.counting_seconds > 0
+
+
+def test_run_number_is_the_next_run_in_setup_and_kept_by_abort(simulator):
+    assert simulator.get_runnumber() == "00000001"
+    simulator.begin()
+    simulator.abort()
+    assert simulator.get_runnumber() == "00000001"
+    simulator.begin()
+    simulator.end()
+    assert simulator.get_runnumber() == "00000002"
+
+
+def test_setting_an_unknown_block_sets_nothing(simulator):
+    with pytest.raises(ValueError):
+        simulator.cset(THETA=1.0, NOT_A_BLOCK=2.0)
+
+    assert simulator.cget("THETA")["value"] == 0.0
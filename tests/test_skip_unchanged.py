@@ -0,0 +1,34 @@
+"""
+Tests of skipping moves to setpoints a block already has
+"""
+from techniques.reflectometry.base import _Movement, run_angle
+
+
+def test_blocks_already_at_their_setpoints_are_not_set_again(simulator, sample):
+    run_angle(sample, 0.7, count_uamps=5, mode="NR")
+    del simulator.set_blocks[:]
+
+    run_angle(sample, 0.7, count_uamps=5, mode="NR")
+
+    assert "THETA" not in simulator.set_blocks
+    assert "S1VG" not in simulator.set_blocks
+
+
+def test_blocks_are_set_again_after_a_mode_change(simulator, sample):
+    run_angle(sample, 0.7, count_uamps=5, mode="NR")
+    del simulator.set_blocks[:]
+
+    run_angle(sample, 0.7, count_uamps=5, mode="PNR")
+
+    assert simulator.set_blocks[0] == "MODE"
+    assert "THETA" in simulator.set_blocks
+    assert "S1VG" in simulator.set_blocks
+
+
+def test_mode_change_forgets_the_other_setpoints(simulator):
+    movement = _Movement(False, skip_unchanged=True)
+    movement.seed_setpoints()
+
+    movement.change_to_mode_if_not_none("PNR")
+
+    assert list(movement.setpoints) == ["MODE"]
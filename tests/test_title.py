@@ -0,0 +1,18 @@
+"""
+Tests of the run title
+"""
+from techniques.reflectometry.base import run_angle
+
+
+def test_title_records_the_gaps_read_back_after_the_move(simulator, sample, monkeypatch):
+    cset = simulator.cset
+
+    def _stalled_s1vg(block=None, value=None, *args, **pars):
+        pars.pop("S1VG", None)  # slit 1 does not move
+        if block != "S1VG":
+            cset(block, value, *args, **pars)
+    monkeypatch.setattr(simulator, "cset", _stalled_s1vg)
+
+    run_angle(sample, 0.7, count_seconds=10, mode="NR")
+
+    assert "VGs (1 0.466" in simulator.get_title()
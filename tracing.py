@@ -0,0 +1,214 @@
+"""
+Lightweight timing of where the time goes in a script; spans are only recorded when tracing is enabled
+"""
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Span(object):
+    """
+    A timed operation
+    """
+    __slots__ = ("name", "block", "value", "step", "depth", "start", "duration")
+
+    def __init__(self, name, block, value, step, depth, start):
+        """
+        Initialiser.
+        Args:
+            name: name of the operation, e.g. the method name
+            block: block the operation acts on; None if it is not for a single block
+            value: value the operation sets or the arguments it was called with
+            step: label of the step the operation is part of; None if not in a step
+            depth: number of spans this span is nested in
+            start: time the operation started
+        """
+        self.name = name
+        self.block = block
+        self.value = value
+        self.step = step
+        self.depth = depth
+        self.start = start
+        self.duration = None
+
+    def as_dict(self):
+        """
+        Returns: the span as a dictionary
+        """
+        return OrderedDict((name, getattr(self, name)) for name in Span.__slots__)
+
+    def __repr__(self):
+        return "Span: {}".format(dict(self.as_dict()))
+
+
+class Tracer(object):
+    """
+    Records spans and summarises them
+    """
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._step = None
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, block=None, value=None):
+        """
+        Time the code in the context as a span; nothing is recorded if tracing is disabled
+        Args:
+            name: name of the operation
+            block: block the operation acts on
+            value: value the operation sets
+        """
+        if not self.enabled:
+            yield
+            return
+        depth = getattr(self._local, "depth", 0)
+        span = Span(name, block, value, self._step, depth, time.time())
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            span.duration = time.time() - span.start
+            self._local.depth = depth
+            self.spans.append(span)
+
+    @contextmanager
+    def step(self, label):
+        """
+        Label all spans in the context as part of a step, and time the whole step as a span named "step"
+        Args:
+            label: label for the step
+        """
+        previous_step = self._step
+        self._step = label
+        try:
+            with self.span("step", value=label):
+                yield
+        finally:
+            self._step = previous_step
+
+    def current_step(self):
+        """
+        Returns: label of the step being run; None if not in a step
+        """
+        return self._step
+
+    def clear(self):
+        """
+        Throw away all recorded spans
+        """
+        self.spans = []
+
+    def totals(self, by="name"):
+        """
+        Aggregate the spans
+        Args:
+            by: "name" to aggregate by operation; "step" to aggregate whole steps by step label
+
+        Returns: ordered dictionary of key to (count, total seconds, maximum seconds), largest total first
+        """
+        totals = {}
+        for span in self.spans:
+            if by == "step":
+                if span.name != "step":
+                    continue
+                key = span.value
+            else:
+                if span.name == "step":
+                    continue
+                key = span.name
+            count, total, maximum = totals.get(key, (0, 0.0, 0.0))
+            totals[key] = (count + 1, total + span.duration, max(maximum, span.duration))
+        return OrderedDict(sorted(totals.items(), key=lambda item: item[1][1], reverse=True))
+
+    def summary(self, by="name"):
+        """
+        Args:
+            by: "name" to summarise by operation; "step" to summarise by step
+
+        Returns: table of the count, total, mean and maximum time for each operation or step
+        """
+        lines = ["{:<40} {:>7} {:>10} {:>10} {:>10}".format(by, "count", "total s", "mean s", "max s")]
+        for key, (count, total, maximum) in self.totals(by).items():
+            lines.append("{:<40} {:>7} {:>10.3f} {:>10.3f} {:>10.3f}".format(str(key)[:40], count, total,
+                                                                             total / count, maximum))
+        return "\n".join(lines)
+
+    def dump_json_lines(self, filename):
+        """
+        Write the spans to a file as one json object per line
+        Args:
+            filename: name of the file to write to
+        """
+        with open(filename, "w") as spans_file:
+            for span in self.spans:
+                spans_file.write(json.dumps(span.as_dict(), default=str))
+                spans_file.write("\n")
+
+
+TRACER = Tracer()
+
+
+def enable_tracing(clear=True):
+    """
+    Start recording spans
+    Args:
+        clear: True to throw away previously recorded spans
+    """
+    if clear:
+        TRACER.clear()
+    TRACER.enabled = True
+
+
+def disable_tracing():
+    """
+    Stop recording spans; recorded spans are kept
+    """
+    TRACER.enabled = False
+
+
+def traced(name=None, is_method=False):
+    """
+    Decorator which records each call of a function as a span, with its arguments as the value. When tracing is
+    disabled the only overhead is checking whether it is enabled.
+    Args:
+        name: name for the span; None for the function name
+        is_method: True if the function is a method so its first argument is not included in the value
+    """
+    def _decorator(function):
+        span_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def _wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(span_name, value=_describe_arguments(args[1:] if is_method else args, kwargs)):
+                return function(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+def traced_methods(exclude=()):
+    """
+    Class decorator which traces all the public methods of a class
+    Args:
+        exclude: names of methods not to trace, e.g. context managers
+    """
+    def _decorator(cls):
+        for attribute_name, attribute in list(vars(cls).items()):
+            if callable(attribute) and not attribute_name.startswith("_") and attribute_name not in exclude:
+                setattr(cls, attribute_name, traced("{}.{}".format(cls.__name__, attribute_name), True)(attribute))
+        return cls
+    return _decorator
+
+
+def _describe_arguments(args, kwargs):
+    """
+    Returns: short description of arguments
+    """
+    arguments = [repr(arg) for arg in args] + ["{}={!r}".format(key, value) for key, value in kwargs.items()]
+    return ", ".join(arguments)
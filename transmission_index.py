@@ -0,0 +1,249 @@
+"""
+Index of transmission runs by beamline configuration, so that a transmission which has already been measured with the
+same slits, super mirror and mode can be reused rather than measured again
+"""
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+from .base import _Movement, transmission
+from .block_snapshot import HORIZONTAL_GAP_BLOCKS
+from .instrument_constants import get_instrument_constants
+from .move_time import get_move_time_model, format_seconds
+
+# Time in seconds a transmission run can be reused for
+DEFAULT_TRANSMISSION_EXPIRY = 24 * 3600.0
+
+# Number of decimal places values are rounded to when comparing configurations
+CONFIGURATION_DECIMALS = 4
+
+TransmissionRecord = namedtuple("TransmissionRecord", ["key", "configuration", "run", "counts", "time"])
+TransmissionRecord.__doc__ = """
+A measured transmission: the key of its configuration, the configuration (dictionary of setting to value), the run
+number, the counts (dictionary of count type to amount) and the time it was measured
+"""
+
+
+class TransmissionIndex(object):
+    """
+    Transmission runs indexed by configuration; records can be kept in memory or appended to a file, one compact json
+    object per line, so that they are shared between scripts
+    """
+    def __init__(self, filename=None, expiry=DEFAULT_TRANSMISSION_EXPIRY):
+        """
+        Initialiser.
+        Args:
+            filename: file to keep the records in; None to keep them in memory only
+            expiry: time in seconds a run can be reused for; None for never expire
+        """
+        self.filename = filename
+        self.expiry = expiry
+        self.reused = 0
+        self.saved_seconds = 0.0
+        self._records = []
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as index_file:
+                for line in index_file:
+                    try:
+                        self._records.append(TransmissionRecord(**json.loads(line)))
+                    except (ValueError, TypeError):
+                        continue
+
+    def find(self, configuration, counts):
+        """
+        Find an unexpired run with the configuration which counted at least as much as requested
+        Args:
+            configuration: dictionary of setting to value, see transmission_configuration
+            counts: dictionary of count type to amount requested
+
+        Returns:
+            TransmissionRecord: the most recent matching record; None if there is none
+        """
+        key = configuration_key(configuration)
+        now = time.time()
+        for record in reversed(self._records):
+            if record.key != key or record.run is None:
+                continue
+            if self.expiry is not None and now - record.time > self.expiry:
+                continue
+            if _covers(record.counts, counts):
+                return record
+        return None
+
+    def record(self, configuration, run, counts):
+        """
+        Record a transmission run
+        Args:
+            configuration: dictionary of setting to value
+            run: run number
+            counts: dictionary of count type to amount
+
+        Returns:
+            TransmissionRecord: the record
+        """
+        record = TransmissionRecord(configuration_key(configuration), configuration, run,
+                                    OrderedDict((name, _as_json(value)) for name, value in counts.items()), time.time())
+        self._records.append(record)
+        if self.filename is not None:
+            with open(self.filename, "a") as index_file:
+                index_file.write(json.dumps(record._asdict(), separators=(",", ":"), default=str) + "\n")
+                index_file.flush()
+                os.fsync(index_file.fileno())
+        return record
+
+    def records(self):
+        """
+        Returns:
+            list[TransmissionRecord]: all the records in the order they were made
+        """
+        return list(self._records)
+
+    def report(self):
+        """
+        Returns: how many transmissions were reused and the counting time saved
+        """
+        return "Transmissions reused {}, counting time saved {}".format(self.reused, format_seconds(self.saved_seconds))
+
+    def __repr__(self):
+        return "Transmission index: {} records, expiry {} s, file {}".format(
+            len(self._records), self.expiry, self.filename)
+
+
+_TRANSMISSION_INDEX = TransmissionIndex()
+
+
+def get_transmission_index():
+    """
+    Returns:
+        TransmissionIndex: the index used when no index is given
+    """
+    return _TRANSMISSION_INDEX
+
+
+def set_transmission_index(index):
+    """
+    Set the index used when no index is given
+    Args:
+        index (TransmissionIndex|str): the index, or the name of a file to keep it in
+    """
+    global _TRANSMISSION_INDEX
+    if not isinstance(index, TransmissionIndex):
+        index = TransmissionIndex(index)
+    _TRANSMISSION_INDEX = index
+
+
+def transmission_configuration(s1vg, s2vg, s3vg=None, s4vg=None, s1hg=None, s2hg=None, s3hg=None, s4hg=None,
+                               height_offset=5, smangle=None, mode=None, constants=None, dry_run=False):
+    """
+    The full beamline configuration a transmission would be measured in. Settings which transmission would leave
+    unchanged (None) are read from the instrument, and s3 and s4 default to their maximums as in transmission.
+    Args:
+        as for transmission
+        constants (techniques.reflectometry.instrument_constants.InstrumentConstant): instrument constants; None to
+            read them
+        dry_run: If True nothing is read from the instrument and settings which would be read are left as None
+
+    Returns: ordered dictionary of setting to value
+    """
+    constants = constants if constants is not None else get_instrument_constants()
+    blocks = ("MODE", "SM2ANGLE", "SM2INBEAM") + HORIZONTAL_GAP_BLOCKS
+    current = {} if dry_run else _Movement(True).take_snapshot(blocks)
+    if smangle is None:
+        smangle = 0.0 if current.get("SM2INBEAM") == "OUT" else current.get("SM2ANGLE")
+    horizontal_gaps = [current.get(block) if gap is None else gap
+                       for block, gap in zip(HORIZONTAL_GAP_BLOCKS, (s1hg, s2hg, s3hg, s4hg))]
+    configuration = OrderedDict([
+        ("mode", current.get("MODE") if mode is None else mode),
+        ("smangle", smangle),
+        ("s1vg", s1vg), ("s2vg", s2vg),
+        ("s3vg", constants.s3max if s3vg is None else s3vg), ("s4vg", constants.s4max if s4vg is None else s4vg),
+        ("height_offset", height_offset),
+    ])
+    configuration.update((block.lower(), gap) for block, gap in zip(HORIZONTAL_GAP_BLOCKS, horizontal_gaps))
+    return OrderedDict((name, _rounded(value)) for name, value in configuration.items())
+
+
+def configuration_key(configuration):
+    """
+    Returns: key which is the same for configurations with the same settings
+    """
+    return json.dumps(sorted(configuration.items()), separators=(",", ":"), default=str)
+
+
+def transmission_once(sample, title, s1vg, s2vg, index=None, dry_run=False, **kwargs):
+    """
+    Measure a transmission unless one has already been measured, within the index's expiry, with the same
+    configuration and at least the same counts; in that case the earlier run is reused and nothing moves. A dry run
+    reads nothing from the instrument, so a run is only found if every setting of the configuration is given.
+    Args:
+        sample (techniques.reflectometry.sample.Sample): The sample to measure
+        title: Title to set
+        s1vg: slit 1 vertical gap
+        s2vg: slit 2 vertical gap
+        index (TransmissionIndex): index to look in and record the run in; None for the current index
+        dry_run: If True just print what would happen; If False, run the transmission if it is needed
+        kwargs: other arguments as for transmission
+
+    Examples:
+        >>> for sample in samples:
+        >>>     transmission_once(sample, "Direct beam", 0.1, 0.2, count_uamps=20, mode="NR")
+        The direct beam is measured for the first sample and reused for the others.
+
+    Returns: run number of the transmission, whether it was measured now or earlier; None in a dry run
+    """
+    index = index if index is not None else get_transmission_index()
+    configuration = transmission_configuration(s1vg, s2vg, dry_run=dry_run, **{
+        name: value for name, value in kwargs.items() if name in (
+            "s3vg", "s4vg", "s1hg", "s2hg", "s3hg", "s4hg", "height_offset", "smangle", "mode")})
+    counts = OrderedDict((name, kwargs[name]) for name in (
+        "count_target", "count_uamps", "count_seconds", "count_frames") if kwargs.get(name) is not None)
+    existing = index.find(configuration, counts)
+    if existing is not None:
+        saved_seconds = get_move_time_model().count_time(*[kwargs.get(name) for name in (
+            "count_uamps", "count_seconds", "count_frames", "count_target")])
+        print("** Transmission {} already measured in run {}, reusing it (saves {}) **".format(
+            title, existing.run, format_seconds(saved_seconds)))
+        if dry_run:
+            return None
+        index.reused += 1
+        index.saved_seconds += saved_seconds
+        return existing.run
+
+    run = transmission(sample, title, s1vg, s2vg, dry_run=dry_run, **kwargs)
+    if run is not None and counts:
+        index.record(configuration, run, counts)
+    return run
+
+
+def _covers(recorded_counts, requested_counts):
+    """
+    Returns: True if the recorded counts are of the same type and at least as much as the requested counts
+    """
+    if not requested_counts or list(recorded_counts) != list(requested_counts):
+        return False
+    for name, requested in requested_counts.items():
+        recorded = recorded_counts[name]
+        if name == "count_target":
+            if recorded != _as_json(requested):
+                return False
+        elif recorded < requested:
+            return False
+    return True
+
+
+def _as_json(value):
+    """
+    Returns: the value if json can store it; otherwise its description
+    """
+    return value if value is None or isinstance(value, (int, float, str)) else repr(value)
+
+
+def _rounded(value):
+    """
+    Returns: the value rounded for comparison if it is a number
+    """
+    try:
+        return round(float(value), CONFIGURATION_DECIMALS)
+    except (TypeError, ValueError):
+        return value